@@ -2,10 +2,15 @@
 from .messaging_pyx import Context, Poller, SubSocket, PubSocket  # pylint: disable=no-name-in-module, import-error
 from .messaging_pyx import MultiplePublishersError, MessagingError  # pylint: disable=no-name-in-module, import-error
 import os
+import time
 import capnp
+import bisect
+import struct
+import numpy as np
 
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Tuple
 from collections import deque
+from collections.abc import Mapping
 
 from cereal import log
 from cereal.services import service_list
@@ -17,11 +22,15 @@ NO_TRAVERSAL_LIMIT = 2**64-1
 AVG_FREQ_HISTORY = 100
 SIMULATION = "SIMULATION" in os.environ
 
+# opt-in instrumentation, names of the processes publishing messagingStats. See init_stats
+MESSAGING_STATS = os.getenv("MESSAGING_STATS", "")
+STATS_PERIOD = 1.  # seconds
+LAG_BUCKETS_MS = [1., 2., 5., 10., 20., 50., 100., 200., 500., 1000.]
+
 # sec_since_boot is faster, but allow to run standalone too
 try:
   from common.realtime import sec_since_boot
 except ImportError:
-  import time
   sec_since_boot = time.time
   print("Warning, using python time.time() instead of faster sec_since_boot")
 
@@ -30,6 +39,37 @@ context = Context()
 def log_from_bytes(dat: bytes) -> capnp.lib.capnp._DynamicStructReader:
   return log.Event.from_bytes(dat, traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
 
+# Location of the Event fields read by log_header_from_bytes in the data section of the serialized struct
+_EVENT_SCHEMA = log.Event.schema
+_WHICH_OFFSET = _EVENT_SCHEMA.node.struct.discriminantOffset * 2  # bytes
+_LOG_MONO_TIME_OFFSET = _EVENT_SCHEMA.fields['logMonoTime'].proto.slot.offset * 8  # bytes
+_VALID_OFFSET = _EVENT_SCHEMA.fields['valid'].proto.slot.offset  # bits, stored inverted as it defaults to true
+_EVENT_WHICH = {_EVENT_SCHEMA.fields[f].proto.discriminantValue: f for f in _EVENT_SCHEMA.union_fields}
+
+def log_header_from_bytes(dat: bytes) -> Optional[Tuple[str, int, bool]]:
+  """Reads which(), logMonoTime and valid of a serialized Event without decoding it.
+  Returns None if they can not be read directly, in which case the message has to be decoded."""
+  try:
+    # segment table, then the root struct pointer
+    segment_count = struct.unpack_from('<I', dat)[0] + 1
+    root = (4 + 4 * segment_count + 7) // 8 * 8
+    ptr, data_words, _ = struct.unpack_from('<iHH', dat, root)
+  except struct.error:
+    return None
+  if ptr & 3 != 0:  # far pointer, the struct is on another segment
+    return None
+
+  data = root + 8 + (ptr >> 2) * 8
+  data_size = data_words * 8
+  if data + data_size > len(dat):
+    return None
+
+  which = struct.unpack_from('<H', dat, data + _WHICH_OFFSET)[0] if _WHICH_OFFSET + 2 <= data_size else 0
+  log_mono_time = struct.unpack_from('<Q', dat, data + _LOG_MONO_TIME_OFFSET)[0] \
+    if _LOG_MONO_TIME_OFFSET + 8 <= data_size else 0
+  valid = not (dat[data + _VALID_OFFSET // 8] >> (_VALID_OFFSET % 8)) & 1 if _VALID_OFFSET // 8 < data_size else True
+  return _EVENT_WHICH.get(which), log_mono_time, valid
+
 def new_message(service: Optional[str] = None, size: Optional[int] = None) -> capnp.lib.capnp._DynamicStructBuilder:
   dat = log.Event.new_message()
   dat.logMonoTime = int(sec_since_boot() * 1e9)
@@ -133,6 +173,167 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
     if dat is not None:
       return log_from_bytes(dat)
 
+class MessagePool():
+  """Reuses the message builder of each service between sends, for publishers writing the same fields every cycle.
+
+  new_message returns the builder of the previous send with a new logMonoTime and valid set, so the fields not written
+  again keep their previous value. Lists are reused while their size doesn't change. Scalars, list elements and nested
+  structs are written in place, but setting a text, list or struct field leaves the old value as unused space in the
+  message: to_bytes detects it and sends a compacted copy, which also replaces the builder, so those should only be
+  written when they change. The builders returned before are not valid after the next new_message.
+  """
+  def __init__(self):
+    self.msgs = {}
+    self.compactions = 0
+
+  def new_message(self, service: str, size: Optional[int] = None) -> capnp.lib.capnp._DynamicStructBuilder:
+    dat = self.msgs.get(service)
+    if dat is None or (size is not None and len(getattr(dat, service)) != size):
+      dat = self.msgs[service] = new_message(service, size)
+    else:
+      dat.logMonoTime = int(sec_since_boot() * 1e9)
+      dat.valid = True
+    return dat
+
+  def to_bytes(self, dat: capnp.lib.capnp._DynamicStructBuilder) -> bytes:
+    ret = dat.to_bytes()
+    dat.clear_write_flag()
+
+    # a single segment message without unused space is the segment table, the root pointer and the content
+    words = dat.total_size.word_count
+    if len(ret) != 8 * (words + 2):
+      self.compactions += 1
+      dat = self.msgs[dat.which()] = dat.as_reader().as_builder(num_first_segment_words=words + 1)
+      ret = dat.to_bytes()
+      dat.clear_write_flag()
+    return ret
+
+class _ServiceStats():
+  __slots__ = ('published', 'msg_count', 'dropped_count', 'bytes', 'lag_histogram', 'lag_sum', 'lag_max',
+               'codec_count', 'codec_sum', 'codec_max', 'last_log_mono_time')
+
+  def __init__(self, published: bool):
+    self.published = published
+    self.msg_count = 0
+    self.dropped_count = 0
+    self.bytes = 0
+    self.lag_histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+    self.lag_sum = 0.
+    self.lag_max = 0.
+    self.codec_count = 0
+    self.codec_sum = 0.
+    self.codec_max = 0.
+    self.last_log_mono_time = 0
+
+class MessagingStats():
+  """Per service stats of the messages received by the SubMasters and sent by the PubMasters of a process:
+  lag from publish (logMonoTime) to reception, estimated dropped messages, bytes per second and decode/encode time.
+  Published every STATS_PERIOD seconds on messagingStats, see selfdrive/debug/messaging_stats.py to view them.
+  """
+  def __init__(self, process_name: str, period: float = STATS_PERIOD):
+    self.process_name = process_name
+    self.period = period
+    self.services = {}
+    self.start_time = None
+    self.sock = None
+    self.publish_enabled = True
+
+  def _service(self, s: str, published: bool) -> _ServiceStats:
+    key = (s, published)
+    stats = self.services.get(key)
+    if stats is None:
+      stats = self.services[key] = _ServiceStats(published)
+    return stats
+
+  def record_receive(self, s: str, cur_time: float, log_mono_time: int, size: int) -> None:
+    stats = self._service(s, False)
+    stats.msg_count += 1
+    stats.bytes += size
+
+    lag = cur_time * 1e3 - log_mono_time * 1e-6
+    stats.lag_histogram[bisect.bisect_left(LAG_BUCKETS_MS, lag)] += 1
+    stats.lag_sum += lag
+    stats.lag_max = max(stats.lag_max, lag)
+
+    # messages are conflated, so the ones published between two received are lost
+    freq = service_list[s].frequency
+    if stats.last_log_mono_time > 0 and freq > 1e-5:
+      stats.dropped_count += max(round((log_mono_time - stats.last_log_mono_time) * 1e-9 * freq) - 1, 0)
+    stats.last_log_mono_time = log_mono_time
+
+  def record_send(self, s: str, size: int, encode_time: float) -> None:
+    stats = self._service(s, True)
+    stats.msg_count += 1
+    stats.bytes += size
+    self._record_codec(stats, encode_time)
+
+  def record_decode(self, s: str, decode_time: float) -> None:
+    self._record_codec(self._service(s, False), decode_time)
+
+  @staticmethod
+  def _record_codec(stats: _ServiceStats, t: float) -> None:
+    stats.codec_count += 1
+    stats.codec_sum += t
+    stats.codec_max = max(stats.codec_max, t)
+
+  def to_message(self, cur_time: float) -> capnp.lib.capnp._DynamicStructBuilder:
+    period = max(cur_time - self.start_time, 1e-9)
+    dat = new_message('messagingStats')
+    dat.messagingStats.processName = self.process_name
+    dat.messagingStats.periodSec = period
+    dat.messagingStats.lagBucketsMs = LAG_BUCKETS_MS
+    services = dat.messagingStats.init('services', len(self.services))
+    for out, ((s, published), stats) in zip(services, sorted(self.services.items())):
+      out.name = s
+      out.published = published
+      out.msgCount = stats.msg_count
+      out.droppedCount = stats.dropped_count
+      out.bytesPerSec = stats.bytes / period
+      out.lagHistogram = stats.lag_histogram
+      out.lagMeanMs = stats.lag_sum / max(stats.msg_count, 1) if not published else 0.
+      out.lagMaxMs = stats.lag_max
+      out.codecMeanUs = stats.codec_sum / max(stats.codec_count, 1) * 1e6
+      out.codecMaxUs = stats.codec_max * 1e6
+    return dat
+
+  def reset(self, cur_time: float) -> None:
+    # the time of the last message is kept to count dropped messages across periods
+    last_log_mono_time = {key: stats.last_log_mono_time for key, stats in self.services.items()}
+    self.services = {}
+    for key, t in last_log_mono_time.items():
+      self._service(*key).last_log_mono_time = t
+    self.start_time = cur_time
+
+  def maybe_publish(self, cur_time: float) -> None:
+    if self.start_time is None:
+      self.start_time = cur_time
+    if cur_time - self.start_time < self.period:
+      return
+
+    if self.publish_enabled:
+      try:
+        if self.sock is None:
+          self.sock = pub_sock('messagingStats')
+        self.sock.send(self.to_message(cur_time).to_bytes())
+      except MultiplePublishersError:
+        print("Warning, messagingStats is published by another process, not publishing messaging stats")
+        self.publish_enabled = False
+    self.reset(cur_time)
+
+_stats: Optional[MessagingStats] = None
+
+def init_stats(process_name: str) -> Optional[MessagingStats]:
+  """Enables the messaging instrumentation if the process is listed on MESSAGING_STATS (comma separated, by module
+  name or its last component, e.g. MESSAGING_STATS=controlsd). Only one process can publish the stats at a time."""
+  global _stats
+  names = [n.strip() for n in MESSAGING_STATS.split(",") if n.strip()]
+  if process_name in names or process_name.split(".")[-1] in names:
+    _stats = MessagingStats(process_name)
+  return _stats
+
+def get_stats() -> Optional[MessagingStats]:
+  return _stats
+
 class SubMaster():
   def __init__(self, services: List[str], poll: Optional[List[str]] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
@@ -175,6 +376,10 @@ class SubMaster():
     return self.data[s]
 
   def update(self, timeout: int = 1000) -> None:
+    if _stats is not None:
+      self._update_with_stats(_stats, timeout)
+      return
+
     msgs = []
     for sock in self.poller.poll(timeout):
       msgs.append(recv_one_or_none(sock))
@@ -184,6 +389,25 @@ class SubMaster():
       msgs.append(recv_one_or_none(self.sock[s]))
     self.update_msgs(sec_since_boot(), msgs)
 
+  def _update_with_stats(self, stats: MessagingStats, timeout: int) -> None:
+    dats = [sock.receive(non_blocking=True) for sock in self.poller.poll(timeout)]
+    dats += [self.sock[s].receive(non_blocking=True) for s in self.non_polled_services]
+    cur_time = sec_since_boot()
+
+    msgs = []
+    for dat in dats:
+      if dat is None:
+        continue
+      t = time.perf_counter()
+      msg = log_from_bytes(dat)
+      s = msg.which()
+      stats.record_decode(s, time.perf_counter() - t)
+      stats.record_receive(s, cur_time, msg.logMonoTime, len(dat))
+      msgs.append(msg)
+
+    self.update_msgs(cur_time, msgs)
+    stats.maybe_publish(cur_time)
+
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
     self.frame += 1
     self.updated = dict.fromkeys(self.updated, False)
@@ -236,6 +460,188 @@ class SubMaster():
       service_list = self.alive.keys()
     return self.all_alive(service_list=service_list) and self.all_valid(service_list=service_list)
 
+class ServiceValues(Mapping):
+  """Read only view of a per service list (or array) as a mapping from service name to value"""
+  def __init__(self, index, values):
+    self._index = index
+    self._values = values
+
+  def __getitem__(self, s):
+    return self._values[self._index[s]]
+
+  def __iter__(self):
+    return iter(self._index)
+
+  def __len__(self):
+    return len(self._index)
+
+class _LazyData(Mapping):
+  def __init__(self, sm):
+    self._sm = sm
+
+  def __getitem__(self, s):
+    return self._sm[s]
+
+  def __iter__(self):
+    return iter(self._sm._index)
+
+  def __len__(self):
+    return len(self._sm._index)
+
+class LazySubMaster(SubMaster):
+  """SubMaster which keeps the received messages serialized and only decodes them when accessed with sm[service].
+  Which service, logMonoTime and valid are read straight from the message bytes. The state of the services is
+  kept in lists and arrays indexed by service, exposed by service name as read only mappings, and the average
+  receive interval is a rolling sum updated in constant time per message.
+  """
+  def __init__(self, services: List[str], poll: Optional[List[str]] = None,
+               ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
+               addr: str = "127.0.0.1"):
+    self.frame = -1
+    self._index = {s: i for i, s in enumerate(services)}
+    n = len(services)
+
+    self._updated = [False] * n
+    self._not_updated = [False] * n
+    self._rcv_frame = [0] * n
+    self._log_mono_time = [0] * n
+    self._valid = [False] * n
+    self._alive = [False] * n
+    self._raw = [b""] * n
+    self._data = [None] * n
+    self._rcv_time = np.zeros(n)
+
+    self.updated = ServiceValues(self._index, self._updated)
+    self.rcv_frame = ServiceValues(self._index, self._rcv_frame)
+    self.logMonoTime = ServiceValues(self._index, self._log_mono_time)
+    self.valid = ServiceValues(self._index, self._valid)
+    self.alive = ServiceValues(self._index, self._alive)
+    self.rcv_time = ServiceValues(self._index, self._rcv_time)
+    self.data = _LazyData(self)
+
+    self.sock = {}
+    self.poller = Poller()
+    self.non_polled_services = [s for s in services if poll is not None and
+                                len(poll) and s not in poll]
+    self.ignore_average_freq = [] if ignore_avg_freq is None else ignore_avg_freq
+    self.ignore_alive = [] if ignore_alive is None else ignore_alive
+    self.freq = {s: service_list[s].frequency for s in services}
+
+    # receive intervals of the last AVG_FREQ_HISTORY messages of each service, as a ring buffer and its sum
+    self._track_freq = [self.freq[s] > 1e-5 and s not in self.non_polled_services and
+                        s not in self.ignore_average_freq for s in services]
+    self._recv_dts = [[0.0] * AVG_FREQ_HISTORY for _ in services]
+    self._recv_dts_pos = [0] * n
+    self._recv_dts_sum = np.zeros(n)
+
+    # alive if delay is within 10x the expected frequency and average frequency is higher than 90% of it.
+    # services with a frequency of 0 are always alive
+    freq = np.array([self.freq[s] for s in services], dtype=np.float64)
+    self._no_freq = freq <= 1e-5
+    with np.errstate(divide='ignore'):
+      self._max_delay = np.where(self._no_freq, np.inf, 10. / freq)
+      self._max_recv_dts_sum = np.where(self._no_freq, np.inf, AVG_FREQ_HISTORY / (freq * 0.90))
+
+    for s in services:
+      if addr is not None:
+        p = self.poller if s not in self.non_polled_services else None
+        self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True)
+
+      try:
+        data = new_message(s)
+      except capnp.lib.capnp.KjException:  # pylint: disable=c-extension-no-member
+        data = new_message(s, 0) # lists
+
+      i = self._index[s]
+      self._data[i] = getattr(data, s)
+      self._valid[i] = data.valid
+
+  def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    i = self._index[s]
+    data = self._data[i]
+    if data is None:
+      t = time.perf_counter()
+      data = self._data[i] = getattr(log_from_bytes(self._raw[i]), s)
+      if _stats is not None:
+        _stats.record_decode(s, time.perf_counter() - t)
+    return data
+
+  def update(self, timeout: int = 1000) -> None:
+    msgs = [sock.receive(non_blocking=True) for sock in self.poller.poll(timeout)]
+
+    # non-blocking receive for non-polled sockets
+    for s in self.non_polled_services:
+      msgs.append(self.sock[s].receive(non_blocking=True))
+    self.update_raw_msgs(sec_since_boot(), msgs)
+
+  def update_raw_msgs(self, cur_time: float, msgs: List[Optional[bytes]]) -> None:
+    stats = _stats
+    self._start_frame()
+    for dat in msgs:
+      if dat is None:
+        continue
+
+      header = log_header_from_bytes(dat)
+      if header is None:
+        msg = log_from_bytes(dat)
+        s, log_mono_time = msg.which(), msg.logMonoTime
+        self._update_service(self._index[s], cur_time, log_mono_time, msg.valid, dat, getattr(msg, s))
+      else:
+        s, log_mono_time, valid = header
+        self._update_service(self._index[s], cur_time, log_mono_time, valid, dat, None)
+
+      if stats is not None:
+        stats.record_receive(s, cur_time, log_mono_time, len(dat))
+    self._update_alive(cur_time)
+
+    if stats is not None:
+      stats.maybe_publish(cur_time)
+
+  def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+    self._start_frame()
+    for msg in msgs:
+      if msg is None:
+        continue
+
+      s = msg.which()
+      self._update_service(self._index[s], cur_time, msg.logMonoTime, msg.valid, None, getattr(msg, s))
+    self._update_alive(cur_time)
+
+  def _start_frame(self) -> None:
+    self.frame += 1
+    self._updated[:] = self._not_updated
+
+  def _update_service(self, i, cur_time, log_mono_time, valid, raw, data) -> None:
+    rcv_time = self._rcv_time[i]
+    if rcv_time > 1e-5 and self._track_freq[i]:
+      dt = cur_time - rcv_time
+      recv_dts = self._recv_dts[i]
+      pos = self._recv_dts_pos[i]
+      self._recv_dts_sum[i] += dt - recv_dts[pos]
+      recv_dts[pos] = dt
+      pos += 1
+      if pos == AVG_FREQ_HISTORY:
+        # recompute the sum once per cycle of the ring buffer to not accumulate rounding errors
+        pos = 0
+        self._recv_dts_sum[i] = sum(recv_dts)
+      self._recv_dts_pos[i] = pos
+
+    self._updated[i] = True
+    self._rcv_time[i] = cur_time
+    self._rcv_frame[i] = self.frame
+    self._log_mono_time[i] = log_mono_time
+    self._valid[i] = valid
+    self._raw[i] = raw
+    self._data[i] = data
+
+    if SIMULATION:
+      self._alive[i] = True
+
+  def _update_alive(self, cur_time: float) -> None:
+    if not SIMULATION:
+      alive = ((cur_time - self._rcv_time) < self._max_delay) & (self._recv_dts_sum < self._max_recv_dts_sum)
+      self._alive[:] = (alive | self._no_freq).tolist()
+
 class PubMaster():
   def __init__(self, services: List[str]):
     self.sock = {}
@@ -243,9 +649,22 @@ class PubMaster():
       self.sock[s] = pub_sock(s)
 
   def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
+    if _stats is not None:
+      self._send_with_stats(_stats, s, dat)
+      return
+
+    if not isinstance(dat, bytes):
+      dat = dat.to_bytes()
+    self.sock[s].send(dat)
+
+  def _send_with_stats(self, stats: MessagingStats, s: str,
+                       dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
+    t = time.perf_counter()
     if not isinstance(dat, bytes):
       dat = dat.to_bytes()
+    stats.record_send(s, len(dat), time.perf_counter() - t)
     self.sock[s].send(dat)
+    stats.maybe_publish(sec_since_boot())
 
   def all_readers_updated(self, s: str) -> bool:
     return self.sock[s].all_readers_updated()
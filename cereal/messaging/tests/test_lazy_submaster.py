@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import cereal.messaging as messaging
+from cereal import log
+
+
+def make_msg(service, log_mono_time, valid=True, size=None):
+  msg = messaging.new_message(service, size)
+  msg.logMonoTime = log_mono_time
+  msg.valid = valid
+  return msg
+
+
+class TestLogHeader(unittest.TestCase):
+  def test_matches_decoded_message(self):
+    for service, size in [("carState", None), ("controlsState", None), ("deviceState", None), ("can", 3),
+                          ("sendcan", 0), ("liveTracks", 5), ("initData", None)]:
+      for valid in [True, False]:
+        msg = make_msg(service, random.randint(0, 2**63), valid, size)
+        dat = msg.to_bytes()
+        decoded = messaging.log_from_bytes(dat)
+        self.assertEqual(messaging.log_header_from_bytes(dat), (decoded.which(), decoded.logMonoTime, decoded.valid))
+
+  def test_defaults_not_written(self):
+    # a message built without logMonoTime and valid, the fields default to 0 and true
+    msg = log.Event.new_message()
+    msg.init("carState")
+    self.assertEqual(messaging.log_header_from_bytes(msg.to_bytes()), ("carState", 0, True))
+
+  def test_fallback(self):
+    # the root struct doesn't fit in the first segment, it is reached through a far pointer
+    msg = log.Event.new_message(num_first_segment_words=1)
+    msg.logMonoTime = 123
+    msg.init("carState")
+    self.assertGreater(len(msg.to_segments()), 1)
+    self.assertIsNone(messaging.log_header_from_bytes(msg.to_bytes()))
+
+    dat = make_msg("carState", 123).to_bytes()
+    self.assertIsNone(messaging.log_header_from_bytes(dat[:4]))
+    self.assertIsNone(messaging.log_header_from_bytes(dat[:20]))
+
+
+class TestLazySubMaster(unittest.TestCase):
+  SERVICES = ["carState", "controlsState", "liveCalibration", "modelV2", "deviceState"]
+
+  def assertSameState(self, sm, lazy_sm):
+    for s in self.SERVICES:
+      for attr in ["updated", "alive", "valid", "rcv_frame", "logMonoTime"]:
+        self.assertEqual(getattr(lazy_sm, attr)[s], getattr(sm, attr)[s], f"{attr} of {s} at frame {sm.frame}")
+      self.assertEqual(lazy_sm[s].to_dict(), sm[s].to_dict())
+    self.assertEqual(lazy_sm.frame, sm.frame)
+    self.assertEqual(lazy_sm.all_alive_and_valid(), sm.all_alive_and_valid())
+
+  def test_matches_submaster(self):
+    kwargs = dict(ignore_avg_freq=["modelV2"], ignore_alive=["deviceState"], addr=None)
+    sm = messaging.SubMaster(self.SERVICES, **kwargs)
+    lazy_sm = messaging.LazySubMaster(self.SERVICES, **kwargs)
+    self.assertSameState(sm, lazy_sm)
+
+    rng = random.Random(0)
+    t = 1000.
+    for frame in range(3000):
+      t += 0.01
+      msgs = []
+      for s in self.SERVICES:
+        period = round(100 / messaging.service_list[s].frequency)
+        # modelV2 and carState stall for a while, then come back
+        stalled = (s == "modelV2" and 500 <= frame < 800) or (s == "carState" and 1500 <= frame < 1520)
+        # carState runs slower than expected on a stretch, alive but not at the average frequency
+        if s == "carState" and 2000 <= frame < 2500:
+          period = 2
+        if frame % period == 0 and not stalled:
+          msg = make_msg(s, int((t - rng.uniform(0, 0.005)) * 1e9), valid=rng.random() > 0.05)
+          if s == "carState":
+            msg.carState.vEgo = frame
+          msgs.append(msg.to_bytes())
+      rng.shuffle(msgs)
+
+      sm.update_msgs(t, [messaging.log_from_bytes(dat) for dat in msgs])
+      lazy_sm.update_raw_msgs(t, msgs)
+      self.assertSameState(sm, lazy_sm)
+
+  def test_update_msgs(self):
+    sm = messaging.SubMaster(self.SERVICES, addr=None)
+    lazy_sm = messaging.LazySubMaster(self.SERVICES, addr=None)
+    for frame in range(300):
+      msgs = [make_msg(s, frame) for s in self.SERVICES if frame % 5 != 0 or s != "carState"]
+      readers = [messaging.log_from_bytes(m.to_bytes()) for m in msgs]
+      sm.update_msgs(frame * 0.01, readers)
+      lazy_sm.update_msgs(frame * 0.01, readers)
+      self.assertSameState(sm, lazy_sm)
+
+
+if __name__ == "__main__":
+  unittest.main()
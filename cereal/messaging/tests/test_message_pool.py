@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import unittest
+
+import cereal.messaging as messaging
+
+
+class TestMessagePool(unittest.TestCase):
+  def send(self, pool, dat):
+    ret = pool.to_bytes(dat)
+    # no unused space: the segment table, the root pointer and the content of the pooled builder
+    self.assertEqual(len(ret), 8 * (pool.msgs[dat.which()].total_size.word_count + 2))
+    return ret
+
+  def test_in_place_rewrites(self):
+    pool = messaging.MessagePool()
+    first = pool.new_message('carControl')
+    sizes = set()
+    for i in range(10):
+      dat = pool.new_message('carControl')
+      self.assertIs(dat, first)
+      dat.carControl.enabled = i % 2 == 0
+      dat.carControl.actuators.steer = i / 10.
+      dat.carControl.actuators.accel = -i
+      dat.carControl.cruiseControl.cancel = i % 3 == 0
+
+      ret = self.send(pool, dat)
+      sizes.add(len(ret))
+      msg = messaging.log_from_bytes(ret)
+      self.assertTrue(msg.valid)
+      self.assertEqual(msg.carControl.enabled, i % 2 == 0)
+      self.assertAlmostEqual(msg.carControl.actuators.steer, i / 10., places=5)
+      self.assertEqual(msg.carControl.actuators.accel, -i)
+      self.assertEqual(msg.carControl.cruiseControl.cancel, i % 3 == 0)
+
+    self.assertEqual(pool.compactions, 0)
+    self.assertEqual(len(sizes), 1)
+
+  def test_rewritten_fields_are_compacted(self):
+    def write_text(dat, i):
+      dat.controlsState.alertText1 = f"alert {i}"
+
+    def write_struct(dat, i):
+      dat.controlsState.lateralControlState.init('pidState').p = i
+
+    def write_list(dat, i):
+      dat.carState.init('buttonEvents', 2)[1].pressed = i % 2 == 1
+
+    for service, scalar, write, read in [
+      ('controlsState', 'vCruise', write_text, lambda msg: msg.controlsState.alertText1),
+      ('controlsState', 'vCruise', write_struct, lambda msg: msg.controlsState.lateralControlState.pidState.p),
+      ('carState', 'vEgo', write_list, lambda msg: [b.pressed for b in msg.carState.buttonEvents]),
+    ]:
+      with self.subTest(write.__name__):
+        pool = messaging.MessagePool()
+        dat = pool.new_message(service)
+        write(dat, 0)
+        self.send(pool, dat)
+        self.assertEqual(pool.compactions, 0)
+
+        # the old value is left as unused space, the compacted copy is sent and replaces the pooled builder
+        dat = pool.new_message(service)
+        write(dat, 1)
+        ret = self.send(pool, dat)
+        self.assertEqual(pool.compactions, 1)
+        compacted = pool.msgs[service]
+        self.assertIsNot(compacted, dat)
+        self.assertEqual(read(messaging.log_from_bytes(ret)), read(dat))
+
+        # the next message is built on the compacted builder, in place writes don't need compacting
+        dat = pool.new_message(service)
+        self.assertIs(dat, compacted)
+        self.assertEqual(read(dat), read(messaging.log_from_bytes(ret)))
+        setattr(getattr(dat, service), scalar, 3.)
+        ret = self.send(pool, dat)
+        self.assertEqual(pool.compactions, 1)
+        self.assertEqual(getattr(getattr(messaging.log_from_bytes(ret), service), scalar), 3.)
+
+  def test_list_size_change(self):
+    pool = messaging.MessagePool()
+    dat = pool.new_message('liveTracks', 3)
+    dat.liveTracks[2].trackId = 7
+    self.send(pool, dat)
+
+    self.assertIs(pool.new_message('liveTracks', 3), dat)
+    self.assertEqual(dat.liveTracks[2].trackId, 7)
+
+    new_dat = pool.new_message('liveTracks', 4)
+    self.assertIsNot(new_dat, dat)
+    self.assertIs(pool.msgs['liveTracks'], new_dat)
+    self.assertEqual([t.trackId for t in new_dat.liveTracks], [0] * 4)
+    self.assertEqual(len(messaging.log_from_bytes(self.send(pool, new_dat)).liveTracks), 4)
+    self.assertEqual(pool.compactions, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -69,6 +69,10 @@ services = {
 
   # debug
   "testJoystick": (False, 0.),
+  "messagingStats": (True, 1., 1),
+  "controlsdLatency": (True, 0.2, 1),
+  "plannerdLatency": (True, 0.2, 1),
+  "radardLatency": (True, 0.2, 1),
 }
 service_list = {name: Service(new_port(idx), *vals) for  # type: ignore
                 idx, (name, vals) in enumerate(services.items())}
@@ -0,0 +1,49 @@
+import os
+import struct
+from cffi import FFI
+
+ffi = FFI()
+ffi.cdef("""
+int inotify_init1(int flags);
+int inotify_add_watch(int fd, const char *pathname, uint32_t mask);
+""")
+libc = ffi.dlopen(None)
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def inotify_init(flags=IN_CLOEXEC):
+  fd = libc.inotify_init1(flags)
+  if fd == -1:
+    raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_init1({flags})")
+  return fd
+
+def inotify_add_watch(fd, path, mask):
+  wd = libc.inotify_add_watch(fd, path.encode(), mask)
+  if wd == -1:
+    raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_add_watch({path}, {mask})")
+  return wd
+
+def read_events(fd):
+  """Blocks until there are events, returns the (wd, mask, name) of each one"""
+  buf = os.read(fd, 4096)
+  events = []
+  offset = 0
+  while offset < len(buf):
+    wd, mask, _, name_len = EVENT_HEADER.unpack_from(buf, offset)
+    offset += EVENT_HEADER.size
+    name = buf[offset:offset + name_len].rstrip(b"\0").decode()
+    offset += name_len
+    events.append((wd, mask, name))
+  return events
@@ -1,9 +1,96 @@
+import os
+import threading
+
 from common.params_pyx import Params, ParamKeyType, UnknownKeyName, put_nonblocking # pylint: disable=no-name-in-module, import-error
 assert Params
 assert ParamKeyType
 assert UnknownKeyName
 assert put_nonblocking
 
+
+class CachedParams():
+  """Params for the hot loops, served from memory: a value is read from the filesystem once and kept until its
+  param is written or deleted, by any process, as seen by an inotify watch on the params directory. Without
+  inotify every read goes to the filesystem, like Params. Use get_cached_params to share the instance (and its
+  watch thread) in a process.
+  """
+  def __init__(self, d=""):
+    self.params = Params(d)
+    self._cache = {}
+    self._seq = 0  # changes seen by the watch thread, a value read during a change is not cached
+    self._watching = False
+
+    try:
+      from common.inotify import inotify_init, inotify_add_watch, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, \
+                                  IN_MOVED_FROM, IN_MOVED_TO
+      fd = inotify_init()
+      inotify_add_watch(fd, self.params.get_param_path(), IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM |
+                        IN_MOVED_TO)
+    except (ImportError, OSError):
+      return
+
+    self._watching = True
+    threading.Thread(target=self._watch, args=(fd,), name="params_watch", daemon=True).start()
+
+  def _watch(self, fd):
+    from common.inotify import read_events, IN_DELETE_SELF, IN_IGNORED, IN_Q_OVERFLOW
+
+    while self._watching:
+      for _, mask, name in read_events(fd):
+        self._seq += 1
+        if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_IGNORED):
+          # events were lost, or the directory is gone
+          self._watching = not (mask & (IN_DELETE_SELF | IN_IGNORED))
+          self._cache.clear()
+        else:
+          self._cache.pop(name, None)
+    os.close(fd)
+
+  def get(self, key, encoding=None):
+    try:
+      val = self._cache[key]
+    except KeyError:
+      seq = self._seq
+      val = self.params.get(key)
+      if self._watching and seq == self._seq:
+        self._cache[key] = val
+    return val if val is None or encoding is None else val.decode(encoding)
+
+  def get_bool(self, key):
+    return self.get(key) == b"1"
+
+  def get_int(self, key, default=0):
+    try:
+      return int(self.get(key))
+    except (TypeError, ValueError):
+      return default
+
+  def get_str(self, key, default=""):
+    val = self.get(key, encoding="utf8")
+    return default if val is None else val
+
+  def put(self, key, dat):
+    self.params.put(key, dat)
+    self._cache.pop(key, None)
+
+  def put_bool(self, key, val):
+    self.params.put_bool(key, val)
+    self._cache.pop(key, None)
+
+  def delete(self, key):
+    self.params.delete(key)
+    self._cache.pop(key, None)
+
+
+_cached_params = {}
+
+def get_cached_params(d=""):
+  # by process, the watch thread of a parent process doesn't survive the fork
+  key = (d, os.getpid())
+  if key not in _cached_params:
+    _cached_params[key] = CachedParams(d)
+  return _cached_params[key]
+
 if __name__ == "__main__":
   import sys
 
@@ -21,6 +21,7 @@ cdef extern from "selfdrive/common/params.h":
     int put(string, string) nogil
     int putBool(string, bool) nogil
     bool checkKey(string) nogil
+    string getParamPath(string) nogil
     void clearAll(ParamKeyType)
 
 
@@ -73,6 +74,10 @@ cdef class Params:
       r = self.p.getBool(k)
     return r
 
+  def get_param_path(self, key=""):
+    cdef string k = ensure_bytes(key)
+    return self.p.getParamPath(k).decode()
+
   def put(self, key, dat):
     """
     Warning: This function blocks until the param is written to disk!
@@ -1,45 +1,110 @@
 import time
 
-class Profiler():
-  def __init__(self, enabled=False):
-    self.enabled = enabled
-    self.cp = {}
-    self.cp_ignored = []
-    self.iter = 0
-    self.start_time = time.time()
-    self.last_time = self.start_time
-    self.tot = 0.
-
-  def reset(self, enabled=False):
-    self.enabled = enabled
-    self.cp = {}
-    self.cp_ignored = []
-    self.iter = 0
-    self.start_time = time.time()
-    self.last_time = self.start_time
-
-  def checkpoint(self, name, ignore=False):
-    # ignore flag needed when benchmarking threads with ratekeeper
-    if not self.enabled:
-      return
-    tt = time.time()
-    if name not in self.cp:
-      self.cp[name] = 0.
-      if ignore:
-        self.cp_ignored.append(name)
-    self.cp[name] += tt - self.last_time
-    if not ignore:
-      self.tot += tt - self.last_time
-    self.last_time = tt
-
-  def display(self):
-    if not self.enabled:
-      return
-    self.iter += 1
-    print("******* Profiling %d *******" % self.iter)
-    for n, ms in sorted(self.cp.items(), key=lambda x: -x[1]):
-      if n in self.cp_ignored:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f   IGNORED" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
-      else:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
-    print("Iter clock: %2.6f   TOTAL: %2.2f" % (self.tot/self.iter, self.tot))
+import numpy as np
+
+import cereal.messaging as messaging
+from selfdrive.swaglog import cloudlog
+
+class LatencyProfiler():
+  """Always on latency of the stages of a loop. The duration of each stage (the time since the previous checkpoint)
+  of the last cycles is kept in a fixed size ring buffer, the p50/p99/max of each stage and of the whole cycle are
+  published every period on the service. Cycles over the budget are counted, with the slowest stage of the cycle.
+
+    prof.start()
+    ...
+    prof.checkpoint("Sample")
+    ...
+    prof.end()
+  """
+  def __init__(self, service, budget, pm=None, period=5., size=1000, max_stages=8):
+    self.service = service
+    self.budget = budget
+    self.pm = pm
+    self.period = period
+
+    self.stages = {}  # column by name, in order of the first checkpoint
+    self.durations = np.full((size, max_stages + 1), np.nan)  # last column is the whole cycle
+    self.cycle = np.full(max_stages + 1, np.nan)
+    self.idx = 0
+
+    self.start_time = 0.
+    self.last_time = 0.
+    self.period_start_time = None
+    self.reset()
+
+  def reset(self):
+    self.cycle_count = 0
+    self.overrun_count = 0
+    self.stage_overruns = np.zeros(self.durations.shape[1] - 1, dtype=np.uint32)
+    self.worst_overrun = 0.
+    self.worst_overrun_stage = ""
+
+  def start(self):
+    self.start_time = self.last_time = time.monotonic()
+
+  def checkpoint(self, name):
+    t = time.monotonic()
+    col = self.stages.get(name)
+    if col is None and len(self.stages) < len(self.cycle) - 1:
+      col = self.stages[name] = len(self.stages)
+    if col is not None:
+      self.cycle[col] = t - self.last_time
+    self.last_time = t
+
+  def end(self):
+    t = time.monotonic()
+    self.cycle[-1] = t - self.start_time
+    self.durations[self.idx] = self.cycle
+    self.idx = (self.idx + 1) % len(self.durations)
+    self.cycle_count += 1
+
+    if self.cycle[-1] > self.budget:
+      self.overrun_count += 1
+      stage_durations = np.nan_to_num(self.cycle[:-1], nan=-1.)
+      col = int(np.argmax(stage_durations))
+      if stage_durations[col] >= 0.:
+        self.stage_overruns[col] += 1
+      if self.cycle[-1] > self.worst_overrun:
+        self.worst_overrun = float(self.cycle[-1])
+        self.worst_overrun_stage = next((name for name, c in self.stages.items() if c == col), "")
+    self.cycle.fill(np.nan)
+
+    if self.period_start_time is None:
+      self.period_start_time = t
+    elif t - self.period_start_time >= self.period:
+      self.publish(t)
+
+  def get_msg(self, t):
+    msg = messaging.new_message(self.service)
+    stats = getattr(msg, self.service)
+    stats.periodSec = t - self.period_start_time
+    stats.cycleCount = self.cycle_count
+    stats.budgetMs = self.budget * 1e3
+    stats.overrunCount = self.overrun_count
+    stats.worstOverrunMs = self.worst_overrun * 1e3
+    stats.worstOverrunStage = self.worst_overrun_stage
+
+    # the cycles of this period still in the ring buffer
+    count = min(self.cycle_count, len(self.durations))
+    durations = self.durations[(self.idx - 1 - np.arange(count)) % len(self.durations)] * 1e3
+
+    def percentiles(d):
+      d = d[~np.isnan(d)]
+      return (float(np.percentile(d, 50)), float(np.percentile(d, 99)), float(np.max(d))) if len(d) else (0., 0., 0.)
+
+    stats.p50Ms, stats.p99Ms, stats.maxMs = percentiles(durations[:, -1])
+    stages = stats.init('stages', len(self.stages))
+    for (name, col), stage in zip(self.stages.items(), stages):
+      stage.name = name
+      stage.p50Ms, stage.p99Ms, stage.maxMs = percentiles(durations[:, col])
+      stage.overrunCount = int(self.stage_overruns[col])
+    return msg
+
+  def publish(self, t):
+    if self.overrun_count > 0:
+      cloudlog.event("cycle_overrun", service=self.service, count=self.overrun_count,
+                     worst_ms=self.worst_overrun * 1e3, worst_stage=self.worst_overrun_stage)
+    if self.pm is not None:
+      self.pm.send(self.service, self.get_msg(t))
+    self.period_start_time = t
+    self.reset()
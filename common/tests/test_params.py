@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from common.params import CachedParams, Params, UnknownKeyName, get_cached_params
+
+
+class TestCachedParams(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.params = Params(self.tmpdir)  # another writer, like a different process
+    self.cached = CachedParams(self.tmpdir)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def wait_for(self, condition, timeout=1.):
+    t = time.monotonic()
+    while not condition() and time.monotonic() - t < timeout:
+      time.sleep(0.001)
+    self.assertTrue(condition())
+
+  def test_reads_from_memory(self):
+    self.params.put("DongleId", "cb38263377b873ee")
+    self.assertEqual(self.cached.get("DongleId", encoding="utf8"), "cb38263377b873ee")
+
+    with mock.patch.object(self.cached.params, "get", side_effect=AssertionError("read from disk")):
+      for _ in range(10):
+        self.assertEqual(self.cached.get("DongleId"), b"cb38263377b873ee")
+
+  def test_invalidated_on_write(self):
+    self.assertIsNone(self.cached.get("AutoLaneChangeTimer"))
+
+    self.params.put("AutoLaneChangeTimer", "2")
+    self.wait_for(lambda: self.cached.get_int("AutoLaneChangeTimer") == 2)
+
+    self.params.put("AutoLaneChangeTimer", "3")
+    self.wait_for(lambda: self.cached.get_int("AutoLaneChangeTimer") == 3)
+
+    self.params.delete("AutoLaneChangeTimer")
+    self.wait_for(lambda: self.cached.get("AutoLaneChangeTimer") is None)
+
+  def test_own_writes(self):
+    self.cached.put_bool("IsMetric", True)
+    self.assertTrue(self.cached.get_bool("IsMetric"))
+    self.cached.put_bool("IsMetric", False)
+    self.assertFalse(self.cached.get_bool("IsMetric"))
+    self.cached.delete("IsMetric")
+    self.assertIsNone(self.cached.get("IsMetric"))
+
+  def test_typed_accessors(self):
+    self.params.put("DynamicLaneProfile", "1")
+    self.params.put("DongleId", "abc")
+    self.params.put_bool("IsMetric", True)
+
+    self.assertEqual(self.cached.get_int("DynamicLaneProfile"), 1)
+    self.assertEqual(self.cached.get_int("DongleId", default=-1), -1)
+    self.assertEqual(self.cached.get_int("GapAdjustCruiseTr", default=4), 4)
+    self.assertEqual(self.cached.get_str("DongleId"), "abc")
+    self.assertEqual(self.cached.get_str("GitBranch", default="none"), "none")
+    self.assertTrue(self.cached.get_bool("IsMetric"))
+    self.assertFalse(self.cached.get_bool("IsLdwEnabled"))
+
+  def test_unknown_key(self):
+    with self.assertRaises(UnknownKeyName):
+      self.cached.get("swag")
+
+  def test_shared_instance(self):
+    cached = get_cached_params(self.tmpdir)
+    self.assertIs(get_cached_params(self.tmpdir), cached)
+    # a forked process gets its own
+    with mock.patch.object(os, "getpid", return_value=os.getpid() + 1):
+      self.assertIsNot(get_cached_params(self.tmpdir), cached)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from common.profiler import LatencyProfiler
+
+
+class FakePubMaster():
+  def __init__(self):
+    self.sent = []
+
+  def send(self, service, msg):
+    self.sent.append(getattr(msg, service).as_reader())
+
+
+class TestLatencyProfiler(unittest.TestCase):
+  def setUp(self):
+    self.t = 0.
+    patcher = mock.patch('common.profiler.time.monotonic', side_effect=lambda: self.t)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.pm = FakePubMaster()
+
+  def run_cycle(self, prof, stages):
+    prof.start()
+    for name, duration in stages:
+      self.t += duration
+      prof.checkpoint(name)
+    prof.end()
+    self.t += 0.005  # waiting for the next cycle
+
+  def test_stage_percentiles(self):
+    prof = LatencyProfiler('controlsdLatency', 0.01, pm=self.pm, period=0.5, size=50)
+    for i in range(100):
+      self.run_cycle(prof, [("Sample", 0.001), ("State Control", 0.001 * (i % 4))])
+    self.assertEqual(len(self.pm.sent), 1)
+
+    stats = self.pm.sent[0]
+    self.assertEqual(stats.budgetMs, 10.)
+    self.assertEqual(stats.overrunCount, 0)
+    self.assertEqual([s.name for s in stats.stages], ["Sample", "State Control"])
+    sample, control = stats.stages
+    self.assertAlmostEqual(sample.p50Ms, 1., places=3)
+    self.assertAlmostEqual(sample.maxMs, 1., places=3)
+    self.assertAlmostEqual(control.maxMs, 3., places=3)
+    self.assertAlmostEqual(stats.maxMs, 4., places=3)
+    # more cycles than the ring buffer holds
+    self.assertGreater(stats.cycleCount, 50)
+
+  def test_overruns(self):
+    prof = LatencyProfiler('controlsdLatency', 0.01, pm=self.pm, period=10.)
+    for i in range(100):
+      if i % 50 == 10:
+        stages = [("Sample", 0.001), ("Events", 0.012), ("State Control", 0.002)]
+      elif i % 50 == 20:
+        stages = [("Sample", 0.001), ("Events", 0.001), ("State Control", 0.009)]
+      else:
+        stages = [("Sample", 0.001), ("Events", 0.001), ("State Control", 0.002)]
+      self.run_cycle(prof, stages)
+    prof.publish(self.t)
+
+    stats = self.pm.sent[0]
+    self.assertEqual(stats.overrunCount, 4)
+    self.assertEqual(stats.worstOverrunStage, "Events")
+    self.assertAlmostEqual(stats.worstOverrunMs, 15., places=3)
+    self.assertEqual({s.name: s.overrunCount for s in stats.stages}, {"Sample": 0, "Events": 2, "State Control": 2})
+
+  def test_skipped_stages(self):
+    prof = LatencyProfiler('controlsdLatency', 0.01, pm=self.pm, period=0.1)
+    for i in range(20):
+      self.run_cycle(prof, [("Sample", 0.001)] + ([("State transition", 0.002)] if i % 2 else []))
+    stats = self.pm.sent[0]
+    self.assertAlmostEqual(stats.stages[1].p50Ms, 2., places=3)
+
+
+if __name__ == "__main__":
+  unittest.main()
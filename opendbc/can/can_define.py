@@ -1,2 +1,18 @@
-from opendbc.can.parser_pyx import CANDefine  # pylint: disable=no-name-in-module, import-error
+import os
+
+from opendbc import DBC_PATH
+from opendbc.can.dbc import dbc
+
+try:
+  from opendbc.can.parser_pyx import CANDefine  # pylint: disable=no-name-in-module, import-error
+except ImportError:
+  # Without the compiled parser (e.g. offline tools), the values definitions come from the cached parsed dbc.
+  class CANDefine():
+    def __init__(self, dbc_name):
+      self.dbc_name = dbc_name
+      dbc_fn = os.path.join(DBC_PATH, dbc_name + ".dbc")
+      if not os.path.exists(dbc_fn):
+        raise RuntimeError(f"Can't find DBC: '{dbc_name}'")
+      self.dv = dbc(dbc_fn).can_define()
+
 assert CANDefine
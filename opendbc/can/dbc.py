@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 import re
 import os
+import pickle
+import hashlib
+import tempfile
 import struct
 import sys
 import numbers
+import numpy as np
 from collections import namedtuple, defaultdict
 
 def int_or_float(s):
@@ -18,104 +22,201 @@ DBCSignal = namedtuple(
   "DBCSignal", ["name", "start_bit", "size", "is_little_endian", "is_signed",
                 "factor", "offset", "tmin", "tmax", "units"])
 
+# Result of decoding a batch of messages of one address. idx are the positions of the messages in the batch
+# and signals maps signal name to a numpy array with the decoded value for each of them.
+DBCBatch = namedtuple("DBCBatch", ["name", "idx", "signals"])
 
-class dbc():
-  def __init__(self, fn):
-    self.name, _ = os.path.splitext(os.path.basename(fn))
-    with open(fn, encoding="ascii") as f:
-      self.txt = f.readlines()
-    self._warned_addresses = set()
-
-    # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
-    bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
-    sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
-    sgm_regexp = re.compile(r"^SG\_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
-    val_regexp = re.compile(r"VAL\_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*)")
-
-    # A dictionary which maps message ids to tuples ((name, size), signals).
-    #   name is the ASCII name of the message.
-    #   size is the size of the message in bytes.
-    #   signals is a list signals contained in the message.
-    # signals is a list of DBCSignal in order of increasing start_bit.
-    self.msgs = {}
-
-    # A dictionary which maps message ids to a list of tuples (signal name, definition value pairs)
-    self.def_vals = defaultdict(list)
-
-    # lookup to bit reverse each byte
-    self.bits_index = [(i & ~0b111) + ((-i - 1) & 0b111) for i in range(64)]
-
-    for l in self.txt:
-      l = l.strip()
-
-      if l.startswith("BO_ "):
-        # new group
-        dat = bo_regexp.match(l)
+# Parsed dbc files are cached here, keyed by the hash of the file. Bump the version when the parsed format changes.
+DBC_CACHE_DIR = os.getenv("DBC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".commacache", "dbc"))
+DBC_CACHE_VERSION = 1
 
-        if dat is None:
-          print("bad BO {0}".format(l))
+_parsed_dbcs = {}
 
-        name = dat.group(2)
-        size = int(dat.group(3))
-        ids = int(dat.group(1), 0)  # could be hex
-        if ids in self.msgs:
-          sys.exit("Duplicate address detected %d %s" % (ids, self.name))
 
-        self.msgs[ids] = ((name, size), [])
+def can_payloads_array(dats, size=8):
+  """Packs a list of CAN payloads (bytes) into a (N, size) uint8 array, zero padded."""
+  buf = b"".join(d[:size].ljust(size, b'\x00') for d in dats)
+  return np.frombuffer(buf, dtype=np.uint8).reshape(-1, size)
 
-      if l.startswith("SG_ "):
-        # new signal
-        dat = sg_regexp.match(l)
-        go = 0
-        if dat is None:
-          dat = sgm_regexp.match(l)
-          go = 1
 
-        if dat is None:
-          print("bad SG {0}".format(l))
+def parse_dbc(dbc_name, lines):
+  """Parses the lines of a dbc file. Returns the (msgs, def_vals, msg_name_to_address) of the dbc class."""
+  # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
+  bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
+  sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
+  sgm_regexp = re.compile(r"^SG\_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
+  val_regexp = re.compile(r"VAL\_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*)")
 
-        sgname = dat.group(1)
-        start_bit = int(dat.group(go + 2))
-        signal_size = int(dat.group(go + 3))
-        is_little_endian = int(dat.group(go + 4)) == 1
-        is_signed = dat.group(go + 5) == '-'
-        factor = int_or_float(dat.group(go + 6))
-        offset = int_or_float(dat.group(go + 7))
-        tmin = int_or_float(dat.group(go + 8))
-        tmax = int_or_float(dat.group(go + 9))
-        units = dat.group(go + 10)
+  # A dictionary which maps message ids to tuples ((name, size), signals).
+  #   name is the ASCII name of the message.
+  #   size is the size of the message in bytes.
+  #   signals is a list signals contained in the message.
+  # signals is a list of DBCSignal in order of increasing start_bit.
+  msgs = {}
+
+  # A dictionary which maps message ids to a list of tuples (signal name, definition value pairs)
+  def_vals = defaultdict(list)
+
+  for l in lines:
+    l = l.strip()
+
+    if l.startswith("BO_ "):
+      # new group
+      dat = bo_regexp.match(l)
+
+      if dat is None:
+        print("bad BO {0}".format(l))
+
+      name = dat.group(2)
+      size = int(dat.group(3))
+      ids = int(dat.group(1), 0)  # could be hex
+      if ids in msgs:
+        sys.exit("Duplicate address detected %d %s" % (ids, dbc_name))
+
+      msgs[ids] = ((name, size), [])
+
+    if l.startswith("SG_ "):
+      # new signal
+      dat = sg_regexp.match(l)
+      go = 0
+      if dat is None:
+        dat = sgm_regexp.match(l)
+        go = 1
+
+      if dat is None:
+        print("bad SG {0}".format(l))
+
+      sgname = dat.group(1)
+      start_bit = int(dat.group(go + 2))
+      signal_size = int(dat.group(go + 3))
+      is_little_endian = int(dat.group(go + 4)) == 1
+      is_signed = dat.group(go + 5) == '-'
+      factor = int_or_float(dat.group(go + 6))
+      offset = int_or_float(dat.group(go + 7))
+      tmin = int_or_float(dat.group(go + 8))
+      tmax = int_or_float(dat.group(go + 9))
+      units = dat.group(go + 10)
+
+      msgs[ids][1].append(
+        DBCSignal(sgname, start_bit, signal_size, is_little_endian,
+                  is_signed, factor, offset, tmin, tmax, units))
+
+    if l.startswith("VAL_ "):
+      # new signal value/definition
+      dat = val_regexp.match(l)
+
+      if dat is None:
+        print("bad VAL {0}".format(l))
+
+      ids = int(dat.group(1), 0)  # could be hex
+      sgname = dat.group(2)
+      defvals = dat.group(3)
+
+      defvals = defvals.replace("?", r"\?")  # escape sequence in C++
+      defvals = defvals.split('"')[:-1]
+
+      # convert strings to UPPER_CASE_WITH_UNDERSCORES
+      defvals[1::2] = [d.strip().upper().replace(" ", "_") for d in defvals[1::2]]
+      defvals = '"' + "".join(str(i) for i in defvals) + '"'
+
+      def_vals[ids].append((sgname, defvals))
+
+  for msg in msgs.values():
+    msg[1].sort(key=lambda x: x.start_bit)
+
+  msg_name_to_address = {}
+  for address, m in msgs.items():
+    name = m[0][0]
+    msg_name_to_address[name] = address
+
+  return msgs, def_vals, msg_name_to_address
+
+
+def dbc_cache_path(digest):
+  return os.path.join(DBC_CACHE_DIR, f"{digest}.v{DBC_CACHE_VERSION}.pkl")
+
+
+def load_parsed_dbc(name, lines, digest):
+  """Provides the parsed definitions of a dbc file, given its lines and their sha256 digest. Parsed dbcs are kept
+     in memory and pickled to DBC_CACHE_DIR keyed by digest, so a changed file is parsed again. The returned
+     definitions are shared by every user of the same dbc and must not be modified.
+  """
+  parsed = _parsed_dbcs.get(digest)
+  if parsed is not None:
+    return parsed
+
+  path = dbc_cache_path(digest)
+  try:
+    with open(path, "rb") as f:
+      parsed = pickle.load(f)
+  except Exception:
+    parsed = parse_dbc(name, lines)
+    tmp_path = None
+    try:
+      os.makedirs(DBC_CACHE_DIR, exist_ok=True)
+      with tempfile.NamedTemporaryFile(dir=DBC_CACHE_DIR, delete=False) as f:
+        tmp_path = f.name
+        pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, path)
+      tmp_path = None
+    except Exception:
+      pass
+    finally:
+      # remove the temporary file if writing or renaming it failed
+      if tmp_path is not None:
+        try:
+          os.unlink(tmp_path)
+        except OSError:
+          pass
+
+  _parsed_dbcs[digest] = parsed
+  return parsed
 
-        self.msgs[ids][1].append(
-          DBCSignal(sgname, start_bit, signal_size, is_little_endian,
-                    is_signed, factor, offset, tmin, tmax, units))
 
-      if l.startswith("VAL_ "):
-        # new signal value/definition
-        dat = val_regexp.match(l)
-
-        if dat is None:
-          print("bad VAL {0}".format(l))
+class dbc():
+  def __init__(self, fn):
+    self.name, _ = os.path.splitext(os.path.basename(fn))
+    with open(fn, "rb") as f:
+      raw = f.read()
+    self.txt = raw.decode("ascii").splitlines(keepends=True)
+    self.digest = hashlib.sha256(raw).hexdigest()
+    self._parsed = None
+    self._warned_addresses = set()
 
-        ids = int(dat.group(1), 0)  # could be hex
-        sgname = dat.group(2)
-        defvals = dat.group(3)
+    # lookup to bit reverse each byte
+    self.bits_index = [(i & ~0b111) + ((-i - 1) & 0b111) for i in range(64)]
 
-        defvals = defvals.replace("?", r"\?")  # escape sequence in C++
-        defvals = defvals.split('"')[:-1]
+  def _load(self):
+    # the parsed definitions are loaded on first use, from the cache if the dbc was already parsed
+    if self._parsed is None:
+      self._parsed = load_parsed_dbc(self.name, self.txt, self.digest)
+    return self._parsed
 
-        # convert strings to UPPER_CASE_WITH_UNDERSCORES
-        defvals[1::2] = [d.strip().upper().replace(" ", "_") for d in defvals[1::2]]
-        defvals = '"' + "".join(str(i) for i in defvals) + '"'
+  @property
+  def msgs(self):
+    return self._load()[0]
 
-        self.def_vals[ids].append((sgname, defvals))
+  @property
+  def def_vals(self):
+    return self._load()[1]
 
-    for msg in self.msgs.values():
-      msg[1].sort(key=lambda x: x.start_bit)
+  @property
+  def msg_name_to_address(self):
+    return self._load()[2]
 
-    self.msg_name_to_address = {}
-    for address, m in self.msgs.items():
-      name = m[0][0]
-      self.msg_name_to_address[name] = address
+  def can_define(self):
+    """Signal value definitions in the same format as CANDefine.dv: a dictionary which maps message address and
+       message name to a dictionary of signal name to {value: definition}.
+    """
+    dv = defaultdict(dict)
+    for address, vals in self.def_vals.items():
+      msg_name = self.msgs[address][0][0]
+      for sgname, defvals in vals:
+        # the definitions are stored escaped and quoted for the generated C++ code
+        defvals = defvals[1:-1].replace(r"\?", "?").split()
+        dv[address][sgname] = dict(zip((int(v) for v in defvals[::2]), defvals[1::2]))
+        dv[msg_name][sgname] = dv[address][sgname]
+    return dict(dv)
 
   def lookup_msg_id(self, msg_id):
     if not isinstance(msg_id, numbers.Number):
@@ -196,6 +297,7 @@ class dbc():
       out = {}
     else:
       out = [None] * len(arr)
+      arr_idx = {sig_name: i for i, sig_name in enumerate(arr)}
 
     msg = self.msgs.get(x[0])
     if msg is None:
@@ -212,7 +314,7 @@ class dbc():
     le, be = None, None
 
     for s in msg[1]:
-      if arr is not None and s[0] not in arr:
+      if arr is not None and s[0] not in arr_idx:
         continue
 
       start_bit = s[1]
@@ -249,9 +351,98 @@ class dbc():
       if arr is None:
         out[s[0]] = tmp
       else:
-        out[arr.index(s[0])] = tmp
+        out[arr_idx[s[0]]] = tmp
     return name, out
 
+  def decode_batch(self, addresses, dats, arr=None):
+    """Decode a batch of CAN messages using the dbc, with vectorized bit extraction.
+
+       Inputs:
+        addresses: A numpy array with the CAN address of each message.
+        dats: A (N, size) uint8 numpy array with the CAN data of each message,
+              zero padded (see can_payloads_array). size is usually 8, or 64 for CAN FD.
+        arr: Optional list of signals which should be decoded and returned.
+
+       Returns:
+        A dictionary which maps each address of the batch known by the dbc to a DBCBatch
+        with the message name, the positions of its messages in the batch and the decoded
+        signals, a numpy array of values for each of them.
+    """
+    addresses = np.asarray(addresses)
+    dats = np.asarray(dats, dtype=np.uint8)
+    if dats.shape[1] < 8:
+      dats = np.pad(dats, ((0, 0), (0, 8 - dats.shape[1])))
+
+    # group the messages by address with a single sort
+    order = np.argsort(addresses, kind='stable')
+    unique_addresses, starts = np.unique(addresses[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    arr = set(arr) if arr is not None else None
+    out = {}
+    for address, start, end in zip(unique_addresses.tolist(), starts.tolist(), ends.tolist()):
+      msg = self.msgs.get(address)
+      if msg is None:
+        continue
+
+      idx = order[start:end]
+      sigs = [s for s in msg[1] if arr is None or s.name in arr]
+      out[address] = DBCBatch(msg[0][0], idx, self._decode_signals(dats[idx], sigs))
+    return out
+
+  def _decode_signals(self, dats, sigs):
+    out = {}
+    if dats.shape[1] == 8:
+      # same as decode: the data as a 64 bit integer in both byte orders
+      le = dats.view('<u8')[:, 0]
+      be = dats.view('>u8')[:, 0].astype(np.uint64)
+      for s in sigs:
+        if s.is_little_endian:
+          tmp, shift_amount = le, s.start_bit
+        else:
+          b1 = (s.start_bit // 8) * 8 + (-s.start_bit - 1) % 8
+          tmp, shift_amount = be, 64 - (b1 + s.size)
+
+        if shift_amount < 0:
+          continue
+
+        mask = np.uint64((1 << s.size) - 1)
+        out[s.name] = self._scale((tmp >> np.uint64(shift_amount)) & mask, s)
+    else:
+      # gather the bits of each signal, from least to most significant
+      bits = np.unpackbits(dats, axis=1, bitorder='little')
+      for s in sigs:
+        positions = self._signal_bit_positions(s)
+        if max(positions) >= bits.shape[1] or min(positions) < 0:
+          continue
+        weights = np.uint64(1) << np.arange(s.size, dtype=np.uint64)
+        out[s.name] = self._scale((bits[:, positions].astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64), s)
+    return out
+
+  @staticmethod
+  def _signal_bit_positions(s):
+    # bit positions (byte * 8 + bit, bit 0 being the least significant of the byte) of the signal, from its least
+    # to its most significant bit. big endian signals start at their most significant bit and continue to the
+    # least significant bit of the byte, then to the most significant bit of the next byte
+    if s.is_little_endian:
+      return list(range(s.start_bit, s.start_bit + s.size))
+    positions = []
+    pos = s.start_bit
+    for _ in range(s.size):
+      positions.append(pos)
+      pos = pos + 15 if pos % 8 == 0 else pos - 1
+    return positions[::-1]
+
+  @staticmethod
+  def _scale(raw, s):
+    if s.is_signed:
+      raw = raw.astype(np.int64)
+      if s.size < 64:
+        raw = np.where((raw >> (s.size - 1)) & 1, raw - (1 << s.size), raw)
+    else:
+      raw = raw.astype(np.int64 if s.size < 64 else np.float64)
+    return raw * s.factor + s.offset
+
   def get_signals(self, msg):
     msg = self.lookup_msg_id(msg)
     return [sgs.name for sgs in self.msgs[msg][1]]
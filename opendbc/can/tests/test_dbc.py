@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from opendbc import DBC_PATH
+from opendbc.can import dbc as dbc_module
+from opendbc.can.dbc import dbc, can_payloads_array, dbc_cache_path
+
+# CAN FD message with signals past the first 8 bytes
+FD_DBC = """
+BO_ 1280 FD_MSG: 64 XXX
+ SG_ BE_FIRST : 7|8@0+ (1,0) [0|0] "" XXX
+ SG_ LE_SIGNED : 130|12@1- (0.5,-10) [0|0] "" XXX
+ SG_ BE_UNSIGNED : 207|20@0+ (1,0) [0|0] "" XXX
+ SG_ BE_SIGNED : 300|7@0- (2,1) [0|0] "" XXX
+ SG_ LE_LAST : 500|12@1+ (1,0) [0|0] "" XXX
+"""
+
+VAL_DBC = """
+BO_ 466 PCM_CRUISE: 8 XXX
+ SG_ CRUISE_STATE : 55|4@0+ (1,0) [0|0] "" XXX
+ SG_ GAS_RELEASED : 4|1@0+ (1,0) [0|0] "" XXX
+BO_ 467 PCM_CRUISE_2: 8 XXX
+ SG_ LOW_SPEED_LOCKOUT : 14|2@0+ (1,0) [0|0] "" XXX
+
+VAL_ 466 CRUISE_STATE 8 "adaptive engaged" 1 "non-adaptive engaged?" 0 "off";
+VAL_ 467 LOW_SPEED_LOCKOUT 2 "low speed locked" 1 "ok";
+"""
+
+
+def decode_fd(dat, s):
+  # decode of a single signal, for payloads of any length
+  if s.is_little_endian:
+    tmp, shift_amount = int.from_bytes(dat, "little"), s.start_bit
+  else:
+    b1 = (s.start_bit // 8) * 8 + (-s.start_bit - 1) % 8
+    tmp, shift_amount = int.from_bytes(dat, "big"), len(dat) * 8 - (b1 + s.size)
+  tmp = (tmp >> shift_amount) & ((1 << s.size) - 1)
+  if s.is_signed and (tmp >> (s.size - 1)):
+    tmp -= (1 << s.size)
+  return tmp * s.factor + s.offset
+
+
+class TestDbc(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp_dir.cleanup)
+    for patch in (mock.patch.object(dbc_module, "DBC_CACHE_DIR", self.tmp_dir.name),
+                  mock.patch.object(dbc_module, "_parsed_dbcs", {})):
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def write_dbc(self, name, txt):
+    fn = os.path.join(self.tmp_dir.name, name + ".dbc")
+    with open(fn, "w") as f:
+      f.write(txt)
+    return fn
+
+  def random_batch(self, d, n, size):
+    addresses = np.array([random.choice(list(d.msgs)) for _ in range(n)])
+    dats = [bytes(random.getrandbits(8) for _ in range(size)) for _ in range(n)]
+    return addresses, dats
+
+  def test_decode_batch_matches_decode(self):
+    random.seed(0)
+    for dbc_name in ("toyota_nodsu_pt_generated", "hyundai_kia_generic", "honda_civic_touring_2016_can_generated"):
+      d = dbc(os.path.join(DBC_PATH, dbc_name + ".dbc"))
+      addresses, dats = self.random_batch(d, 2000, 8)
+
+      # 8 byte payloads, and the same ones zero padded to 64 bytes (the bit by bit path)
+      for size in (8, 64):
+        out = d.decode_batch(addresses, can_payloads_array(dats, size))
+        self.assertEqual(set(out), set(addresses.tolist()))
+        for address, batch in out.items():
+          self.assertTrue((addresses[batch.idx] == address).all())
+          for i, idx in enumerate(batch.idx):
+            name, expected = d.decode((address, 0, dats[idx]))
+            self.assertEqual(batch.name, name)
+            self.assertEqual({k: v[i] for k, v in batch.signals.items()}, expected)
+
+  def test_decode_batch_arr(self):
+    random.seed(1)
+    d = dbc(os.path.join(DBC_PATH, "toyota_nodsu_pt_generated.dbc"))
+    addresses, dats = self.random_batch(d, 500, 8)
+    arr = ["STEER_ANGLE", "STEER_FRACTION", "GAS_PEDAL", "NOT_A_SIGNAL"]
+
+    out = d.decode_batch(addresses, can_payloads_array(dats), arr=arr)
+
+    for address, batch in out.items():
+      signals = [s.name for s in d.msgs[address][1] if s.name in arr]
+      self.assertEqual(sorted(batch.signals), sorted(signals))
+      for i, idx in enumerate(batch.idx):
+        _, expected = d.decode((address, 0, dats[idx]), arr=arr)
+        self.assertEqual([batch.signals[s][i] if s in batch.signals else None for s in arr], expected)
+
+  def test_decode_batch_can_fd(self):
+    random.seed(2)
+    d = dbc(self.write_dbc("fd", FD_DBC))
+    dats = [bytes(random.getrandbits(8) for _ in range(64)) for _ in range(200)]
+    addresses = np.array([1280, 0x123] * 100)
+
+    out = d.decode_batch(addresses, can_payloads_array(dats, 64))
+
+    self.assertEqual(list(out), [1280])
+    # unknown addresses are left to decode to warn about
+    self.assertEqual(d._warned_addresses, set())
+    batch = out[1280]
+    self.assertEqual(batch.idx.tolist(), list(range(0, 200, 2)))
+    for s in d.msgs[1280][1]:
+      self.assertEqual(batch.signals[s.name].tolist(), [decode_fd(dats[idx], s) for idx in batch.idx])
+
+  def test_cache_hit(self):
+    fn = os.path.join(DBC_PATH, "toyota_nodsu_pt_generated.dbc")
+    d = dbc(fn)
+    expected = (d.msgs, dict(d.def_vals), d.msg_name_to_address)
+    self.assertTrue(os.path.exists(dbc_cache_path(d.digest)))
+    self.assertEqual(os.listdir(self.tmp_dir.name), [os.path.basename(dbc_cache_path(d.digest))])
+
+    # loaded from the pickled file, without parsing
+    dbc_module._parsed_dbcs.clear()
+    with mock.patch.object(dbc_module, "parse_dbc", side_effect=AssertionError) as parse:
+      d = dbc(fn)
+      self.assertEqual((d.msgs, dict(d.def_vals), d.msg_name_to_address), expected)
+      parse.assert_not_called()
+
+  def test_changed_file_is_parsed_again(self):
+    fn = self.write_dbc("changed", VAL_DBC)
+    d = dbc(fn)
+    self.assertEqual(d.msgs[466][1][0].name, "GAS_RELEASED")
+
+    fn = self.write_dbc("changed", VAL_DBC.replace("GAS_RELEASED", "GAS_PRESSED"))
+    d2 = dbc(fn)
+
+    self.assertNotEqual(d2.digest, d.digest)
+    self.assertEqual(d2.msgs[466][1][0].name, "GAS_PRESSED")
+    self.assertTrue(os.path.exists(dbc_cache_path(d.digest)))
+    self.assertTrue(os.path.exists(dbc_cache_path(d2.digest)))
+
+  def test_failed_cache_write_leaves_no_file(self):
+    fn = self.write_dbc("cache_write", VAL_DBC)
+    for target, error in [("pickle.dump", TypeError), ("os.replace", OSError)]:
+      dbc_module._parsed_dbcs.clear()
+      with mock.patch(f"opendbc.can.dbc.{target}", side_effect=error):
+        d = dbc(fn)
+        self.assertEqual(d.msgs[467][0], ("PCM_CRUISE_2", 8))
+      self.assertEqual(os.listdir(self.tmp_dir.name), ["cache_write.dbc"])
+
+  def test_can_define(self):
+    dv = dbc(self.write_dbc("values", VAL_DBC)).can_define()
+
+    cruise_state = {8: "ADAPTIVE_ENGAGED", 1: "NON-ADAPTIVE_ENGAGED?", 0: "OFF"}
+    self.assertEqual(dv, {
+      466: {"CRUISE_STATE": cruise_state},
+      "PCM_CRUISE": {"CRUISE_STATE": cruise_state},
+      467: {"LOW_SPEED_LOCKOUT": {2: "LOW_SPEED_LOCKED", 1: "OK"}},
+      "PCM_CRUISE_2": {"LOW_SPEED_LOCKOUT": {2: "LOW_SPEED_LOCKED", 1: "OK"}},
+    })
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -26,73 +26,71 @@ CANPACKET_HEAD_SIZE = 0x5
 DLC_TO_LEN = [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64]
 LEN_TO_DLC = {length: dlc for (dlc, length) in enumerate(DLC_TO_LEN)}
 
+USB_PACKET_SIZE = 64
+CAN_CHUNK_SIZE = 256  # messages are sent in chunks closed once over this size
+CAN_HEADER = struct.Struct('<BI')  # data length code and bus, then address and flags
+CAN_MSG_LEN = [CANPACKET_HEAD_SIZE + DLC_TO_LEN[b >> 4] for b in range(256)]  # message length by first header byte
+
+def _add_usb_counters(chunk):
+  # prepend a counter to each 63 bytes of the chunk, to make 64 byte USB packets
+  n_packets = -(-len(chunk) // (USB_PACKET_SIZE - 1))
+  tx = bytearray(len(chunk) + n_packets)
+  for i in range(n_packets):
+    start = i * (USB_PACKET_SIZE - 1)
+    tx[i * USB_PACKET_SIZE] = i
+    tx[i * USB_PACKET_SIZE + 1:(i + 1) * USB_PACKET_SIZE] = chunk[start:start + USB_PACKET_SIZE - 1]
+  return bytes(tx)
+
 def pack_can_buffer(arr):
-  snds = [b'']
-  idx = 0
+  snds = []
+  chunk = bytearray()
+  pack_header = CAN_HEADER.pack
   for address, _, dat, bus in arr:
     assert len(dat) in LEN_TO_DLC
     if DEBUG:
       print(f"  W 0x{address:x}: 0x{dat.hex()}")
     extended = 1 if address >= 0x800 else 0
-    data_len_code = LEN_TO_DLC[len(dat)]
-    header = bytearray(5)
-    word_4b = address << 3 | extended << 2
-    header[0] = (data_len_code << 4) | (bus << 1)
-    header[1] = word_4b & 0xFF
-    header[2] = (word_4b >> 8) & 0xFF
-    header[3] = (word_4b >> 16) & 0xFF
-    header[4] = (word_4b >> 24) & 0xFF
-    snds[idx] += header + dat
-    if len(snds[idx]) > 256: # Limit chunks to 256 bytes
-      snds.append(b'')
-      idx += 1
-
-  #Apply counter to each 64 byte packet
-  for idx in range(len(snds)):
-    tx = b''
-    counter = 0
-    for i in range (0, len(snds[idx]), 63):
-      tx += bytes([counter]) + snds[idx][i:i+63]
-      counter += 1
-    snds[idx] = tx
+    chunk += pack_header(LEN_TO_DLC[len(dat)] << 4 | bus << 1, address << 3 | extended << 2)
+    chunk += dat
+    if len(chunk) > CAN_CHUNK_SIZE:
+      snds.append(_add_usb_counters(chunk))
+      chunk = bytearray()
+  snds.append(_add_usb_counters(chunk))
   return snds
 
 def unpack_can_buffer(dat):
-  ret = []
-  counter = 0
-  tail = bytearray()
-  for i in range(0, len(dat), 64):
-    if counter != dat[i]:
+  # drop the USB packets from the first one with an unexpected counter
+  n_packets = 0
+  for i in range(0, len(dat), USB_PACKET_SIZE):
+    if dat[i] != n_packets:
       print("CAN: LOST RECV PACKET COUNTER")
       break
-    counter+=1
-    chunk = tail + dat[i+1:i+64]
-    tail = bytearray()
-    pos = 0
-    while pos<len(chunk):
-      data_len = DLC_TO_LEN[(chunk[pos]>>4)]
-      pckt_len = CANPACKET_HEAD_SIZE + data_len
-      if pckt_len <= len(chunk[pos:]):
-        header = chunk[pos:pos+CANPACKET_HEAD_SIZE]
-        if len(header) < 5:
-          print("CAN: MALFORMED USB RECV PACKET")
-          break
-        bus = (header[0] >> 1) & 0x7
-        address = (header[4] << 24 | header[3] << 16 | header[2] << 8 | header[1]) >> 3
-        returned = (header[1] >> 1) & 0x1
-        rejected = header[1] & 0x1
-        data = chunk[pos + CANPACKET_HEAD_SIZE:pos + CANPACKET_HEAD_SIZE + data_len]
-        if returned:
-          bus += 128
-        if rejected:
-          bus += 192
-        if DEBUG:
-          print(f"  R 0x{address:x}: 0x{data.hex()}")
-        ret.append((address, 0, data, bus))
-        pos += pckt_len
-      else:
-        tail = chunk[pos:]
-        break
+    n_packets += 1
+
+  # messages can span USB packets, so join their data without the counters. a truncated last message is dropped
+  buf = bytearray().join([dat[i + 1:i + USB_PACKET_SIZE]
+                          for i in range(0, n_packets * USB_PACKET_SIZE, USB_PACKET_SIZE)])
+  ret = []
+  unpack_header = CAN_HEADER.unpack_from
+  pos, end = 0, len(buf)
+  while pos < end:
+    msg_end = pos + CAN_MSG_LEN[buf[pos]]
+    if msg_end > end:
+      break
+    header, word_4b = unpack_header(buf, pos)
+    bus = (header >> 1) & 0x7
+    address = word_4b >> 3
+    returned = (word_4b >> 1) & 0x1
+    rejected = word_4b & 0x1
+    data = buf[pos + CANPACKET_HEAD_SIZE:msg_end]
+    if returned:
+      bus += 128
+    if rejected:
+      bus += 192
+    if DEBUG:
+      print(f"  R 0x{address:x}: 0x{data.hex()}")
+    ret.append((address, 0, data, bus))
+    pos = msg_end
   return ret
 
 def ensure_health_packet_version(fn):
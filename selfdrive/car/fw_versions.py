@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import struct
-import traceback
 from typing import Any
 from collections import defaultdict
 
@@ -9,7 +8,7 @@ from tqdm import tqdm
 import panda.python.uds as uds
 from cereal import car
 from selfdrive.car.fingerprints import FW_VERSIONS, get_attr_from_cars
-from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from selfdrive.car.isotp_async import AsyncIsoTpEngine, can_io_from_sockets
 from selfdrive.car.toyota.values import CAR as TOYOTA
 from selfdrive.swaglog import cloudlog
 
@@ -167,11 +166,6 @@ REQUESTS = [
 ]
 
 
-def chunks(l, n=128):
-  for i in range(0, len(l), n):
-    yield l[i:i + n]
-
-
 def build_fw_dict(fw_versions):
   fw_versions_dict = {}
   for fw in fw_versions:
@@ -276,44 +270,39 @@ def match_fw_to_car(fw_versions, allow_fuzzy=True):
 def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False, progress=False):
   ecu_types = {}
 
-  # Extract ECU addresses to query from fingerprints
-  # ECUs using a subadress need be queried one by one, the rest can be done in parallel
-  addrs = []
-  parallel_addrs = []
-
   versions = get_attr_from_cars('FW_VERSIONS', combine_brands=False)
   if extra is not None:
     versions.update(extra)
 
+  # Extract ECU addresses to query from fingerprints
+  addrs = []
   for brand, brand_versions in versions.items():
     for c in brand_versions.values():
       for ecu_type, addr, sub_addr in c.keys():
         a = (brand, addr, sub_addr)
         if a not in ecu_types:
           ecu_types[(addr, sub_addr)] = ecu_type
-
-        if sub_addr is None:
-          if a not in parallel_addrs:
-            parallel_addrs.append(a)
-        else:
-          if [a] not in addrs:
-            addrs.append([a])
-
-  addrs.insert(0, parallel_addrs)
-
+        if a not in addrs:
+          addrs.append(a)
+
+  # All the requests of every brand run concurrently, the engine only queries one ECU address at a time.
+  # ECUs using a subaddress are queried one by one as they share the address of their gateway
+  queries = {}
+  for request_idx, (brand, request, response, response_offset) in enumerate(REQUESTS):
+    for b, addr, sub_addr in addrs:
+      if b in (brand, 'any'):
+        t = 2 * timeout if sub_addr is None else timeout
+        queries[(request_idx, addr, sub_addr)] = dict(tx_addr=addr, requests=request, responses=response,
+                                                      sub_addr=sub_addr, response_offset=response_offset, timeout=t)
+
+  engine = AsyncIsoTpEngine(*can_io_from_sockets(sendcan, logcan), bus, debug=debug)
+  with tqdm(total=len(queries), disable=not progress) as pbar:
+    results = engine.run(engine.query_many(queries, on_done=pbar.update))
+
+  # responses to later requests take precedence
   fw_versions = {}
-  for i, addr in enumerate(tqdm(addrs, disable=not progress)):
-    for addr_chunk in chunks(addr):
-      for brand, request, response, response_offset in REQUESTS:
-        try:
-          addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any')]
-
-          if addrs:
-            query = IsoTpParallelQuery(sendcan, logcan, bus, addrs, request, response, response_offset, debug=debug)
-            t = 2 * timeout if i == 0 else timeout
-            fw_versions.update(query.get_data(t))
-        except Exception:
-          cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
+  for (_, addr, sub_addr), version in sorted(results.items(), key=lambda r: r[0][0]):
+    fw_versions[(addr, sub_addr)] = version
 
   # Build capnp list to put into CarParams
   car_fw = []
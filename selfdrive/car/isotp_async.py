@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from panda.python.uds import CanClient, IsoTpMessage, FUNCTIONAL_ADDRS, get_rx_addr_for_tx_addr
+from selfdrive.swaglog import cloudlog
+
+CanMsg = Tuple[int, int, bytes, int]  # address, bus time, data, bus
+
+POLL_INTERVAL = 0.001  # seconds between receive polls
+MAX_ACTIVE_SESSIONS = 128  # limits the requests sent at once
+
+
+def can_io_from_sockets(sendcan, logcan) -> Tuple[Callable[[List[CanMsg]], None], Callable[[], List[CanMsg]]]:
+  """can_send and can_recv functions for AsyncIsoTpEngine over the sendcan and can sockets"""
+  # imported here so the engine can be used without messaging, e.g. with a panda (see can_io_from_panda)
+  import cereal.messaging as messaging
+  from selfdrive.boardd.boardd import can_list_to_can_capnp
+
+  def can_send(msgs):
+    sendcan.send(can_list_to_can_capnp(msgs, msgtype='sendcan'))
+
+  def can_recv():
+    return [(m.address, m.busTime, m.dat, m.src) for packet in messaging.drain_sock(logcan) for m in packet.can]
+
+  return can_send, can_recv
+
+
+def can_io_from_panda(panda) -> Tuple[Callable[[List[CanMsg]], None], Callable[[], List[CanMsg]]]:
+  """can_send and can_recv functions for AsyncIsoTpEngine over a panda"""
+  return panda.can_send_many, panda.can_recv
+
+
+class _Session():
+  """Receive side of an ISO-TP session: the frames routed to it by the engine, for its CanClient"""
+  def __init__(self, tx_addr: int, rx_addr: Optional[int], sub_addr: Optional[int]):
+    self.tx_addr = tx_addr
+    self.rx_addr = rx_addr
+    self.sub_addr = sub_addr
+    self.frames: List[CanMsg] = []
+    self.event = asyncio.Event()
+
+  def accepts(self, addr: int, dat: bytes) -> bool:
+    if self.rx_addr is None:
+      # functional request, any physical address of the same addressing scheme (11 or 29 bit) can answer
+      if self.tx_addr <= 0x7FF:
+        return 0x7E8 <= addr <= 0x7EF
+      return 0x18DAF100 <= addr <= 0x18DAF1FF
+    return addr == self.rx_addr and (self.sub_addr is None or (len(dat) > 0 and dat[0] == self.sub_addr))
+
+  def push(self, msg: CanMsg) -> None:
+    self.frames.append(msg)
+    self.event.set()
+
+  def pop_frames(self) -> List[CanMsg]:
+    frames, self.frames = self.frames, []
+    return frames
+
+
+class AsyncIsoTpEngine():
+  """Runs many ISO-TP/UDS request sessions concurrently over one CAN bus. A single task receives the CAN traffic and
+  routes every frame to the sessions waiting for its address (and sub address), while each session runs its own
+  ISO-TP state machine (IsoTpMessage), flow control and timeouts. Frames sent by the sessions are batched and sent
+  once per poll. Sessions to the same ECU (bus and tx address) run one after the other, so a response can always
+  be matched to its request.
+
+  can_send(msgs) sends a list of (address, 0, data, bus) messages and can_recv() returns the received messages
+  without blocking, see can_io_from_sockets and can_io_from_panda.
+  """
+  def __init__(self, can_send: Callable[[List[CanMsg]], None], can_recv: Callable[[], List[CanMsg]], bus: int,
+               debug: bool = False):
+    self.can_send = can_send
+    self.can_recv = can_recv
+    self.bus = bus
+    self.debug = debug
+    self._sessions: List[_Session] = []
+    self._tx_msgs: List[CanMsg] = []
+    self._ecu_locks: Dict[int, asyncio.Lock] = {}
+    self._active_sessions: Optional[asyncio.Semaphore] = None
+
+  def _can_tx(self, tx_addr: int, dat: bytes, bus: int) -> None:
+    self._tx_msgs.append((tx_addr, 0, dat, bus))
+
+  def _flush_tx(self) -> None:
+    if len(self._tx_msgs):
+      msgs, self._tx_msgs = self._tx_msgs, []
+      self.can_send(msgs)
+
+  async def _rx_loop(self) -> None:
+    while True:
+      self._flush_tx()
+      for msg in self.can_recv():
+        if msg[3] != self.bus:
+          continue
+        for session in self._sessions:
+          if session.accepts(msg[0], msg[2]):
+            session.push(msg)
+      await asyncio.sleep(POLL_INTERVAL)
+
+  async def query(self, tx_addr: int, requests: List[bytes], responses: List[bytes], sub_addr: Optional[int] = None,
+                  response_offset: int = 0x8, timeout: float = 0.1, total_timeout: Optional[float] = None) \
+                  -> Optional[bytes]:
+    """Sends the requests in order to the ECU, each one after the response to the previous one. Returns the data
+    of the last response after the expected response prefix, or None on a bad response or when the ECU does not
+    respond within timeout (reset by every received frame) or the whole exchange takes over total_timeout.
+    The engine must be running, see run.
+    """
+    if total_timeout is None:
+      total_timeout = 10 * timeout
+
+    async with self._ecu_locks[tx_addr], self._active_sessions:
+      rx_addr = get_rx_addr_for_tx_addr(tx_addr, rx_offset=response_offset)
+      session = _Session(tx_addr, rx_addr, sub_addr)
+      can_client = CanClient(self._can_tx, session.pop_frames, tx_addr, rx_addr, self.bus, sub_addr=sub_addr,
+                             debug=self.debug)
+      msg = IsoTpMessage(can_client, timeout=0, max_len=8 if sub_addr is None else 7, debug=self.debug)
+
+      self._sessions.append(session)
+      try:
+        return await asyncio.wait_for(self._exchange(tx_addr, msg, session, requests, responses, timeout),
+                                      total_timeout)
+      except asyncio.TimeoutError:
+        if self.debug:
+          print(f"iso-tp query timeout: {hex(tx_addr)} {sub_addr}")
+        return None
+      except Exception:
+        cloudlog.exception("Error processing UDS response")
+        return None
+      finally:
+        self._sessions.remove(session)
+
+  async def _exchange(self, tx_addr: int, msg: IsoTpMessage, session: _Session, requests: List[bytes],
+                      responses: List[bytes], timeout: float) -> Optional[bytes]:
+    dat: Optional[bytes] = None
+    for i, (request, expected_response) in enumerate(zip(requests, responses)):
+      msg.send(request)
+      while True:
+        dat = msg.recv()
+        if dat:
+          break
+        session.event.clear()
+        try:
+          await asyncio.wait_for(session.event.wait(), timeout)
+        except asyncio.TimeoutError:
+          if i > 0:
+            cloudlog.warning(f"iso-tp query timeout after receiving response: {hex(tx_addr)}")
+          return None
+
+      if dat[:len(expected_response)] != expected_response:
+        cloudlog.warning(f"iso-tp query bad response: 0x{dat.hex()}")
+        return None
+    return dat[len(responses[-1]):] if dat is not None else None
+
+  async def query_many(self, queries: Dict, on_done: Optional[Callable[[], None]] = None) -> Dict:
+    """Runs all the queries concurrently, queries maps a key to the keyword arguments of query. Returns the responses
+    by key, for the queries that got one. on_done is called as each query finishes.
+    """
+    async def run_query(kwargs):
+      result = await self.query(**kwargs)
+      if on_done is not None:
+        on_done()
+      return result
+
+    results = await asyncio.gather(*[run_query(kwargs) for kwargs in queries.values()])
+    return {k: r for k, r in zip(queries.keys(), results) if r is not None}
+
+  async def query_functional(self, requests: List[bytes], responses: List[bytes], timeout: float = 0.1) \
+                             -> Dict[Tuple[int, Optional[int]], bytes]:
+    """Sends the requests to the OBD functional addresses. Returns the response of the first ECU answering on each
+    of them, by functional address."""
+    results = await asyncio.gather(*[self.query(addr, requests, responses, timeout=timeout)
+                                     for addr in FUNCTIONAL_ADDRS])
+    return {(addr, None): r for addr, r in zip(FUNCTIONAL_ADDRS, results) if r is not None}
+
+  def run(self, coro):
+    """Runs the coroutine (usually queries on this engine) while receiving the CAN traffic, returns its result"""
+    async def main():
+      # locks are bound to the event loop of this run
+      self._ecu_locks = defaultdict(asyncio.Lock)
+      self._active_sessions = asyncio.Semaphore(MAX_ACTIVE_SESSIONS)
+      self.can_recv()  # throw away any stale data
+      rx_task = asyncio.ensure_future(self._rx_loop())
+      try:
+        return await coro
+      finally:
+        rx_task.cancel()
+        self._flush_tx()
+
+    start_time = time.monotonic()
+    try:
+      return asyncio.run(main())
+    finally:
+      if self.debug:
+        print(f"iso-tp engine ran for {time.monotonic() - start_time:.3f}s")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import struct
+import time
+import unittest
+
+from selfdrive.car.isotp_async import AsyncIsoTpEngine, _Session
+
+BUS = 1
+
+
+class SimulatedEcu():
+  """ISO-TP server answering requests with fixed responses, with single or multi frame responses"""
+  def __init__(self, tx_addr, responses, rx_offset=0x8, sub_addr=None):
+    self.tx_addr = tx_addr  # address the ECU listens on
+    self.rx_addr = tx_addr + rx_offset
+    self.responses = responses  # request -> response
+    self.sub_addr = sub_addr
+    self.pending = b""
+    self.idx = 0
+    self.requests = []
+
+  def _frame(self, dat):
+    max_len = 8 if self.sub_addr is None else 7
+    dat = dat.ljust(max_len, b"\x00")
+    return (self.rx_addr, 0, dat if self.sub_addr is None else bytes([self.sub_addr]) + dat, BUS)
+
+  def _consecutive_frames(self):
+    num_bytes = 7 if self.sub_addr is None else 6
+    frames = []
+    while len(self.pending):
+      self.idx += 1
+      frames.append(self._frame(bytes([0x20 | (self.idx & 0xF)]) + self.pending[:num_bytes]))
+      self.pending = self.pending[num_bytes:]
+    return frames
+
+  def rx(self, addr, dat):
+    if addr != self.tx_addr:
+      return []
+    if self.sub_addr is not None:
+      if dat[0] != self.sub_addr:
+        return []
+      dat = dat[1:]
+
+    if dat[0] >> 4 == 0x3:  # flow control
+      return self._consecutive_frames()
+
+    request = dat[1:1 + (dat[0] & 0xF)]
+    self.requests.append(request)
+    response = self.responses.get(request)
+    if response is None:
+      return []
+    max_single = 7 if self.sub_addr is None else 6
+    if len(response) < max_single:
+      return [self._frame(bytes([len(response)]) + response)]
+    first = max_single - 1
+    self.pending, self.idx = response[first:], 0
+    return [self._frame(struct.pack("!H", 0x1000 | len(response)) + response[:first])]
+
+
+class SimulatedBus():
+  """CAN bus connecting the engine and the ECUs, responses are received on the next poll"""
+  def __init__(self, ecus):
+    self.ecus = ecus
+    self.rx_queue = []
+    self.sends = 0
+
+  def can_send(self, msgs):
+    self.sends += 1
+    for addr, _, dat, bus in msgs:
+      if bus == BUS:
+        for ecu in self.ecus:
+          self.rx_queue += ecu.rx(addr, dat)
+
+  def can_recv(self):
+    msgs, self.rx_queue = self.rx_queue, []
+    return msgs
+
+
+VERSION_REQUEST = b"\x22\xf1\x81"
+VERSION_RESPONSE = b"\x62\xf1\x81"
+
+
+class TestAsyncIsoTpEngine(unittest.TestCase):
+  def test_concurrent_queries(self):
+    ecus = [SimulatedEcu(0x700 + i, {VERSION_REQUEST: VERSION_RESPONSE + f"version {i}".encode() * (i + 1)})
+            for i in range(20)]
+    bus = SimulatedBus(ecus)
+    engine = AsyncIsoTpEngine(bus.can_send, bus.can_recv, BUS)
+
+    # includes ECUs not answering, which have to time out
+    queries = {addr: dict(tx_addr=addr, requests=[VERSION_REQUEST], responses=[VERSION_RESPONSE], timeout=0.1)
+               for addr in range(0x700, 0x720)}
+    start = time.monotonic()
+    results = engine.run(engine.query_many(queries))
+    elapsed = time.monotonic() - start
+
+    self.assertEqual(results, {0x700 + i: f"version {i}".encode() * (i + 1) for i in range(20)})
+    # all the sessions share the timeout window instead of timing out one after the other
+    self.assertLess(elapsed, 0.5)
+
+  def test_requests_to_same_ecu_in_order(self):
+    ecu = SimulatedEcu(0x7e0, {b"\x3e": b"\x7e", VERSION_REQUEST: VERSION_RESPONSE + b"abc", b"\x10\x03": b"\x50\x03"})
+    bus = SimulatedBus([ecu])
+    engine = AsyncIsoTpEngine(bus.can_send, bus.can_recv, BUS)
+
+    queries = {
+      'version': dict(tx_addr=0x7e0, requests=[b"\x3e", VERSION_REQUEST], responses=[b"\x7e", VERSION_RESPONSE]),
+      'session': dict(tx_addr=0x7e0, requests=[b"\x10\x03"], responses=[b"\x50\x03"]),
+      'bad': dict(tx_addr=0x7e0, requests=[b"\x10\x03"], responses=[b"\x50\x02"]),
+    }
+    results = engine.run(engine.query_many(queries))
+    self.assertEqual(results, {'version': b"abc", 'session': b""})
+    self.assertEqual(ecu.requests, [b"\x3e", VERSION_REQUEST, b"\x10\x03", b"\x10\x03"])
+
+  def test_sub_addresses(self):
+    ecus = [SimulatedEcu(0x750, {VERSION_REQUEST: VERSION_RESPONSE + bytes([s]) * 20}, sub_addr=s, rx_offset=0x8)
+            for s in (0x0f, 0x6d)]
+    bus = SimulatedBus(ecus)
+    engine = AsyncIsoTpEngine(bus.can_send, bus.can_recv, BUS)
+
+    queries = {s: dict(tx_addr=0x750, sub_addr=s, requests=[VERSION_REQUEST], responses=[VERSION_RESPONSE])
+               for s in (0x0f, 0x6d, 0x40)}
+    results = engine.run(engine.query_many(queries))
+    self.assertEqual(results, {0x0f: b"\x0f" * 20, 0x6d: b"\x6d" * 20})
+
+  def test_functional_query(self):
+    ecus = [SimulatedEcu(0x7e1, {b"\x09\x02": b"\x49\x02\x01" + b"1HGCM82633A004352"})]
+    bus = SimulatedBus(ecus)
+    engine = AsyncIsoTpEngine(bus.can_send, bus.can_recv, BUS)
+
+    # functional requests are received by all ECUs, route them to the physical address of the simulated one
+    can_send = bus.can_send
+    bus.can_send = lambda msgs: can_send([(0x7e1 if a == 0x7df else a, t, d, b) for a, t, d, b in msgs])
+    engine.can_send = bus.can_send
+
+    results = engine.run(engine.query_functional([b"\x09\x02"], [b"\x49\x02\x01"]))
+    self.assertEqual(results, {(0x7df, None): b"1HGCM82633A004352"})
+
+  def test_functional_query_29_bit(self):
+    responses = {b"\x09\x02": b"\x49\x02\x01" + b"1HGCM82633A004352"}
+    ecus = [SimulatedEcu(0x18da10f1, responses, rx_offset=0x18daf110 - 0x18da10f1)]
+    bus = SimulatedBus(ecus)
+    sent = []
+    can_send = bus.can_send
+    # functional requests are received by all ECUs, route them to the physical address of the simulated one
+    bus.can_send = lambda msgs: sent.extend(msgs) or \
+      can_send([(0x18da10f1 if a == 0x18db33f1 else a, t, d, b) for a, t, d, b in msgs])
+    engine = AsyncIsoTpEngine(bus.can_send, bus.can_recv, BUS)
+
+    results = engine.run(engine.query_functional([b"\x09\x02"], [b"\x49\x02\x01"]))
+
+    # the response is only received by the 29 bit session, which sends the flow control to the physical address
+    self.assertEqual(results, {(0x18db33f1, None): b"1HGCM82633A004352"})
+    flow_control_addrs = {a for a, _, d, _ in sent if d[0] >> 4 == 0x3}
+    self.assertEqual(flow_control_addrs, {0x18da10f1})
+
+  def test_functional_session_accepts_its_addressing_scheme(self):
+    session_11_bit = _Session(0x7df, None, None)
+    session_29_bit = _Session(0x18db33f1, None, None)
+    for addr in (0x7e8, 0x7ef):
+      self.assertTrue(session_11_bit.accepts(addr, b""))
+      self.assertFalse(session_29_bit.accepts(addr, b""))
+    for addr in (0x18daf100, 0x18daf1ff):
+      self.assertFalse(session_11_bit.accepts(addr, b""))
+      self.assertTrue(session_29_bit.accepts(addr, b""))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -11,13 +11,14 @@ from selfdrive.car.toyota.values import CAR, DBC, STEER_THRESHOLD, NO_STOP_TIMER
 from selfdrive.car.toyota.values import CAR, DBC, STEER_THRESHOLD, NO_STOP_TIMER_CAR, TSS2_CAR
 from selfdrive.swaglog import cloudlog
 from common.realtime import DT_CTRL, sec_since_boot
-from common.params import Params
+from common.params import get_cached_params
 
 
 class CarState(CarStateBase):
   def __init__(self, CP):
     super().__init__(CP)
     can_define = CANDefine(DBC[CP.carFingerprint]["pt"])
+    self.params = get_cached_params()
     self.shifter_values = can_define.dv["GEAR_PACKET"]["GEAR"]
 
     # All TSS2 car have the accurate sensor
@@ -82,10 +83,10 @@ class CarState(CarStateBase):
     # update prevs, update must run once per loop
     self.prev_cruise_buttons = self.cruise_buttons
     self.prev_lkas_enabled = self.lkas_enabled
-    self.mads_enabled = Params().get_bool("EnableMADS")
-    self.acc_mads_combo = Params().get_bool("ACCMADSCombo")
-    self.gap_adjust_cruise = Params().get_bool("GapAdjustCruise")
-    self.gap_adjust_cruise_tr_line = int(Params().get("GapAdjustCruiseTr"))
+    self.mads_enabled = self.params.get_bool("EnableMADS")
+    self.acc_mads_combo = self.params.get_bool("ACCMADSCombo")
+    self.gap_adjust_cruise = self.params.get_bool("GapAdjustCruise")
+    self.gap_adjust_cruise_tr_line = self.params.get_int("GapAdjustCruiseTr")
 
     ret.doorOpen = any([cp.vl["SEATS_DOORS"]["DOOR_OPEN_FL"], cp.vl["SEATS_DOORS"]["DOOR_OPEN_FR"],
                         cp.vl["SEATS_DOORS"]["DOOR_OPEN_RL"], cp.vl["SEATS_DOORS"]["DOOR_OPEN_RR"]])
@@ -220,7 +221,7 @@ class CarState(CarStateBase):
       ret.cruiseState.speed = cp.vl["PCM_CRUISE_2"]["SET_SPEED"] * self.CP.wheelSpeedFactor * CV.KPH_TO_MS
 
     if self.CP.carFingerprint in TSS2_CAR:
-      self.acc_type = 1 if Params().get_bool('StopAndGoHack') else cp_cam.vl["ACC_CONTROL"]["ACC_TYPE"]
+      self.acc_type = 1 if self.params.get_bool('StopAndGoHack') else cp_cam.vl["ACC_CONTROL"]["ACC_TYPE"]
 
     if self.CP.carFingerprint in TSS2_CAR:
       if self.gap_adjust_cruise:
@@ -234,7 +235,7 @@ class CarState(CarStateBase):
         ret.gapAdjustCruiseTr = cp.vl["PCM_CRUISE_SM"]["DISTANCE_LINES"]
 
     # Toyota 5/5 Speed Increments
-    self.Fast_Speed_Increments = 2 if Params().get_bool('Change5speed') else 1
+    self.Fast_Speed_Increments = 2 if self.params.get_bool('Change5speed') else 1
 
     # some TSS2 cars have low speed lockout permanently set, so ignore on those cars
     # these cars are identified by an ACC_TYPE value of 2.
@@ -313,7 +314,7 @@ class CarState(CarStateBase):
     self.stock_aeb = copy.copy(cp_cam.vl["PRE_COLLISION_2"])
     self.brakehold_condition_satisfied =  (ret.standstill and ret.cruiseState.available and not ret.gasPressed and \
                                           not ret.cruiseState.enabled and not (ret.gearShifter in (self.GearShifter.reverse,\
-                                          self.GearShifter.park)) and Params().get_bool('AleSato_AutomaticBrakeHold'))
+                                          self.GearShifter.park)) and self.params.get_bool('AleSato_AutomaticBrakeHold'))
     if self.brakehold_condition_satisfied:
       if self.brakehold_condition_counter > self.time_to_brakehold and not self.reset_brakehold:
         self.brakehold_governor = True
@@ -2,8 +2,7 @@
 import traceback
 
 import cereal.messaging as messaging
-from panda.python.uds import FUNCTIONAL_ADDRS
-from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from selfdrive.car.isotp_async import AsyncIsoTpEngine, can_io_from_sockets
 from selfdrive.swaglog import cloudlog
 
 VIN_REQUEST = b'\x09\x02'
@@ -12,10 +11,11 @@ VIN_UNKNOWN = "0" * 17
 
 
 def get_vin(logcan, sendcan, bus, timeout=0.1, retry=5, debug=False):
+  engine = AsyncIsoTpEngine(*can_io_from_sockets(sendcan, logcan), bus, debug=debug)
   for i in range(retry):
     try:
-      query = IsoTpParallelQuery(sendcan, logcan, bus, FUNCTIONAL_ADDRS, [VIN_REQUEST], [VIN_RESPONSE], functional_addr=True, debug=debug)
-      for addr, vin in query.get_data(timeout).items():
+      results = engine.run(engine.query_functional([VIN_REQUEST], [VIN_RESPONSE], timeout=timeout))
+      for addr, vin in results.items():
         return addr[0], vin.decode()
       print(f"vin query retry ({i+1}) ...")
     except Exception:
@@ -6,8 +6,8 @@ from numbers import Number
 from cereal import car, log
 from common.numpy_fast import clip
 from common.realtime import sec_since_boot, config_realtime_process, Priority, Ratekeeper, DT_CTRL
-from common.profiler import Profiler
-from common.params import Params, put_nonblocking
+from common.profiler import LatencyProfiler
+from common.params import Params, get_cached_params, put_nonblocking
 import cereal.messaging as messaging
 from selfdrive.config import Conversions as CV
 from selfdrive.swaglog import cloudlog
@@ -64,23 +64,25 @@ class Controls:
     self.pm = pm
     if self.pm is None:
       self.pm = messaging.PubMaster(['sendcan', 'controlsState', 'carState',
-                                     'carControl', 'carEvents', 'carParams'])
+                                     'carControl', 'carEvents', 'carParams', 'controlsdLatency'])
 
     self.camera_packets = ["roadCameraState", "driverCameraState"]
     if TICI:
       self.camera_packets.append("wideRoadCameraState")
 
     params = Params()
+    self.cached_params = get_cached_params()
     self.joystick_mode = params.get_bool("JoystickDebugMode")
     joystick_packet = ['testJoystick'] if self.joystick_mode else []
 
     self.sm = sm
     if self.sm is None:
       ignore = ['driverCameraState', 'managerState'] if SIMULATION else None
-      self.sm = messaging.SubMaster(['deviceState', 'pandaStates', 'peripheralState', 'modelV2', 'liveCalibration',
-                                     'driverMonitoringState', 'longitudinalPlan', 'lateralPlan', 'liveLocationKalman',
-                                     'managerState', 'liveParameters', 'radarState'] + self.camera_packets + joystick_packet,
-                                     ignore_alive=ignore, ignore_avg_freq=['radarState', 'longitudinalPlan'])
+      self.sm = messaging.LazySubMaster(['deviceState', 'pandaStates', 'peripheralState', 'modelV2',
+                                         'liveCalibration', 'driverMonitoringState', 'longitudinalPlan', 'lateralPlan',
+                                         'liveLocationKalman', 'managerState', 'liveParameters', 'radarState'] +
+                                        self.camera_packets + joystick_packet, ignore_alive=ignore,
+                                        ignore_avg_freq=['radarState', 'longitudinalPlan'])
 
     self.can_sock = can_sock
     if can_sock is None:
@@ -125,6 +127,8 @@ class Controls:
     put_nonblocking("CarParamsCache", cp_bytes)
 
     self.CC = car.CarControl.new_message()
+    # carControl is written in place every cycle, see MessagePool
+    self.msg_pool = messaging.MessagePool()
     self.AM = AlertManager()
     self.events = Events()
 
@@ -184,7 +188,8 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    # stage latency is only published when running with our own sockets
+    self.prof = LatencyProfiler('controlsdLatency', DT_CTRL, pm=self.pm if pm is None else None)
 
   def update_events(self, CS):
     """Compute carEvents from carState"""
@@ -240,7 +245,7 @@ class Controls:
         self.events.add(EventName.calibrationInvalid)
 
     # Handle lane change
-    lane_change_set_timer = int(Params().get("AutoLaneChangeTimer", encoding="utf8"))
+    lane_change_set_timer = self.cached_params.get_int("AutoLaneChangeTimer")
     if self.sm['lateralPlan'].laneChangeState == LaneChangeState.preLaneChange:
       direction = self.sm['lateralPlan'].laneChangeDirection
       if (CS.leftBlindspot and direction == LaneChangeDirection.left) or \
@@ -358,7 +363,7 @@ class Controls:
       # Check if all manager processes are running
       not_running = set(p.name for p in self.sm['managerState'].processes if not p.running)
       if self.sm.rcv_frame['managerState'] and (not_running - IGNORE_PROCESSES):
-        if not Params().get_bool("ProcessNotRunningOff"):
+        if not self.cached_params.get_bool("ProcessNotRunningOff"):
           self.events.add(EventName.processNotRunning)
 
     # Only allow engagement with brake pressed when stopped behind another stopped car
@@ -376,7 +381,10 @@ class Controls:
 
     # Update carState from CAN
     can_strs = messaging.drain_sock_raw(self.can_sock, wait_for_one=True)
+    # the cycle starts with the CAN data, waiting for it is not part of the latency
+    self.prof.start()
     CS = self.CI.update(self.CC, can_strs)
+    self.prof.checkpoint("Car interface")
 
     self.sm.update(0)
 
@@ -505,7 +513,7 @@ class Controls:
     lat_plan = self.sm['lateralPlan']
     long_plan = self.sm['longitudinalPlan']
 
-    actuators = car.CarControl.Actuators.new_message()
+    actuators = self.msg_pool.new_message('carControl').carControl.actuators
     actuators.longControlState = self.LoC.long_control_state
 
     if CS.leftBlinker or CS.rightBlinker:
@@ -536,6 +544,7 @@ class Controls:
                                                                              desired_curvature, desired_curvature_rate)
     else:
       lac_log = log.ControlsState.LateralDebugState.new_message()
+      actuators.accel, actuators.steer, actuators.steeringAngleDeg = 0., 0., 0.
       if self.sm.rcv_frame['testJoystick'] > 0 and self.active:
         actuators.accel = 4.0*clip(self.sm['testJoystick'].axes[0], -1, 1)
 
@@ -596,14 +605,17 @@ class Controls:
   def publish_logs(self, CS, start_time, actuators, lac_log):
     """Send actuators and hud commands to the car, send controlsstate and MPC logging"""
 
-    CC = car.CarControl.new_message()
+    # the builder of the previous cycle, with the actuators of state_control. All the fields are written every cycle
+    cc_send = self.msg_pool.new_message('carControl')
+    CC = cc_send.carControl
     CC.enabled = self.enabled
     CC.active = self.active
-    CC.actuators = actuators
 
     if len(self.sm['liveLocationKalman'].orientationNED.value) > 2:
       CC.roll = self.sm['liveLocationKalman'].orientationNED.value[0]
       CC.pitch = self.sm['liveLocationKalman'].orientationNED.value[1]
+    else:
+      CC.roll, CC.pitch = 0., 0.
 
     CC.cruiseControl.cancel = CS.cruiseState.enabled and (not self.enabled or not self.CP.pcmCruise)
     if self.joystick_mode and self.sm.rcv_frame['testJoystick'] > 0 and self.sm['testJoystick'].buttons[0]:
@@ -621,6 +633,8 @@ class Controls:
     ldw_allowed = self.is_ldw_enabled and CS.vEgo > LDW_MIN_SPEED and not recent_blinker \
                     and not self.active and self.sm['liveCalibration'].calStatus == Calibration.CALIBRATED
 
+    CC.hudControl.leftLaneDepart = False
+    CC.hudControl.rightLaneDepart = False
     meta = self.sm['modelV2'].meta
     if len(meta.desirePrediction) and ldw_allowed:
       right_lane_visible = self.sm['lateralPlan'].rProb > 0.5
@@ -727,23 +741,21 @@ class Controls:
       self.pm.send('carParams', cp_send)
 
     # carControl
-    cc_send = messaging.new_message('carControl')
     cc_send.valid = CS.canValid
-    cc_send.carControl = CC
-    self.pm.send('carControl', cc_send)
+    self.pm.send('carControl', self.msg_pool.to_bytes(cc_send))
 
-    # copy CarControl to pass to CarInterface on the next iteration
+    # keep CarControl to pass to CarInterface on the next iteration
     self.CC = CC
 
   def step(self):
     start_time = sec_since_boot()
-    self.prof.checkpoint("Ratekeeper", ignore=True)
 
     # Sample data from sockets and get a carState
     CS = self.data_sample()
     self.prof.checkpoint("Sample")
 
     self.update_events(CS)
+    self.prof.checkpoint("Events")
 
     if not self.read_only:
       # Update control state
@@ -760,12 +772,12 @@ class Controls:
     self.prof.checkpoint("Sent")
 
     self.update_button_timers(CS.buttonEvents)
+    self.prof.end()
 
   def controlsd_thread(self):
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
 
 def main(sm=None, pm=None, logcan=None):
   controls = Controls(sm, pm, logcan)
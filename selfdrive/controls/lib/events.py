@@ -1,5 +1,7 @@
 from enum import IntEnum
-from typing import Dict, Union, Callable
+from typing import Callable, Dict, List, Union
+
+import numpy as np
 
 from cereal import log, car
 import cereal.messaging as messaging
@@ -40,11 +42,23 @@ class ET:
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
 
 
+# bit of each event type in the event type masks
+ET_BITS = {et: 1 << i for i, et in enumerate([ET.ENABLE, ET.PRE_ENABLE, ET.NO_ENTRY, ET.WARNING, ET.USER_DISABLE,
+                                              ET.SOFT_DISABLE, ET.IMMEDIATE_DISABLE, ET.PERMANENT])}
+EVENT_COUNT = max(EventName.schema.enumerants.values()) + 1
+
+
 class Events:
   def __init__(self):
     self.events = []
     self.static_events = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    # number of consecutive cycles each event was active before this one, by event name
+    self.events_prev = np.zeros(EVENT_COUNT, dtype=np.int64)
+    self.prev_active = set()
+
+    # event types of the events, of the static ones
+    self.et_mask = 0
+    self.static_et_mask = 0
 
   @property
   def names(self):
@@ -56,50 +70,59 @@ class Events:
   def add(self, event_name, static=False):
     if static:
       self.static_events.append(event_name)
+      self.static_et_mask |= EVENT_ET_MASK[event_name]
     self.events.append(event_name)
+    self.et_mask |= EVENT_ET_MASK[event_name]
 
   def clear(self):
-    self.events_prev = {k: (v + 1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    active = set(self.events)
+    for e in self.prev_active - active:
+      self.events_prev[e] = 0
+    for e in active:
+      self.events_prev[e] += 1
+    self.prev_active = active
+
     self.events = self.static_events.copy()
+    self.et_mask = self.static_et_mask
 
   def any(self, event_type):
-    for e in self.events:
-      if event_type in EVENTS.get(e, {}).keys():
-        return True
-    return False
+    return bool(self.et_mask & ET_BITS[event_type])
 
   def create_alerts(self, event_types, callback_args=None):
     if callback_args is None:
       callback_args = []
 
+    types_mask = 0
+    for et in event_types:
+      types_mask |= ET_BITS[et]
+
     ret = []
+    if not self.et_mask & types_mask:
+      return ret
+
     for e in self.events:
-      types = EVENTS[e].keys()
+      if not EVENT_ET_MASK[e] & types_mask:
+        continue
+      alerts = EVENTS[e]
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
-          if not isinstance(alert, Alert):
-            alert = alert(*callback_args)
-
-          if DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
-            alert.event_type = et
-            ret.append(alert)
+        alert = alerts.get(et)
+        if alert is None:
+          continue
+        if not isinstance(alert, Alert):
+          alert = alert(*callback_args)
+          alert.alert_type = EVENT_ALERT_TYPES[e][et]
+          alert.event_type = et
+
+        if alert.creation_delay == 0. or DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
+          ret.append(alert)
     return ret
 
   def add_from_msg(self, events):
     for e in events:
-      self.events.append(e.name.raw)
+      self.add(e.name.raw)
 
   def to_msg(self):
-    ret = []
-    for event_name in self.events:
-      event = car.CarEvent.new_message()
-      event.name = event_name
-      for event_type in EVENTS.get(event_name, {}).keys():
-        setattr(event, event_type, True)
-      ret.append(event)
-    return ret
+    return [EVENT_MSGS[e] for e in self.events]
 
 
 class Alert:
@@ -937,3 +960,22 @@ EVENTS: Dict[int, Dict[str, Union[Alert, AlertCallbackType]]] = {
       Priority.LOWEST, VisualAlert.none, AudibleAlert.engageBrakehold, .1,),
   },  
 }
+
+
+# Compiled EVENTS, indexed by event name: the mask of the event types of each event, the type of each of its alerts
+# and a prebuilt CarEvent. The static alerts get their type here, once.
+EVENT_ET_MASK = [0] * EVENT_COUNT
+EVENT_ALERT_TYPES: List[Dict[str, str]] = [{} for _ in range(EVENT_COUNT)]
+EVENT_MSGS = [None] * EVENT_COUNT
+
+for _name, _e in EventName.schema.enumerants.items():
+  _alerts = EVENTS.get(_e, {})
+  _msg = car.CarEvent.new_message(name=_e)
+  for _et, _alert in _alerts.items():
+    EVENT_ET_MASK[_e] |= ET_BITS[_et]
+    EVENT_ALERT_TYPES[_e][_et] = f"{_name}/{_et}"
+    if isinstance(_alert, Alert):
+      _alert.alert_type = EVENT_ALERT_TYPES[_e][_et]
+      _alert.event_type = _et
+    setattr(_msg, _et, True)
+  EVENT_MSGS[_e] = _msg.as_reader()
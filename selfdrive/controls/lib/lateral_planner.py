@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from common.params import Params
+from common.params import get_cached_params
 from common.realtime import sec_since_boot, DT_MDL
 from common.numpy_fast import interp
 from selfdrive.swaglog import cloudlog
@@ -49,7 +49,8 @@ class LateralPlanner:
 
     self.solution_invalid_cnt = 0
 
-    self.dynamic_lane_profile = int(Params().get("DynamicLaneProfile", encoding="utf8"))
+    self.params = get_cached_params()
+    self.dynamic_lane_profile = self.params.get_int("DynamicLaneProfile")
     self.dynamic_lane_profile_status = False
     self.dynamic_lane_profile_status_buffer = False
 
@@ -85,12 +86,12 @@ class LateralPlanner:
   def update(self, sm):
     self.second += DT_MDL
     if self.second > 1.0:
-      self.use_lanelines = not Params().get_bool("EndToEndToggle")
-      self.dynamic_lane_profile = int(Params().get("DynamicLaneProfile", encoding="utf8"))
+      self.use_lanelines = not self.params.get_bool("EndToEndToggle")
+      self.dynamic_lane_profile = self.params.get_int("DynamicLaneProfile")
       self.second = 0.0
     self.stand_still = sm['carState'].standStill
 
-    lane_change_set_timer = int(Params().get("AutoLaneChangeTimer", encoding="utf8"))
+    lane_change_set_timer = self.params.get_int("AutoLaneChangeTimer")
     lane_change_auto_timer = 0.0 if lane_change_set_timer == 0 else 0.1 if lane_change_set_timer == 1 else 0.5 if lane_change_set_timer == 2 \
       else 1.0 if lane_change_set_timer == 3 else 1.5 if lane_change_set_timer == 4 else 2.0
 
@@ -1,5 +1,5 @@
-from common.numpy_fast import mean
-from common.kalman.simple_kalman import KF1D
+import numpy as np
+
 from selfdrive.config import RADAR_TO_CAMERA
 
 
@@ -7,151 +7,144 @@ from selfdrive.config import RADAR_TO_CAMERA
 # TODO is this a good default?
 _LEAD_ACCEL_TAU = 1.5
 
-# radar tracks
-SPEED, ACCEL = 0, 1   # Kalman filter states enum
-
 # stationary qualification parameters
 v_ego_stationary = 4.   # no stationary object flag below this speed
 
 
-class Track():
-  def __init__(self, v_lead, kalman_params):
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel, y_rel, v_rel, v_lead, measured):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
-
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+class Tracks():
+  """Radar tracks as arrays sorted by trackId, each with a Kalman filter of the lead speed and acceleration.
+  All the tracks are updated at once, the KF is the same as KF1D"""
+  def __init__(self, kalman_params):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    # x = (A - K C) x + K meas, with a constant gain
+    self.K0_0, self.K1_0 = K[0][0], K[1][0]
+    self.A_K_0 = A[0][0] - self.K0_0 * C[0]
+    self.A_K_1 = A[0][1] - self.K0_0 * C[1]
+    self.A_K_2 = A[1][0] - self.K1_0 * C[0]
+    self.A_K_3 = A[1][1] - self.K1_0 * C[1]
+
+    self.ids = np.zeros(0, dtype=np.int64)
+    self.dRel = np.zeros(0)     # LONG_DIST
+    self.yRel = np.zeros(0)     # -LAT_DIST
+    self.vRel = np.zeros(0)     # REL_SPEED
+    self.vLead = np.zeros(0)
+    self.vLeadK = np.zeros(0)   # KF state
+    self.aLeadK = np.zeros(0)   # KF state
+    self.aLeadTau = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)   # measured or estimate
+    self.cnt = np.zeros(0, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def update(self, ids, d_rel, y_rel, v_rel, v_lead, measured):
+    """Replaces the tracks by the points of a radar frame, ids are sorted and unique. The tracks of the ids seen in the
+    previous frame keep their state, the other ones are dropped"""
+    idx = np.searchsorted(self.ids, ids)
+    known = idx < len(self.ids)
+    known[known] = self.ids[idx[known]] == ids[known]
+    idx = idx[known]
+
+    cnt = np.zeros(len(ids), dtype=np.int64)
+    cnt[known] = self.cnt[idx]
+    v_lead_k = v_lead.copy()
+    v_lead_k[known] = self.vLeadK[idx]
+    a_lead_k = np.zeros(len(ids))
+    a_lead_k[known] = self.aLeadK[idx]
+    a_lead_tau = np.full(len(ids), _LEAD_ACCEL_TAU)
+    a_lead_tau[known] = self.aLeadTau[idx]
+
+    # computed velocity and accelerations, new tracks start at the measurement
+    z = v_lead[known]
+    v, a = v_lead_k[known], a_lead_k[known]
+    v_lead_k[known] = self.A_K_0 * v + self.A_K_1 * a + self.K0_0 * z
+    a_lead_k[known] = self.A_K_2 * v + self.A_K_3 * a + self.K1_0 * z
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
+    a_lead_tau = np.where(np.abs(a_lead_k) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
 
-    self.cnt += 1
+    self.ids = ids
+    self.dRel = d_rel
+    self.yRel = y_rel
+    self.vRel = v_rel
+    self.vLead = v_lead
+    self.vLeadK = v_lead_k
+    self.aLeadK = a_lead_k
+    self.aLeadTau = a_lead_tau
+    self.measured = measured
+    self.cnt = cnt + 1
 
-  def get_key_for_cluster(self):
+  def get_keys_for_cluster(self):
     # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
-
-  def reset_a_lead(self, aLeadK, aLeadTau):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
-
-
-class Cluster():
-  def __init__(self):
-    self.tracks = set()
-
-  def add(self, t):
-    # add the first track
-    self.tracks.add(t)
-
-  # TODO: make generic
-  @property
-  def dRel(self):
-    return mean([t.dRel for t in self.tracks])
-
-  @property
-  def yRel(self):
-    return mean([t.yRel for t in self.tracks])
-
-  @property
-  def vRel(self):
-    return mean([t.vRel for t in self.tracks])
-
-  @property
-  def aRel(self):
-    return mean([t.aRel for t in self.tracks])
-
-  @property
-  def vLead(self):
-    return mean([t.vLead for t in self.tracks])
-
-  @property
-  def dPath(self):
-    return mean([t.dPath for t in self.tracks])
-
-  @property
-  def vLat(self):
-    return mean([t.vLat for t in self.tracks])
-
-  @property
-  def vLeadK(self):
-    return mean([t.vLeadK for t in self.tracks])
-
-  @property
-  def aLeadK(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return 0.
-    else:
-      return mean([t.aLeadK for t in self.tracks if t.cnt > 1])
-
-  @property
-  def aLeadTau(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return _LEAD_ACCEL_TAU
-    else:
-      return mean([t.aLeadTau for t in self.tracks if t.cnt > 1])
-
-  @property
-  def measured(self):
-    return any(t.measured for t in self.tracks)
-
-  def get_RadarState(self, model_prob=0.0):
+    return np.column_stack((self.dRel, self.yRel * 2, self.vRel))
+
+  def reset_a_lead(self, mask, aLeadK, aLeadTau):
+    self.vLeadK[mask] = self.vLead[mask]
+    self.aLeadK[mask] = aLeadK
+    self.aLeadTau[mask] = aLeadTau
+
+
+class Clusters():
+  """Means of the tracks of each cluster label, labels go from 0 to the number of clusters - 1"""
+  def __init__(self, tracks, labels):
+    self.labels = labels
+    n = int(labels.max()) + 1 if len(labels) else 0
+    count = np.bincount(labels, minlength=n)
+
+    self.dRel = np.bincount(labels, tracks.dRel, n) / count
+    self.yRel = np.bincount(labels, tracks.yRel, n) / count
+    self.vRel = np.bincount(labels, tracks.vRel, n) / count
+    self.vLead = np.bincount(labels, tracks.vLead, n) / count
+    self.vLeadK = np.bincount(labels, tracks.vLeadK, n) / count
+    self.measured = np.bincount(labels, tracks.measured, n) > 0
+
+    # the acceleration of the tracks updated more than once, if any
+    filtered = tracks.cnt > 1
+    filtered_count = np.bincount(labels, filtered, n)
+    has_filtered = filtered_count > 0
+    filtered_count[~has_filtered] = 1
+    self.aLeadK = np.where(has_filtered, np.bincount(labels, tracks.aLeadK * filtered, n) / filtered_count, 0.)
+    self.aLeadTau = np.where(has_filtered, np.bincount(labels, tracks.aLeadTau * filtered, n) / filtered_count,
+                             _LEAD_ACCEL_TAU)
+
+  def __len__(self):
+    return len(self.dRel)
+
+  def get_RadarState(self, i, model_prob=0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
+      "dRel": float(self.dRel[i]),
+      "yRel": float(self.yRel[i]),
+      "vRel": float(self.vRel[i]),
+      "vLead": float(self.vLead[i]),
+      "vLeadK": float(self.vLeadK[i]),
+      "aLeadK": float(self.aLeadK[i]),
       "status": True,
-      "fcw": self.is_potential_fcw(model_prob),
+      "fcw": is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "aLeadTau": float(self.aLeadTau)
+      "aLeadTau": float(self.aLeadTau[i])
     }
 
-  def get_RadarState_from_vision(self, lead_msg, v_ego):
-    return {
-      "dRel": float(lead_msg.x[0] - RADAR_TO_CAMERA),
-      "yRel": float(-lead_msg.y[0]),
-      "vRel": float(lead_msg.v[0] - v_ego),
-      "vLead": float(lead_msg.v[0]),
-      "vLeadK": float(lead_msg.v[0]),
-      "aLeadK": float(0),
-      "aLeadTau": _LEAD_ACCEL_TAU,
-      "fcw": False,
-      "modelProb": float(lead_msg.prob),
-      "radar": False,
-      "status": True
-    }
-
-  def __str__(self):
-    ret = "x: %4.1f  y: %4.1f  v: %4.1f  a: %4.1f" % (self.dRel, self.yRel, self.vRel, self.aLeadK)
-    return ret
-
   def potential_low_speed_lead(self, v_ego):
     # stop for stuff in front of you and low speed, even without model confirmation
-    return abs(self.yRel) < 1.5 and (v_ego < v_ego_stationary) and self.dRel < 25
-
-  def is_potential_fcw(self, model_prob):
-    return model_prob > .9
+    return (np.abs(self.yRel) < 1.5) & (v_ego < v_ego_stationary) & (self.dRel < 25)
+
+
+def get_RadarState_from_vision(lead_msg, v_ego):
+  return {
+    "dRel": float(lead_msg.x[0] - RADAR_TO_CAMERA),
+    "yRel": float(-lead_msg.y[0]),
+    "vRel": float(lead_msg.v[0] - v_ego),
+    "vLead": float(lead_msg.v[0]),
+    "vLeadK": float(lead_msg.v[0]),
+    "aLeadK": float(0),
+    "aLeadTau": _LEAD_ACCEL_TAU,
+    "fcw": False,
+    "modelProb": float(lead_msg.prob),
+    "radar": False,
+    "status": True
+  }
+
+
+def is_potential_fcw(model_prob):
+  return model_prob > .9
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import random
+import unittest
+import numpy as np
+
+from common.kalman.simple_kalman import KF1D
+from selfdrive.controls.radard import KalmanParams
+from selfdrive.controls.lib.radar_helpers import _LEAD_ACCEL_TAU, Clusters, Tracks
+
+
+def update(tracks, points):
+  ids = sorted(points)
+  d, y, v = (np.array([points[i][k] for i in ids], dtype=np.float64) for k in range(3))
+  tracks.update(np.array(ids, dtype=np.int64), d, y, v, v + 10., np.ones(len(ids), dtype=bool))
+
+
+class TestTracks(unittest.TestCase):
+  def setUp(self):
+    self.kalman_params = KalmanParams(0.05)
+    self.tracks = Tracks(self.kalman_params)
+
+  def test_kalman_filter(self):
+    kp = self.kalman_params
+    filters = {}
+    for _ in range(50):
+      points = {i: (random.uniform(0, 100), random.uniform(-5, 5), random.uniform(-10, 10)) for i in range(10)}
+      update(self.tracks, points)
+      for i, (_, _, v_rel) in points.items():
+        if i not in filters:
+          filters[i] = KF1D([[v_rel + 10.], [0.0]], kp.A, kp.C, kp.K)
+        else:
+          filters[i].update(v_rel + 10.)
+
+    np.testing.assert_allclose(self.tracks.vLeadK, [filters[i].x[0][0] for i in range(10)])
+    np.testing.assert_allclose(self.tracks.aLeadK, [filters[i].x[1][0] for i in range(10)])
+
+  def test_new_and_missing_tracks(self):
+    update(self.tracks, {3: (10., 0., -1.), 7: (20., 1., 0.)})
+    update(self.tracks, {3: (10., 0., -2.), 7: (20., 1., 0.)})
+    update(self.tracks, {1: (30., 0., 0.), 7: (20., 1., 0.)})
+
+    self.assertEqual(self.tracks.ids.tolist(), [1, 7])
+    self.assertEqual(self.tracks.cnt.tolist(), [1, 3])
+    self.assertEqual(self.tracks.vLeadK[0], 10.)
+    self.assertEqual(self.tracks.aLeadK[0], 0.)
+
+    update(self.tracks, {})
+    self.assertEqual(len(self.tracks), 0)
+
+  def test_acceleration_tau(self):
+    for i in range(20):
+      update(self.tracks, {0: (50., 0., -0.5 * i), 1: (40., 0., 0.)})
+    self.assertLess(self.tracks.aLeadTau[0], _LEAD_ACCEL_TAU)
+    self.assertEqual(self.tracks.aLeadTau[1], _LEAD_ACCEL_TAU)
+
+
+class TestClusters(unittest.TestCase):
+  def test_means(self):
+    tracks = Tracks(KalmanParams(0.05))
+    update(tracks, {0: (10., 1., -1.), 1: (12., 1.5, -3.), 2: (50., -2., 4.)})
+    update(tracks, {0: (10., 1., -1.), 1: (12., 1.5, -3.), 2: (50., -2., 4.), 5: (11., 1.2, -2.)})
+    clusters = Clusters(tracks, np.array([0, 0, 1, 0]))
+
+    self.assertEqual(len(clusters), 2)
+    np.testing.assert_allclose(clusters.dRel, [11., 50.])
+    np.testing.assert_allclose(clusters.yRel, [3.7 / 3, -2.])
+    np.testing.assert_allclose(clusters.vRel, [-2., 4.])
+    # the new track doesn't count for the acceleration
+    self.assertAlmostEqual(clusters.aLeadK[0], tracks.aLeadK[:2].mean())
+    self.assertTrue(clusters.measured.all())
+
+    lead = clusters.get_RadarState(1, model_prob=0.95)
+    self.assertTrue(lead['status'] and lead['radar'] and lead['fcw'])
+    self.assertEqual(lead['dRel'], 50.)
+
+  def test_new_tracks_only(self):
+    tracks = Tracks(KalmanParams(0.05))
+    update(tracks, {0: (3., 0.5, -1.), 1: (4., 0.7, -1.)})
+    clusters = Clusters(tracks, np.array([0, 0]))
+    self.assertEqual(clusters.aLeadK[0], 0.)
+    self.assertEqual(clusters.aLeadTau[0], _LEAD_ACCEL_TAU)
+    self.assertEqual(clusters.potential_low_speed_lead(2.).tolist(), [True])
+    self.assertEqual(clusters.potential_low_speed_lead(10.).tolist(), [False])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from cereal import car
 from common.params import Params
-from common.realtime import Priority, config_realtime_process
+from common.profiler import LatencyProfiler
+from common.realtime import Priority, config_realtime_process, DT_MDL
 from selfdrive.swaglog import cloudlog
 from selfdrive.controls.lib.longitudinal_planner import Planner
 from selfdrive.controls.lib.lateral_planner import LateralPlanner
@@ -29,6 +30,8 @@ def plannerd_thread(sm=None, pm=None):
     sm = messaging.SubMaster(['carState', 'controlsState', 'radarState', 'modelV2', 'lateralPlan', 'liveMapData'],
                              poll=['radarState', 'modelV2'], ignore_avg_freq=['radarState'])
 
+  prof_pm = messaging.PubMaster(['plannerdLatency']) if pm is None else None
+  prof = LatencyProfiler('plannerdLatency', DT_MDL, pm=prof_pm)
   if pm is None:
     pm = messaging.PubMaster(['longitudinalPlan', 'lateralPlan'])
 
@@ -36,10 +39,16 @@ def plannerd_thread(sm=None, pm=None):
     sm.update()
 
     if sm.updated['modelV2']:
+      prof.start()
       lateral_planner.update(sm)
+      prof.checkpoint("Lateral update")
       lateral_planner.publish(sm, pm)
+      prof.checkpoint("Lateral publish")
       longitudinal_planner.update(sm)
+      prof.checkpoint("Longitudinal update")
       longitudinal_planner.publish(sm, pm)
+      prof.checkpoint("Longitudinal publish")
+      prof.end()
 
 
 def main(sm=None, pm=None):
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Replays the CAN traffic of rlogs through the panda USB CAN packing: every `can` event is packed with
+pack_can_buffer, as sent by can_send_many, and each of the resulting USB transfers is unpacked with
+unpack_can_buffer. Checks that the messages round trip and reports the time spent packing and unpacking.
+
+  ./selfdrive/debug/can_packing_benchmark.py rlog.bz2 [rlog.bz2 ...]
+"""
+import argparse
+from time import perf_counter
+
+from panda import pack_can_buffer, unpack_can_buffer
+from tools.lib.logreader import LogReader
+
+
+def can_frames(log_paths):
+  # the messages of every can event, on the buses a panda can send to
+  for fn in log_paths:
+    for msg in LogReader(fn, services=['can']):
+      yield [(c.address, 0, c.dat, c.src) for c in msg.can if c.src < 8]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("logs", nargs="+", help="rlogs to replay")
+  args = parser.parse_args()
+
+  frames = [f for f in can_frames(args.logs) if len(f)]
+  msg_count = sum(len(f) for f in frames)
+  pack_time, unpack_time, transfer_bytes = 0., 0., 0
+
+  for frame in frames:
+    t = perf_counter()
+    transfers = pack_can_buffer(frame)
+    pack_time += perf_counter() - t
+
+    received = []
+    t = perf_counter()
+    for tx in transfers:
+      received += unpack_can_buffer(tx)
+    unpack_time += perf_counter() - t
+
+    transfer_bytes += sum(len(tx) for tx in transfers)
+    assert [(m[0], bytes(m[2]), m[3]) for m in received] == [(m[0], bytes(m[2]), m[3]) for m in frame], \
+      "CAN messages did not round trip"
+
+  print(f"{len(frames)} can events, {msg_count} messages, {transfer_bytes / 1e6:.1f} MB of USB transfers")
+  for name, total in [("pack", pack_time), ("unpack", unpack_time)]:
+    print(f"  {name:<8}{total:8.3f}s  {total / len(frames) * 1e6:8.1f} us/event  {total / msg_count * 1e6:6.2f} us/msg")
+
+
+if __name__ == "__main__":
+  main()
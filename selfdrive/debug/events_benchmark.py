@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Times the use of Events by controlsd in a 100Hz cycle: clear, add the car and monitoring events, the any() checks of
+the state transition, create_alerts and to_msg. Runs with different numbers of active events.
+
+  ./selfdrive/debug/events_benchmark.py [--cycles 20000]
+"""
+import argparse
+from time import perf_counter
+
+from cereal import car
+from selfdrive.controls.lib.events import ET, EVENTS, Alert, Events
+
+# any() calls of a controlsd cycle, state transition and controlsState
+ANY_CHECKS = [ET.USER_DISABLE, ET.IMMEDIATE_DISABLE, ET.SOFT_DISABLE, ET.PRE_ENABLE, ET.ENABLE, ET.NO_ENTRY, ET.NO_ENTRY]
+ALERT_TYPES = [ET.PERMANENT, ET.WARNING]
+EVENT_LOADS = [0, 1, 3, 10]
+
+
+def run(event_names, cycles):
+  # half of them come from carState, like the car interface events
+  car_events = [car.CarEvent.new_message(name=e).as_reader() for e in event_names[::2]]
+  extra_events = event_names[1::2]
+
+  events = Events()
+  t = perf_counter()
+  for _ in range(cycles):
+    events.clear()
+    events.add_from_msg(car_events)
+    for e in extra_events:
+      events.add(e)
+    for et in ANY_CHECKS:
+      events.any(et)
+    events.create_alerts(ALERT_TYPES)
+    events.to_msg()
+  return (perf_counter() - t) / cycles
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--cycles", type=int, default=20000)
+  args = parser.parse_args()
+
+  # events with static alerts only, the callbacks need a running controlsd
+  static_events = sorted(e for e, alerts in EVENTS.items() if all(isinstance(a, Alert) for a in alerts.values()))
+  for count in EVENT_LOADS:
+    cycle_time = run(static_events[:count], args.cycles)
+    print(f"{count:3d} events: {cycle_time * 1e6:7.1f} us/cycle, {cycle_time * 100 * 100:5.2f}% of a 100Hz cycle")
+
+
+if __name__ == "__main__":
+  main()
@@ -67,7 +67,7 @@ if __name__ == "__main__":
   if logs:
     for log in logs:
       if log:
-        lr = LogReader(log)
+        lr = LogReader(log, services=['logMessage', 'androidLog'])
         for m in lr:
           if m.which() == 'logMessage':
             print_logmessage(m.logMonoTime, m.logMessage, min_level)
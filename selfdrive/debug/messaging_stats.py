@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Shows the messaging stats (messagingStats) of the process with messaging instrumentation enabled: per service
+lag from publish to reception, estimated dropped messages, bandwidth and decode/encode time.
+
+  MESSAGING_STATS=controlsd ./selfdrive/manager/manager.py
+  ./selfdrive/debug/messaging_stats.py [--addr 192.168.5.11]
+  ./selfdrive/debug/messaging_stats.py --rlog rlog.bz2
+"""
+import argparse
+
+import cereal.messaging as messaging
+
+
+def histogram_percentile(counts, buckets, p):
+  # upper bound of the bucket holding the percentile p, inf for the last bucket
+  total = sum(counts)
+  if total == 0:
+    return 0.
+  target = total * p / 100.
+  cumulative = 0
+  for count, bound in zip(counts, list(buckets) + [float('inf')]):
+    cumulative += count
+    if cumulative >= target:
+      return bound
+  return float('inf')
+
+
+def format_stats(stats):
+  lines = [f"{stats.processName}, last {stats.periodSec:.1f}s",
+           f"{'service':<25}{'dir':>4}{'msgs':>7}{'drop':>6}{'KB/s':>9}{'lag mean':>10}{'p50':>8}{'p99':>8}"
+           f"{'max':>9}{'codec us':>10}{'max':>9}"]
+  for s in stats.services:
+    direction = "pub" if s.published else "sub"
+    if s.published:
+      lag = f"{'':>10}{'':>8}{'':>8}{'':>9}"
+    else:
+      p50 = histogram_percentile(s.lagHistogram, stats.lagBucketsMs, 50)
+      p99 = histogram_percentile(s.lagHistogram, stats.lagBucketsMs, 99)
+      lag = f"{s.lagMeanMs:>10.2f}{'<' + format(p50, 'g'):>8}{'<' + format(p99, 'g'):>8}{s.lagMaxMs:>9.2f}"
+    lines.append(f"{s.name:<25}{direction:>4}{s.msgCount:>7}{s.droppedCount:>6}{s.bytesPerSec / 1e3:>9.1f}{lag}"
+                 f"{s.codecMeanUs:>10.1f}{s.codecMaxUs:>9.1f}")
+  return "\n".join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--addr", default="127.0.0.1", help="address of the device")
+  parser.add_argument("--rlog", help="show the stats logged on this rlog instead of the live ones")
+  args = parser.parse_args()
+
+  if args.rlog is not None:
+    from tools.lib.logreader import LogReader
+    for msg in LogReader(args.rlog, services=['messagingStats']):
+      print(f"\n{msg.logMonoTime / 1e9:.2f}s {format_stats(msg.messagingStats)}")
+    return
+
+  sock = messaging.sub_sock('messagingStats', addr=args.addr)
+  while True:
+    msg = messaging.recv_one(sock)
+    if msg is not None:
+      print("\n" + format_stats(msg.messagingStats))
+
+
+if __name__ == "__main__":
+  main()
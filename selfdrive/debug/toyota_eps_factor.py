@@ -59,6 +59,6 @@ def get_eps_factor(lr, plot=False):
 
 if __name__ == "__main__":
   r = Route(sys.argv[1])
-  lr = MultiLogIterator(r.log_paths(), wraparound=False)
+  lr = MultiLogIterator(r.log_paths(), wraparound=False, services=['can'])
   n = get_eps_factor(lr, plot="--plot" in sys.argv)
   print("EPS torque factor: ", n)
@@ -58,6 +58,10 @@ class HardwareBase:
   def get_network_type(self):
     pass
 
+  def get_network_metered(self, network_type):
+    # unknown, the upload policy of the network type applies
+    return False
+
   @abstractmethod
   def get_sim_info(self):
     pass
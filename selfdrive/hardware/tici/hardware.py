@@ -13,6 +13,7 @@ from selfdrive.hardware.tici.amplifier import Amplifier
 
 NM = 'org.freedesktop.NetworkManager'
 NM_CON_ACT = NM + '.Connection.Active'
+NM_DEV = NM + '.Device'
 NM_DEV_WL = NM + '.Device.Wireless'
 NM_AP = NM + '.AccessPoint'
 DBUS_PROPS = 'org.freedesktop.DBus.Properties'
@@ -37,6 +38,13 @@ class MM_MODEM_STATE(IntEnum):
        CONNECTING    = 10
        CONNECTED     = 11
 
+class NMMetered(IntEnum):
+  NM_METERED_UNKNOWN = 0
+  NM_METERED_YES = 1
+  NM_METERED_NO = 2
+  NM_METERED_GUESS_YES = 3
+  NM_METERED_GUESS_NO = 4
+
 TIMEOUT = 0.1
 
 NetworkType = log.DeviceState.NetworkType
@@ -116,6 +124,25 @@ class Tici(HardwareBase):
 
     return NetworkType.none
 
+  def get_network_metered(self, network_type):
+    # NetworkManager knows when a wifi network is metered (e.g. a phone hotspot), or a cell connection isn't
+    try:
+      primary_connection = self.nm.Get(NM, 'PrimaryConnection', dbus_interface=DBUS_PROPS, timeout=TIMEOUT)
+      primary_connection = self.bus.get_object(NM, primary_connection)
+      primary_devices = primary_connection.Get(NM_CON_ACT, 'Devices', dbus_interface=DBUS_PROPS, timeout=TIMEOUT)
+
+      for dev in primary_devices:
+        dev_obj = self.bus.get_object(NM, str(dev))
+        metered = dev_obj.Get(NM_DEV, 'Metered', dbus_interface=DBUS_PROPS, timeout=TIMEOUT)
+        if metered in (NMMetered.NM_METERED_YES, NMMetered.NM_METERED_GUESS_YES):
+          return True
+        elif metered == NMMetered.NM_METERED_NO:
+          return False
+    except Exception:
+      pass
+
+    return super().get_network_metered(network_type)
+
   def get_modem(self):
     objects = self.mm.GetManagedObjects(dbus_interface="org.freedesktop.DBus.ObjectManager", timeout=TIMEOUT)
     modem_path = list(objects.keys())[0]
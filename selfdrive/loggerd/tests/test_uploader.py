@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from cereal import log
+from common.xattr import getxattr
+from selfdrive.loggerd import uploader
+from selfdrive.loggerd.uploader import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+
+NetworkType = log.DeviceState.NetworkType
+
+CHUNK_SIZE = 1000
+
+
+class BlobStoreHandler(BaseHTTPRequestHandler):
+  """Stand-in for the storage behind the upload urls: single PUT blobs, and block blobs (Put Block, Put Block List)"""
+  protocol_version = "HTTP/1.1"  # keep-alive, like the storage service
+  lock = threading.Lock()
+  blobs = {}
+  blocks = {}
+  requests = []
+  fail_blocks = set()  # block indexes failing once
+  active = 0
+  max_active = 0
+
+  def log_message(self, *args):
+    pass
+
+  def do_PUT(self):
+    cls = BlobStoreHandler
+    parts = urlsplit(self.path)
+    query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+    body = self.rfile.read(int(self.headers["Content-Length"]))
+
+    with cls.lock:
+      cls.active += 1
+      cls.max_active = max(cls.max_active, cls.active)
+      cls.requests.append((parts.path, query.get('comp'), self.client_address[1]))
+    try:
+      time.sleep(0.05)
+      status = 201
+      with cls.lock:
+        if query.get('sig') != 'valid':
+          status = 403
+        elif query.get('comp') == 'block':
+          idx = int(base64.b64decode(query['blockid']))
+          if idx in cls.fail_blocks:
+            cls.fail_blocks.remove(idx)
+            status = 500
+          else:
+            cls.blocks[(parts.path, query['blockid'])] = body
+        elif query.get('comp') == 'blocklist':
+          ids = [b.split("</Latest>")[0] for b in body.decode().split("<Latest>")[1:]]
+          if any((parts.path, i) not in cls.blocks for i in ids):
+            status = 400
+          else:
+            cls.blobs[parts.path] = b"".join(cls.blocks.pop((parts.path, i)) for i in ids)
+        else:
+          cls.blobs[parts.path] = body
+    finally:
+      with cls.lock:
+        cls.active -= 1
+
+    self.send_response(status)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+
+class FakeResponse():
+  def __init__(self, status_code, text):
+    self.status_code = status_code
+    self.text = text
+
+
+class FakeApi():
+  base_url = None
+
+  def __init__(self, dongle_id):
+    pass
+
+  def get_token(self):
+    return "token"
+
+  def get(self, endpoint, timeout=None, path=None, access_token=None):
+    url = f"{FakeApi.base_url}/{path}?sig=valid"
+    return FakeResponse(200, json.dumps({'url': url, 'headers': {'x-ms-blob-type': 'BlockBlob'}}))
+
+
+class TestUploader(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), BlobStoreHandler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    FakeApi.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    for name, value in [("Api", FakeApi), ("UPLOAD_CHUNK_SIZE", CHUNK_SIZE)]:
+      patcher = mock.patch.object(uploader, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    BlobStoreHandler.blobs = {}
+    BlobStoreHandler.blocks = {}
+    BlobStoreHandler.requests = []
+    BlobStoreHandler.fail_blocks = set()
+    BlobStoreHandler.max_active = 0
+    self.uploader = uploader.Uploader("0000000000000000", self.root)
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def make_file(self, route, name, size):
+    os.makedirs(os.path.join(self.root, route), exist_ok=True)
+    fn = os.path.join(self.root, route, name)
+    with open(fn, "wb") as f:
+      f.write(os.urandom(size))
+    return os.path.join(route, name), fn
+
+  def assertUploaded(self, key, fn):
+    with open(fn, "rb") as f:
+      self.assertEqual(BlobStoreHandler.blobs["/" + key], f.read())
+    self.assertEqual(getxattr(fn, UPLOAD_ATTR_NAME), UPLOAD_ATTR_VALUE)
+
+  def test_upload_order(self):
+    route = "2021-01-01--00-00-00"
+    for name in ["fcamera.hevc", "rlog.bz2", "qcamera.ts", "qlog.bz2"]:
+      self.make_file(f"{route}--0", name, 10)
+    self.make_file(f"{route}--1", "qlog.bz2", 10)
+    self.make_file("crash", "error.log", 10)
+    self.make_file(f"{route}--2", "rlog.bz2.lock", 0)
+    self.make_file(f"{route}--2", "qlog.bz2", 10)
+
+    self.assertEqual([key for key, _ in self.uploader.files_to_upload(with_raw=False)],
+                     ["crash/error.log", f"{route}--0/qlog.bz2", f"{route}--0/qcamera.ts", f"{route}--1/qlog.bz2"])
+    self.assertEqual([key for key, _ in self.uploader.files_to_upload(with_raw=True)][-2:],
+                     [f"{route}--0/rlog.bz2", f"{route}--0/fcamera.hevc"])
+    self.assertEqual(self.uploader.next_file_to_upload(with_raw=True)[0], "crash/error.log")
+
+  def test_small_file_single_put(self):
+    key, fn = self.make_file("2021-01-01--00-00-00--0", "qlog.bz2", CHUNK_SIZE - 1)
+    self.assertTrue(self.uploader.upload(key, fn))
+    self.assertUploaded(key, fn)
+    self.assertEqual([comp for _, comp, _ in BlobStoreHandler.requests], [None])
+
+  def test_large_file_in_blocks(self):
+    key, fn = self.make_file("2021-01-01--00-00-00--0", "fcamera.hevc", 5 * CHUNK_SIZE + 1)
+    self.assertTrue(self.uploader.upload(key, fn))
+    self.assertUploaded(key, fn)
+    self.assertEqual([comp for _, comp, _ in BlobStoreHandler.requests], ['block'] * 6 + ['blocklist'])
+    # the blocks go over the same connection
+    self.assertEqual(len({port for _, _, port in BlobStoreHandler.requests}), 1)
+
+  def test_resume_after_failure(self):
+    key, fn = self.make_file("2021-01-01--00-00-00--0", "fcamera.hevc", 5 * CHUNK_SIZE + 1)
+    BlobStoreHandler.fail_blocks = {3}
+    self.assertFalse(self.uploader.upload(key, fn))
+    self.assertEqual(uploader.get_upload_progress(fn, os.path.getsize(fn)), 3)
+
+    # a new uploader (e.g. after a restart) only uploads the missing blocks
+    BlobStoreHandler.requests = []
+    self.assertTrue(uploader.Uploader("0000000000000000", self.root).upload(key, fn))
+    self.assertUploaded(key, fn)
+    self.assertEqual([comp for _, comp, _ in BlobStoreHandler.requests], ['block'] * 3 + ['blocklist'])
+
+  def test_restart_when_blocks_are_gone(self):
+    key, fn = self.make_file("2021-01-01--00-00-00--0", "fcamera.hevc", 2 * CHUNK_SIZE)
+    uploader.set_upload_progress(fn, os.path.getsize(fn), 1)
+    self.assertFalse(self.uploader.upload(key, fn))
+    self.assertTrue(self.uploader.upload(key, fn))
+    self.assertUploaded(key, fn)
+
+  def test_concurrent_uploads(self):
+    files = [self.make_file(f"2021-01-01--00-00-00--{i}", "qlog.bz2", 100) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=uploader.MAX_UPLOAD_WORKERS) as executor:
+      self.assertTrue(all(executor.map(lambda f: self.uploader.upload(*f), files)))
+    for key, fn in files:
+      self.assertUploaded(key, fn)
+    self.assertGreater(BlobStoreHandler.max_active, 1)
+
+  def test_bandwidth_limit(self):
+    rate = 20e3
+    self.uploader.limiter = uploader.BandwidthLimiter(rate, burst=1000)
+    key, fn = self.make_file("2021-01-01--00-00-00--0", "rlog.bz2", 3 * CHUNK_SIZE)
+
+    t = time.monotonic()
+    self.assertTrue(self.uploader.upload(key, fn))
+    self.assertGreater(time.monotonic() - t, (3 * CHUNK_SIZE - 1000) / rate)
+    self.assertUploaded(key, fn)
+
+  def test_upload_policy(self):
+    self.assertIsNone(uploader.get_upload_policy(NetworkType.none, False))
+    self.assertEqual(uploader.get_upload_policy(NetworkType.wifi, False).rate, None)
+    for network_type in [NetworkType.wifi, NetworkType.cell4G, NetworkType.cell2G]:
+      policy = uploader.get_upload_policy(network_type, True)
+      self.assertEqual(policy.workers, 1)
+      self.assertFalse(policy.raw)
+      self.assertLessEqual(policy.rate, uploader.METERED_MAX_RATE)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import base64
 import json
 import os
 import random
@@ -6,7 +7,10 @@ import requests
 import threading
 import time
 import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from urllib.parse import urlencode, urlsplit
 
 from cereal import log
 import cereal.messaging as messaging
@@ -21,6 +25,24 @@ from selfdrive.swaglog import cloudlog
 NetworkType = log.DeviceState.NetworkType
 UPLOAD_ATTR_NAME = 'user.upload'
 UPLOAD_ATTR_VALUE = b'1'
+UPLOAD_PROGRESS_ATTR_NAME = 'user.upload_progress'
+
+MAX_UPLOAD_WORKERS = 4
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # larger files are uploaded in blocks of this size, resuming after a failure
+SCAN_INTERVAL = 10.  # seconds between looking for new files when there is nothing to upload
+METERED_MAX_RATE = 250e3  # bytes/s
+
+UploadPolicy = namedtuple('UploadPolicy', ['workers', 'rate', 'raw'])
+
+# concurrent uploads, bandwidth limit in bytes/s (None is unlimited) and whether raw files are uploaded by network type
+UPLOAD_POLICIES = {
+  NetworkType.wifi: UploadPolicy(MAX_UPLOAD_WORKERS, None, True),
+  NetworkType.ethernet: UploadPolicy(MAX_UPLOAD_WORKERS, None, True),
+  NetworkType.cell5G: UploadPolicy(2, 2e6, True),
+  NetworkType.cell4G: UploadPolicy(2, 1e6, True),
+  NetworkType.cell3G: UploadPolicy(1, 200e3, True),
+  NetworkType.cell2G: UploadPolicy(1, 20e3, False),
+}
 
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
@@ -39,6 +61,41 @@ def listdir_by_creation(d):
     cloudlog.exception("listdir_by_creation failed")
     return list()
 
+def get_upload_policy(network_type, metered):
+  policy = UPLOAD_POLICIES.get(network_type)
+  if policy is not None and metered:
+    # only the logs uploaded as soon as possible, with a single upload
+    rate = METERED_MAX_RATE if policy.rate is None else min(policy.rate, METERED_MAX_RATE)
+    policy = UploadPolicy(1, rate, False)
+  return policy
+
+def block_id(idx):
+  return base64.b64encode(f"{idx:08d}".encode()).decode()
+
+def url_with_params(url, **params):
+  parts = urlsplit(url)
+  query = "&".join(q for q in (parts.query, urlencode(params)) if q)
+  return parts._replace(query=query).geturl()
+
+def get_upload_progress(fn, sz):
+  # blocks of the file already uploaded
+  try:
+    progress = getxattr(fn, UPLOAD_PROGRESS_ATTR_NAME)
+    if progress is not None:
+      progress = json.loads(progress)
+      if progress['size'] == sz and progress['chunk_size'] == UPLOAD_CHUNK_SIZE:
+        return progress['blocks']
+  except (OSError, ValueError, KeyError):
+    cloudlog.exception("get_upload_progress failed")
+  return 0
+
+def set_upload_progress(fn, sz, blocks):
+  progress = {'size': sz, 'chunk_size': UPLOAD_CHUNK_SIZE, 'blocks': blocks}
+  try:
+    setxattr(fn, UPLOAD_PROGRESS_ATTR_NAME, json.dumps(progress).encode())
+  except OSError:
+    cloudlog.event("uploader_setxattr_failed", fn=fn, attr=UPLOAD_PROGRESS_ATTR_NAME)
+
 def clear_locks(root):
   for logname in os.listdir(root):
     path = os.path.join(root, logname)
@@ -50,16 +107,66 @@ def clear_locks(root):
       cloudlog.exception("clear_locks failed")
 
 
+class BandwidthLimiter():
+  """Token bucket shared by the uploads, limits their total bandwidth to rate bytes/s (None is unlimited)"""
+  def __init__(self, rate=None, burst=64*1024):
+    self.lock = threading.Lock()
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.last_time = time.monotonic()
+
+  def set_rate(self, rate):
+    with self.lock:
+      self.rate = rate
+
+  def consume(self, n):
+    with self.lock:
+      if self.rate is None:
+        return
+      t = time.monotonic()
+      self.tokens = min(self.burst, self.tokens + (t - self.last_time) * self.rate)
+      self.last_time = t
+      # the tokens can go negative, the next reads wait for the debt to be paid off
+      self.tokens -= n
+      wait_time = -self.tokens / self.rate
+    if wait_time > 0:
+      time.sleep(wait_time)
+
+
+class ThrottledReader():
+  """Request body reading length bytes of the file from offset, as fast as the limiter allows"""
+  def __init__(self, f, offset, length, limiter):
+    f.seek(offset)
+    self.f = f
+    self.length = length
+    self.remaining = length
+    self.limiter = limiter
+
+  def __len__(self):
+    return self.length
+
+  def read(self, size=-1):
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    self.limiter.consume(size)
+    dat = self.f.read(size)
+    self.remaining -= len(dat)
+    return dat
+
+
 class Uploader():
-  def __init__(self, dongle_id, root):
+  def __init__(self, dongle_id, root, limiter=None):
     self.dongle_id = dongle_id
     self.api = Api(dongle_id)
     self.root = root
 
-    self.upload_thread = None
-
-    self.last_resp = None
-    self.last_exc = None
+    # uploads share the connections and the bandwidth
+    self.session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_UPLOAD_WORKERS, pool_maxsize=MAX_UPLOAD_WORKERS)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+    self.limiter = BandwidthLimiter() if limiter is None else limiter
 
     self.immediate_size = 0
     self.immediate_count = 0
@@ -107,7 +214,7 @@ class Uploader():
         try:
           is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
         except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
+          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
           is_uploaded = True  # deleter could have deleted
         if is_uploaded:
           continue
@@ -121,67 +228,90 @@ class Uploader():
 
         yield (name, key, fn)
 
-  def next_file_to_upload(self, with_raw):
-    upload_files = list(self.list_upload_files())
-
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return (key, fn)
-
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (key, fn)
-
+  def get_upload_order(self, name, fn, with_raw):
+    # group of the file in upload order, None for files not uploaded
+    if any(f in fn for f in self.immediate_folders):
+      return 0
+    if name in self.immediate_priority:
+      return 1
     if with_raw:
       # then upload the full log files, rear and front camera files
-      for name, key, fn in upload_files:
-        if name in self.high_priority:
-          return (key, fn)
-
+      if name in self.high_priority:
+        return 2
       # Could add a param here to disable full video uploads
-      for name, key, fn in upload_files:
-        if name in self.normal_priority:
-          return (key, fn)
-
+      if name in self.normal_priority:
+        return 3
     return None
 
-  def do_upload(self, key, fn):
-    try:
-      url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
-      if url_resp.status_code == 412:
-        self.last_resp = url_resp
-        return
+  def files_to_upload(self, with_raw):
+    upload_files = []
+    for name, key, fn in self.list_upload_files():
+      order = self.get_upload_order(name, fn, with_raw)
+      if order is not None:
+        upload_files.append((order, key, fn))
+    return [(key, fn) for _, key, fn in sorted(upload_files, key=lambda f: f[0])]
 
-      url_resp_json = json.loads(url_resp.text)
-      url = url_resp_json['url']
-      headers = url_resp_json['headers']
-      cloudlog.debug("upload_url v1.4 %s %s", url, str(headers))
-
-      if fake_upload:
-        cloudlog.debug("*** WARNING, THIS IS A FAKE UPLOAD TO %s ***" % url)
-
-        class FakeResponse():
-          def __init__(self):
-            self.status_code = 200
+  def next_file_to_upload(self, with_raw):
+    upload_files = self.files_to_upload(with_raw)
+    return upload_files[0] if len(upload_files) else None
 
-        self.last_resp = FakeResponse()
-      else:
-        with open(fn, "rb") as f:
-          self.last_resp = requests.put(url, data=f, headers=headers, timeout=10)
-    except Exception as e:
-      self.last_exc = (e, traceback.format_exc())
-      raise
+  def do_upload(self, key, fn):
+    url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
+    if url_resp.status_code == 412:
+      return url_resp
+
+    url_resp_json = json.loads(url_resp.text)
+    url = url_resp_json['url']
+    headers = url_resp_json['headers']
+    cloudlog.debug("upload_url v1.4 %s %s", url, str(headers))
+
+    if fake_upload:
+      cloudlog.debug("*** WARNING, THIS IS A FAKE UPLOAD TO %s ***" % url)
+
+      class FakeResponse():
+        def __init__(self):
+          self.status_code = 200
+
+      return FakeResponse()
+
+    sz = os.path.getsize(fn)
+    with open(fn, "rb") as f:
+      if sz > UPLOAD_CHUNK_SIZE:
+        return self.upload_blocks(fn, f, sz, url, headers)
+      return self.session.put(url, data=ThrottledReader(f, 0, sz, self.limiter), headers=headers, timeout=10)
+
+  def upload_blocks(self, fn, f, sz, url, headers):
+    """Uploads the file as the blocks of a block blob, then commits the block list. The blocks uploaded are
+    recorded on the file, a failed upload resumes with the next block (uncommitted blocks are kept for a week)."""
+    headers = {k: v for k, v in headers.items() if k.lower() != 'x-ms-blob-type'}
+    block_count = (sz + UPLOAD_CHUNK_SIZE - 1) // UPLOAD_CHUNK_SIZE
+
+    start_block = get_upload_progress(fn, sz)
+    if start_block > 0:
+      cloudlog.event("upload_resume", fn=fn, sz=sz, block=start_block, blocks=block_count)
+
+    for idx in range(start_block, block_count):
+      offset = idx * UPLOAD_CHUNK_SIZE
+      body = ThrottledReader(f, offset, min(UPLOAD_CHUNK_SIZE, sz - offset), self.limiter)
+      resp = self.session.put(url_with_params(url, comp='block', blockid=block_id(idx)), data=body, headers=headers,
+                              timeout=10)
+      if resp.status_code not in (200, 201):
+        return resp
+      set_upload_progress(fn, sz, idx + 1)
+
+    block_list = "".join(f"<Latest>{block_id(idx)}</Latest>" for idx in range(block_count))
+    block_list = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'
+    resp = self.session.put(url_with_params(url, comp='blocklist'), data=block_list, headers=headers, timeout=10)
+    if resp.status_code == 400:
+      # the uploaded blocks are gone, start over
+      set_upload_progress(fn, sz, 0)
+    return resp
 
   def normal_upload(self, key, fn):
-    self.last_resp = None
-    self.last_exc = None
-
     try:
-      self.do_upload(key, fn)
-    except Exception:
-      pass
-
-    return self.last_resp
+      return self.do_upload(key, fn), None
+    except Exception as e:
+      return None, (e, traceback.format_exc())
 
   def upload(self, key, fn):
     try:
@@ -199,26 +329,26 @@ class Uploader():
         # tag files of 0 size as uploaded
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
       except OSError:
-        cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+        cloudlog.event("uploader_setxattr_failed", key=key, fn=fn, sz=sz)
       success = True
     else:
       start_time = time.monotonic()
       cloudlog.debug("uploading %r", fn)
-      stat = self.normal_upload(key, fn)
+      stat, exc = self.normal_upload(key, fn)
       if stat is not None and stat.status_code in (200, 201, 403, 412):
         cloudlog.event("upload_success" if stat.status_code != 412 else "upload_ignored", key=key, fn=fn, sz=sz, debug=True)
         try:
           # tag file as uploaded
           setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
         except OSError:
-          cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+          cloudlog.event("uploader_setxattr_failed", exc=exc, key=key, fn=fn, sz=sz)
 
         self.last_filename = fn
         self.last_time = time.monotonic() - start_time
         self.last_speed = (sz / 1e6) / self.last_time
         success = True
       else:
-        cloudlog.event("upload_failed", stat=stat, exc=self.last_exc, key=key, fn=fn, sz=sz, debug=True)
+        cloudlog.event("upload_failed", stat=stat, exc=exc, key=key, fn=fn, sz=sz, debug=True)
         success = False
 
     return success
@@ -251,23 +381,43 @@ def uploader_fn(exit_event):
   sm = messaging.SubMaster(['deviceState'])
   pm = messaging.PubMaster(['uploaderState'])
   uploader = Uploader(dongle_id, ROOT)
+  executor = ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS, thread_name_prefix='uploader')
+  uploads = {}  # futures of the uploads in progress by key
 
   backoff = 0.1
+  retry_time = 0.
   while not exit_event.is_set():
     sm.update(0)
 
+    for key, future in list(uploads.items()):
+      if not future.done():
+        continue
+      del uploads[key]
+      success = future.result()
+      if success:
+        backoff = 0.1
+      else:
+        cloudlog.info("upload backoff %r", backoff)
+        retry_time = time.monotonic() + backoff + random.uniform(0, backoff)
+        backoff = min(backoff*2, 120)
+
+      pm.send("uploaderState", uploader.get_msg())
+      cloudlog.info("upload done, success=%r", success)
+
     offroad = params.get_bool("IsOffroad")
     t = sec_since_boot()
     if offroad and not offroad_last and t > 300.:
       transition_to_offroad_last = sec_since_boot()
     offroad_last = offroad
 
-    offroad = params.get_bool("IsOffroad")
     network_type = sm['deviceState'].networkType if not force_wifi else NetworkType.wifi
-    if network_type == NetworkType.none:
+    metered = sm['deviceState'].networkMetered if not force_wifi else False
+    policy = get_upload_policy(network_type, metered)
+    if policy is None:
       if allow_sleep:
-        time.sleep(60 if offroad else 5)
+        exit_event.wait(60 if offroad else 5)
       continue
+    uploader.limiter.set_rate(policy.rate)
 
     if params.get_bool("DisableOnroadUploads"):
       if not offroad or (transition_to_offroad_last > 0. and t - transition_to_offroad_last < disable_onroad_upload_offroad_transition_timeout):
@@ -282,30 +432,27 @@ def uploader_fn(exit_event):
             time_left_str = f"{int(time_left)} seconds(s)"
           cloudlog.info(f"not uploading: waiting until offroad for {wait_minutes} minutes; {time_left_str} left")
         if allow_sleep:
-          time.sleep(60)
+          exit_event.wait(60)
         continue
 
-    allow_raw_upload = params.get_bool("UploadRaw")
-    d = uploader.next_file_to_upload(with_raw=allow_raw_upload)
-
-    if d is None:  # Nothing to upload
-      if allow_sleep:
-        time.sleep(60 if offroad else 5)
-      continue
-
-    key, fn = d
-
-    cloudlog.debug("upload %r over %s", d, network_type)
-    success = uploader.upload(key, fn)
-    if success:
-      backoff = 0.1
+    if len(uploads) < policy.workers and time.monotonic() >= retry_time:
+      allow_raw_upload = params.get_bool("UploadRaw") and policy.raw
+      for key, fn in uploader.files_to_upload(with_raw=allow_raw_upload):
+        if len(uploads) >= policy.workers:
+          break
+        if key not in uploads:
+          cloudlog.debug("upload %r over %s", (key, fn), network_type)
+          uploads[key] = executor.submit(uploader.upload, key, fn)
+
+    if len(uploads):
+      # wake up as soon as an upload is done to start the next one
+      wait(list(uploads.values()), timeout=1., return_when=FIRST_COMPLETED)
     elif allow_sleep:
-      cloudlog.info("upload backoff %r", backoff)
-      time.sleep(backoff + random.uniform(0, backoff))
-      backoff = min(backoff*2, 120)
+      # Nothing to upload, or waiting to retry after a failed upload
+      retry_wait = retry_time - time.monotonic()
+      exit_event.wait(retry_wait if 0. < retry_wait < SCAN_INTERVAL else SCAN_INTERVAL)
 
-    pm.send("uploaderState", uploader.get_msg())
-    cloudlog.info("upload done, success=%r", success)
+  executor.shutdown(wait=False)
 
 def main():
   uploader_fn(threading.Event())
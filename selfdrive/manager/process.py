@@ -32,6 +32,7 @@ def launcher(proc):
 
     # create new context since we forked
     messaging.context = messaging.Context()
+    messaging.init_stats(proc)
 
     # exec the process
     mod.main()
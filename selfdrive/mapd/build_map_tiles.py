@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import argparse
+import numpy as np
+from selfdrive.mapd.lib.osm import OSM
+from selfdrive.mapd.lib.geo import R
+from selfdrive.mapd.lib.TileStore import TileStore, tile_keys_for_bbox
+from selfdrive.mapd.config import MAP_TILES_PATH, MAP_TILE_SIZE
+
+
+def build_map_tiles(lat, lon, radius, path=MAP_TILES_PATH, tile_size=MAP_TILE_SIZE, force=False):
+  """Fetches from Overpass and stores all map tiles covering a radius around the given location.
+  """
+  osm = OSM()
+  store = TileStore(path, tile_size)
+  bbox_angle = np.degrees(radius / R)
+  keys = tile_keys_for_bbox((lat - bbox_angle, lon - bbox_angle, lat + bbox_angle, lon + bbox_angle), tile_size)
+
+  for idx, key in enumerate(keys):
+    if store.has_tile(key) and not force:
+      print(f'[{idx + 1}/{len(keys)}] Tile {key} already in store')
+      continue
+
+    tile = store.fetch_tile(key, osm.fetch_road_ways_in_bbox)
+    status = f'{tile.way_count} ways' if tile is not None else 'failed'
+    print(f'[{idx + 1}/{len(keys)}] Tile {key}: {status}')
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Pre-build the local map tiles store used by mapd for offline use")
+  parser.add_argument("lat", type=float, help="Latitude of the area center in degrees")
+  parser.add_argument("lon", type=float, help="Longitude of the area center in degrees")
+  parser.add_argument("--radius", type=float, default=50000., help="Radius of the area to build in meters")
+  parser.add_argument("--path", default=MAP_TILES_PATH, help="Path of the tiles store")
+  parser.add_argument("--force", action="store_true", help="Fetch again tiles already in the store")
+  args = parser.parse_args()
+
+  build_map_tiles(args.lat, args.lon, args.radius, path=args.path, force=args.force)
@@ -1,3 +1,7 @@
+import os
+from pathlib import Path
+from selfdrive.hardware import PC
+
 # Map query config
 
 QUERY_RADIUS = 12000  # mts. Radius to use on OSM data queries.
@@ -5,3 +9,21 @@ MIN_DISTANCE_FOR_NEW_QUERY = 2000  # mts. Minimum distance to query area edge be
 FULL_STOP_MAX_SPEED = 1.39  # m/s Max speed for considering car is stopped.
 LOOK_AHEAD_HORIZON_TIME = 15.  # s. Time horizon for look ahead of turn speed sections to provide on liveMapData msg.
 LANE_WIDTH = 3.7  # Lane width estimate. Used for detecting departures from way.
+MERGE_QUERY_RESULTS = True  # Merge new query results into the current way collection instead of replacing it.
+
+# Local map data config
+MAPD_DATA_PATH = os.environ.get('MAPD_DATA_PATH', os.path.join(str(Path.home()), '.comma', 'mapd') if PC
+                                else '/data/media/0/mapd')
+MAP_TILES_PATH = os.path.join(MAPD_DATA_PATH, 'tiles')
+MAP_TILE_SIZE = 0.1  # deg. Side of the square tiles used to store OSM data locally. (~11 km)
+CURVATURE_CACHE_PATH = os.path.join(MAPD_DATA_PATH, 'curvatures')
+CURVATURE_CACHE_MAX_BYTES = 8 * 1024 * 1024  # Memory budget for cached route curvature calculations.
+CURVATURE_CACHE_MAX_DISK_BYTES = 100 * 1024 * 1024  # Disk budget for cached route curvature calculations.
+
+# Map data prefetch config
+QUERY_CENTER_AHEAD_DISTANCE = 4000.  # mts. Distance ahead of current location to center queries on when driving.
+PREFETCH_HORIZON_TIME = 900.  # s. Time horizon of the predicted path ahead to keep map tiles available for.
+PREFETCH_MIN_DISTANCE = 5000.  # mts. Minimum distance of the predicted path ahead to keep map tiles available for.
+PREFETCH_CORRIDOR_WIDTH = 2000.  # mts. Width to each side of the predicted path ahead to keep map tiles available for.
+PREFETCH_WORKERS = 2  # Number of background workers fetching map tiles.
+PREFETCH_RETRY_TIME = 30.  # s. Time to wait before retrying to fetch a map tile that failed.
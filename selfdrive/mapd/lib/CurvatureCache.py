@@ -0,0 +1,134 @@
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from common.file_helpers import mkdirs_exists_ok, rm_not_exists_ok, atomic_write_in_dir
+
+
+_CACHE_FILE_EXT = '.npz'
+
+
+def curvature_cache_key(nodes_data):
+  """Provides the cache key for the curvature calculations of a route given its raw `nodes_data` array
+  ([id, lat, lon, ...] per node, in driving order). Equivalent to keying by the sequence of way ids and directions,
+  but it also covers way relations split on a route and changes on the nodes positions.
+  """
+  return hashlib.sha1(np.ascontiguousarray(nodes_data[:, :3], dtype=float).tobytes()).hexdigest()
+
+
+class CurvatureCache():
+  """A least recently used cache of the curvature calculations (curvatures, curvature distances and turn speed
+  sections data arrays) for routes. The memory layer is bounded to `max_bytes`. When `path` is provided, entries are
+  also persisted on disk, bounded to `max_disk_bytes`, so they are available across drives.
+  """
+  def __init__(self, max_bytes, path=None, max_disk_bytes=0):
+    self.max_bytes = max_bytes
+    self.path = path
+    self.max_disk_bytes = max_disk_bytes
+    self._entries = OrderedDict()
+    self._bytes = 0
+    self._disk_entries = None  # Lazily loaded dict of entry sizes by file path, in least recently used order.
+    self._disk_bytes = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  @property
+  def nbytes(self):
+    return self._bytes
+
+  def get(self, key):
+    """Provides the cached (curv, curv_ds, speed_sections_data) tuple for `key` or None if not cached.
+    """
+    entry = self._entries.get(key)
+    if entry is not None:
+      self._entries.move_to_end(key)
+      return entry
+
+    entry = self._read(key)
+    if entry is not None:
+      self._put_memory(key, entry)
+    return entry
+
+  def put(self, key, curv, curv_ds, speed_sections_data):
+    entry = (curv, curv_ds, speed_sections_data)
+    self._put_memory(key, entry)
+    self._write(key, entry)
+
+  def _put_memory(self, key, entry):
+    entry_bytes = sum(arr.nbytes for arr in entry)
+    if entry_bytes > self.max_bytes:
+      return
+
+    old_entry = self._entries.pop(key, None)
+    if old_entry is not None:
+      self._bytes -= sum(arr.nbytes for arr in old_entry)
+
+    self._entries[key] = entry
+    self._bytes += entry_bytes
+
+    while self._bytes > self.max_bytes:
+      _, evicted = self._entries.popitem(last=False)
+      self._bytes -= sum(arr.nbytes for arr in evicted)
+
+  def _file_path(self, key):
+    return os.path.join(self.path, key + _CACHE_FILE_EXT)
+
+  def _load_disk_entries(self):
+    if self._disk_entries is not None:
+      return
+
+    self._disk_entries = OrderedDict()
+    try:
+      files = [os.path.join(self.path, fn) for fn in os.listdir(self.path) if fn.endswith(_CACHE_FILE_EXT)]
+      for fp in sorted(files, key=os.path.getmtime):
+        self._disk_entries[fp] = os.path.getsize(fp)
+    except OSError:
+      pass
+
+    self._disk_bytes = sum(self._disk_entries.values())
+
+  def _read(self, key):
+    if self.path is None:
+      return None
+
+    self._load_disk_entries()
+    fp = self._file_path(key)
+    if fp not in self._disk_entries:
+      return None
+
+    try:
+      with np.load(fp) as data:
+        entry = (data['curv'], data['curv_ds'], data['speed_sections'])
+      os.utime(fp)  # Keep track of last use for eviction across drives.
+    except (OSError, ValueError, KeyError):
+      return None
+
+    self._disk_entries.move_to_end(fp)
+    return entry
+
+  def _write(self, key, entry):
+    if self.path is None:
+      return
+
+    self._load_disk_entries()
+    fp = self._file_path(key)
+    if fp in self._disk_entries:
+      return
+
+    try:
+      mkdirs_exists_ok(self.path)
+      with atomic_write_in_dir(fp, mode='wb', overwrite=True) as f:
+        np.savez(f, curv=entry[0], curv_ds=entry[1], speed_sections=entry[2])
+      size = os.path.getsize(fp)
+    except OSError as e:
+      print(f'Exception while writing curvature cache entry:\n{e}')
+      return
+
+    self._disk_entries[fp] = size
+    self._disk_bytes += size
+
+    while self._disk_bytes > self.max_disk_bytes and len(self._disk_entries) > 0:
+      evicted_fp, evicted_size = self._disk_entries.popitem(last=False)
+      rm_not_exists_ok(evicted_fp)
+      self._disk_bytes -= evicted_size
@@ -1,6 +1,7 @@
 import numpy as np
 from enum import Enum
 from selfdrive.mapd.lib.geo import DIRECTION, R, vectors
+from selfdrive.mapd.lib.CurvatureCache import curvature_cache_key
 
 from selfdrive.hardware import EON
 
@@ -24,8 +25,8 @@ _DIVERTION_SEARCH_RANGE = [-200., 50.]  # mt. Range of distance to current locat
 def nodes_raw_data_array_for_wr(wr, drop_last=False):
   """Provides an array of raw node data (id, lat, lon, speed_limit) for all nodes in way relation
   """
-  sl = wr.speed_limit
-  data = np.array([(n.id, n.lat, n.lon, sl) for n in wr.way.nodes], dtype=float)
+  way = wr.way
+  data = np.column_stack((way.node_ids, np.degrees(way.nodes_rad), np.full(len(way), wr.speed_limit))).astype(float)
 
   # reverse the order if way direction is backwards
   if wr.direction == DIRECTION.BACKWARD:
@@ -70,6 +71,20 @@ def node_calculations(points):
   return v, dp, dn, dr, b
 
 
+def resample_vectors(vect, dist_prev, min_dist=_MIN_NODE_DISTANCE, step=_ADDED_NODES_DIST):
+  """Enhances the resolution of the path described by the relative vectors `vect` (N, 2) with lengths `dist_prev` (N)
+  by replacing every vector with length of at least `min_dist` by `ceil(length / step)` equal vectors adding up to it.
+  Returns the (M, 2) array of resampled relative vectors, built in a single pass.
+  """
+  # - Number of vectors replacing each vector. 1 for those not too far (i.e. they are kept as they are).
+  counts = np.ones(len(dist_prev), dtype=int)
+  too_far = dist_prev >= min_dist
+  counts[too_far] = np.ceil(dist_prev[too_far] / step).astype(int)
+
+  # - Scale every vector by its count and repeat it count times.
+  return np.repeat(vect / counts[:, None], counts, axis=0)
+
+
 def spline_curvature_calculations(vect, dist_prev):
   """Provides an array of curvatures and its distances by applying a spline interpolation
   to the path described by the nodes data.
@@ -77,17 +92,7 @@ def spline_curvature_calculations(vect, dist_prev):
   # We need to artificially enhance the data before applying spline interpolation to avoid getting
   # inexistent curvature values close to irregularities on the road when the resolution of nodes data
   # approaching the irregularity is low.
-
-  # - Find indexes where dist_prev is greater than threshold
-  too_far_idxs = np.nonzero(dist_prev >= _MIN_NODE_DISTANCE)[0]
-
-  # - Traversing in reverse order, enhance data by adding points at the found indexes.
-  for idx in too_far_idxs[::-1]:
-    dp = dist_prev[idx]  # distance of vector that needs to be replaced by higher resolution vectors.
-    n = int(np.ceil(dp / _ADDED_NODES_DIST))  # number of vectors that need to be added.
-    new_v = vect[idx, :] / n  # new relative vector to insert.
-    vect = np.delete(vect, idx, axis=0)  # remove the relative vector to be replaced by the insertion of new vectors.
-    vect = np.insert(vect, [idx] * n, [new_v] * n, axis=0)  # insert n new relative vectors
+  vect = resample_vectors(vect, dist_prev)
 
   # Data is now enhanced, we can proceed with curvature evaluation.
   # - Create cumulative arrays for distance traveled and vector (x, y)
@@ -259,7 +264,7 @@ class NodeDataIdx(Enum):
 class NodesData:
   """Container for the list of node data from a ordered list of way relations to be used in a Route
   """
-  def __init__(self, way_relations, wr_index):
+  def __init__(self, way_relations, wr_index, curvature_cache=None):
     self._nodes_data = np.array([])
     self._divertions = [[]]
     self._curvature_speed_sections_data = np.array([])
@@ -299,8 +304,16 @@ class NodesData:
     # Store calculcations for curvature sections speed limits. We need more than 3 points to be able to process.
     # _curvature_speed_sections_data structure: [dist_start, dist_stop, speed_limits, curv_sign]
     if len(vect) > 3:
-      curv, curv_ds = spline_curvature_calculations(vect, dist_prev)
-      self._curvature_speed_sections_data = speed_limits_for_curvatures_data(curv, curv_ds)
+      # The calculations only depend on the nodes on the route, reuse them from the cache when available.
+      cache_key = curvature_cache_key(nodes_data) if curvature_cache is not None else None
+      cached = curvature_cache.get(cache_key) if cache_key is not None else None
+      if cached is not None:
+        self._curvature_speed_sections_data = cached[2]
+      else:
+        curv, curv_ds = spline_curvature_calculations(vect, dist_prev)
+        self._curvature_speed_sections_data = speed_limits_for_curvatures_data(curv, curv_ds)
+        if cache_key is not None:
+          curvature_cache.put(cache_key, curv, curv_ds, self._curvature_speed_sections_data)
 
   @property
   def count(self):
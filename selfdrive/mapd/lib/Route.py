@@ -13,7 +13,7 @@ _MAP_DATA_EDGE_DISTANCE = 50  # mts. Consider edge of map data from this distanc
 class Route():
   """A set of consecutive way relations forming a default driving route.
   """
-  def __init__(self, current, wr_index, way_collection_id, query_center):
+  def __init__(self, current, wr_index, way_collection_id, query_center, curvature_cache=None):
     """Create a Route object from a given `wr_index` (Way relation index)
 
     Args:
@@ -21,6 +21,7 @@ class Route():
         wr_index (WayRelationIndex): The indexes of WayRelations by node id.
         way_collection_id (UUID): The id of the Way Collection that created this Route.
         query_center (Numpy Array): lat, lon] numpy array in radians indicating the center of the data query.
+        curvature_cache (CurvatureCache): Optional cache for the curvature calculations of the route nodes.
     """
     self.way_collection_id = way_collection_id
     self._ordered_way_relations = []
@@ -168,7 +169,7 @@ class Route():
       last_wr = way_relations[best_idx]
 
     # Build the node data from the ordered list of way relations
-    self._nodes_data = NodesData(self._ordered_way_relations, wr_index)
+    self._nodes_data = NodesData(self._ordered_way_relations, wr_index, curvature_cache)
 
     # Locate where we are in the route node list.
     self._locate()
@@ -207,6 +208,20 @@ class Route():
         self._ahead_idx = idx
         break
 
+  def is_affected_by(self, way_relations):
+    """Indicates if any of the given `way_relations` is part of the route or connects to any node of it. i.e. a
+    route built from a way collection including `way_relations` could be different.
+    """
+    if len(way_relations) == 0:
+      return False
+
+    way_ids = set(wr.id for wr in self._ordered_way_relations)
+    way_ids.update(wr.parent_wr_id for wr in self._ordered_way_relations if wr.parent_wr_id is not None)
+    node_ids = set(self._nodes_data.get(NodeDataIdx.node_id).astype(int).tolist()) \
+      if self._nodes_data is not None else set()
+
+    return any(wr.id in way_ids or not node_ids.isdisjoint(wr.nodes_ids) for wr in way_relations)
+
   @property
   def current_wr(self):
     return self._ordered_way_relations[0] if len(self._ordered_way_relations) else None
@@ -335,6 +350,30 @@ class Route():
 
     return self._nodes_data.distance_to_end(self._ahead_idx, self._distance_to_node_ahead)
 
+  def coordinates_ahead(self, horizon_mts):
+    """Returns a (N, 2) array with the [lat, lon] coordinates in radians of the route nodes ahead of the current
+    location up to `horizon_mts`, including the first node beyond it.
+    """
+    if not self.located:
+      return np.zeros((0, 2))
+
+    dist_route = self._nodes_data.get(NodeDataIdx.dist_route)
+    rel_dist = dist_route[self._ahead_idx:] - dist_route[self._ahead_idx] + self._distance_to_node_ahead
+    count = np.searchsorted(rel_dist, horizon_mts) + 1
+    lat = self._nodes_data.get(NodeDataIdx.lat)[self._ahead_idx:self._ahead_idx + count]
+    lon = self._nodes_data.get(NodeDataIdx.lon)[self._ahead_idx:self._ahead_idx + count]
+
+    return np.radians(np.column_stack((lat, lon)))
+
+  @property
+  def possible_divertions(self):
+    """Returns the way relations the route could possible divert to in the vicinity of the current location.
+    """
+    if not self.located:
+      return []
+
+    return self._nodes_data.possible_divertions(self._ahead_idx, self._distance_to_node_ahead)
+
   @property
   def current_road_name(self):
     return self.current_wr.road_name if self.located else None
@@ -0,0 +1,118 @@
+import numpy as np
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from selfdrive.mapd.lib.geo import R, bearing_to_points, destination_point
+from selfdrive.mapd.lib.TileStore import tile_keys_for_bbox
+from selfdrive.mapd.config import PREFETCH_HORIZON_TIME, PREFETCH_MIN_DISTANCE, PREFETCH_CORRIDOR_WIDTH, \
+  PREFETCH_WORKERS, PREFETCH_RETRY_TIME
+
+
+_PATH_SAMPLE_STEP = 1000.  # mts. Distance between points when the path ahead is predicted as a straight line.
+
+
+def straight_path(location_rad, bearing_rad, distance):
+  """Provides a (N, 2) array of points in radians sampled along a straight line of `distance` mts from `location_rad`
+  with `bearing_rad`. `location_rad` itself is not included.
+  """
+  if distance <= 0.:
+    return np.zeros((0, 2))
+
+  distances = np.append(np.arange(_PATH_SAMPLE_STEP, distance, _PATH_SAMPLE_STEP), distance)
+  return np.array([destination_point(location_rad, bearing_rad, d) for d in distances])
+
+
+def predict_path(location_rad, bearing_rad, horizon_mts, route=None):
+  """Provides a (N, 2) array of points in radians describing the predicted path ahead up to `horizon_mts`.
+  The path follows the `route` when located and continues straight beyond its end, otherwise it is a straight line
+  along the current bearing. The edge nodes of the possible divertions from the route are included as well.
+  """
+  if route is None or not route.located:
+    return np.vstack(([location_rad], straight_path(location_rad, bearing_rad, horizon_mts)))
+
+  points = np.vstack(([location_rad], route.coordinates_ahead(horizon_mts)))
+
+  # Continue straight beyond the end of the route as we most likely lack the map data to continue it.
+  distance_to_end = route.distance_to_end
+  if distance_to_end is not None and distance_to_end < horizon_mts:
+    end_bearing = bearing_to_points(points[-2], points[-1:])[0] if len(points) > 1 else bearing_rad
+    points = np.vstack((points, straight_path(points[-1], end_bearing, horizon_mts - distance_to_end)))
+
+  divertion_points = [wr.last_node_coordinates for wr in route.possible_divertions]
+  divertion_points = [p for p in divertion_points if p is not None]
+  if len(divertion_points) > 0:
+    points = np.vstack((points, divertion_points))
+
+  return points
+
+
+def corridor_tile_keys(points, corridor_width, tile_size):
+  """Provides the keys of the tiles covering a corridor of `corridor_width` mts to each side of the `points` in
+  radians, without repetitions and in the order of `points` (i.e. the closest first).
+  """
+  margin = np.degrees(corridor_width / R)
+  keys = {}
+  for lat, lon in np.degrees(points):
+    for key in tile_keys_for_bbox((lat - margin, lon - margin, lat + margin, lon + margin), tile_size):
+      keys.setdefault(key, None)
+
+  return list(keys.keys())
+
+
+class TilePrefetcher():
+  """Keeps the map tiles along the predicted path ahead available on the tile store, fetching the missing ones in
+  a pool of background workers ahead of time. `upcoming` holds the keys of the tiles on the current prediction,
+  closest first.
+  """
+  def __init__(self, tile_store, fetch_fn, workers=PREFETCH_WORKERS):
+    self.tile_store = tile_store
+    self.fetch_fn = fetch_fn
+    self.upcoming = []
+    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mapd_prefetch')
+    self._pending = {}  # Futures of the tiles being prefetched by key.
+    self._failed = {}  # Time of last failed fetch by key.
+
+  def _fetch(self, key):
+    # The tile might have been fetched by a map query since scheduled.
+    if self.tile_store.has_tile(key):
+      return True
+    return self.tile_store.fetch_tile(key, self.fetch_fn) is not None
+
+  def _collect(self):
+    now = monotonic()
+    for key, future in list(self._pending.items()):
+      if not future.done():
+        continue
+      del self._pending[key]
+      if future.exception() is not None or not future.result():
+        self._failed[key] = now
+
+  def update(self, location_rad, bearing_rad, speed, route=None, covered_keys=()):
+    """Updates the predicted path ahead and schedules the prefetch of the tiles on it. Tiles in `covered_keys` are
+    not scheduled, as they are being fetched already (i.e. by a running map query).
+    """
+    if location_rad is None or bearing_rad is None:
+      return
+
+    self._collect()
+
+    horizon_mts = max(speed * PREFETCH_HORIZON_TIME, PREFETCH_MIN_DISTANCE)
+    points = predict_path(location_rad, bearing_rad, horizon_mts, route)
+    self.upcoming = corridor_tile_keys(points, PREFETCH_CORRIDOR_WIDTH, self.tile_store.tile_size)
+
+    now = monotonic()
+    for key in self.upcoming:
+      if key in self._pending or key in covered_keys or \
+         now - self._failed.get(key, -PREFETCH_RETRY_TIME) < PREFETCH_RETRY_TIME:
+        continue
+      if not self.tile_store.has_tile(key):
+        self._pending[key] = self._executor.submit(self._fetch, key)
+
+  @property
+  def pending_count(self):
+    return len(self._pending)
+
+  def shutdown(self):
+    for future in self._pending.values():
+      future.cancel()
+    self._pending = {}
+    self._executor.shutdown(wait=False)
@@ -0,0 +1,196 @@
+import os
+import mmap
+import json
+import struct
+import threading
+import numpy as np
+from common.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
+from selfdrive.mapd.lib.WaysData import WaysData
+
+
+# Tile file layout (little endian):
+#   header: magic, version, node count, way count, way node count, tags table length in bytes.
+#   node ids (int64, n_nodes), node coordinates (float64, n_nodes x 2) as [lat, lon] in degrees.
+#   way ids (int64, n_ways), way node offsets (uint32, n_ways + 1), way tags indexes (uint32, n_ways).
+#   way node ids (int64, n_way_nodes).
+#   tags table: utf-8 json encoded list of the unique tag dictionaries referenced by the ways.
+_MAGIC = b'OPMT'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHxxIIII')
+_TILE_FILE_EXT = '.tile'
+
+
+def tile_key(lat, lon, tile_size):
+  """Provides the (lat_idx, lon_idx) key of the tile containing the location `lat`, `lon` in degrees.
+  """
+  return int(np.floor(lat / tile_size)), int(np.floor(lon / tile_size))
+
+
+def tile_bbox(key, tile_size):
+  """Provides the bounding box (min_lat, min_lon, max_lat, max_lon) in degrees for the tile with the given `key`.
+  """
+  return key[0] * tile_size, key[1] * tile_size, (key[0] + 1) * tile_size, (key[1] + 1) * tile_size
+
+
+def tile_keys_for_bbox(bbox, tile_size):
+  """Provides the list of tile keys covering the given bounding box (min_lat, min_lon, max_lat, max_lon) in degrees.
+  """
+  min_key = tile_key(bbox[0], bbox[1], tile_size)
+  max_key = tile_key(bbox[2], bbox[3], tile_size)
+  return [(lat_idx, lon_idx) for lat_idx in range(min_key[0], max_key[0] + 1)
+          for lon_idx in range(min_key[1], max_key[1] + 1)]
+
+
+def encode_tile(ways):
+  """Encodes a list of OSM ways (and the nodes they reference) into the compact binary tile format.
+  """
+  nodes = {}
+  tags_table = []
+  tags_idx_map = {}
+  way_ids = []
+  way_offsets = [0]
+  way_tags = []
+  way_nodes = []
+
+  for way in ways:
+    way_node_ids = []
+    for node in way.nodes:
+      nodes.setdefault(node.id, (float(node.lat), float(node.lon)))
+      way_node_ids.append(node.id)
+
+    # Intern tags as most ways on an area share the same handful of tag combinations.
+    tags_json = json.dumps(way.tags, sort_keys=True)
+    tags_idx = tags_idx_map.get(tags_json)
+    if tags_idx is None:
+      tags_idx = len(tags_table)
+      tags_idx_map[tags_json] = tags_idx
+      tags_table.append(way.tags)
+
+    way_ids.append(way.id)
+    way_nodes.extend(way_node_ids)
+    way_offsets.append(len(way_nodes))
+    way_tags.append(tags_idx)
+
+  tags_bytes = json.dumps(tags_table).encode('utf-8')
+  header = _HEADER.pack(_MAGIC, _VERSION, len(nodes), len(way_ids), len(way_nodes), len(tags_bytes))
+
+  return b''.join([
+    header,
+    np.array(list(nodes.keys()), dtype='<i8').tobytes(),
+    np.array(list(nodes.values()), dtype='<f8').reshape(-1, 2).tobytes(),
+    np.array(way_ids, dtype='<i8').tobytes(),
+    np.array(way_offsets, dtype='<u4').tobytes(),
+    np.array(way_tags, dtype='<u4').tobytes(),
+    np.array(way_nodes, dtype='<i8').tobytes(),
+    tags_bytes,
+  ])
+
+
+class Tile():
+  """A read only view of a tile in the compact binary tile format. The numpy arrays are views over the underlying
+  buffer (usually a memory mapped file) so no data is copied until ways are loaded into a `WaysData` store.
+  """
+  def __init__(self, buf):
+    magic, version, n_nodes, n_ways, n_way_nodes, tags_len = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != _VERSION:
+      raise ValueError('Invalid tile format')
+
+    offset = _HEADER.size
+
+    def take(dtype, count):
+      nonlocal offset
+      arr = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+      offset += arr.nbytes
+      return arr
+
+    self.node_ids = take('<i8', n_nodes)
+    self.node_coords = take('<f8', n_nodes * 2).reshape(-1, 2)
+    self.way_ids = take('<i8', n_ways)
+    self.way_offsets = take('<u4', n_ways + 1)
+    self.way_tags = take('<u4', n_ways)
+    self.way_nodes = take('<i8', n_way_nodes)
+    self.tags_table = json.loads(bytes(buf[offset:offset + tags_len]).decode('utf-8'))
+
+  @property
+  def way_count(self):
+    return len(self.way_ids)
+
+
+class TileStore():
+  """A local store of OSM road ways split in square tiles of `tile_size` degrees. Each tile is stored on its own
+  file in `path` and read through a memory map. Tiles not found on the store are fetched with `fetch_fn`
+  (usually a query to Overpass) and written back to the store for future use.
+  """
+  def __init__(self, path, tile_size, max_open_tiles=16):
+    self.path = path
+    self.tile_size = tile_size
+    self.max_open_tiles = max_open_tiles
+    self._tiles = {}  # Open tiles by key. Kept in least recently used order.
+    self._lock = threading.Lock()  # Tiles can be read and fetched from several threads.
+
+  def tile_path(self, key):
+    return os.path.join(self.path, f'{key[0]}_{key[1]}{_TILE_FILE_EXT}')
+
+  def has_tile(self, key):
+    with self._lock:
+      if key in self._tiles:
+        return True
+    return os.path.exists(self.tile_path(key))
+
+  def write_tile(self, key, ways):
+    mkdirs_exists_ok(self.path)
+    with atomic_write_in_dir(self.tile_path(key), mode='wb', overwrite=True) as f:
+      f.write(encode_tile(ways))
+    with self._lock:
+      self._tiles.pop(key, None)
+
+  def read_tile(self, key):
+    """Provides the `Tile` for the given key or None if not available on the store.
+    """
+    with self._lock:
+      tile = self._tiles.pop(key, None)
+    if tile is None:
+      try:
+        with open(self.tile_path(key), 'rb') as f:
+          tile = Tile(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+      except (OSError, ValueError):
+        return None
+
+    # Re-insert to keep the dictionary in least recently used order and drop the oldest if over the limit.
+    with self._lock:
+      self._tiles[key] = tile
+      if len(self._tiles) > self.max_open_tiles:
+        self._tiles.pop(next(iter(self._tiles)))
+
+    return tile
+
+  def fetch_tile(self, key, fetch_fn):
+    """Fetches the tile data with `fetch_fn` and stores it. Returns None if the data could not be fetched.
+    """
+    try:
+      ways = fetch_fn(*tile_bbox(key, self.tile_size))
+    except Exception as e:
+      print(f'Exception while fetching map tile {key}:\n{e}')
+      return None
+
+    self.write_tile(key, ways)
+    return self.read_tile(key)
+
+  def ways_in_bbox(self, bbox, fetch_fn=None):
+    """Provides a `WaysData` store with all OSM ways on the tiles covering the bounding box
+    (min_lat, min_lon, max_lat, max_lon) in degrees, and the list of keys of the tiles that are not included as they
+    are not on the store and could not be fetched. Tiles missing on the store are fetched with
+    `fetch_fn(min_lat, min_lon, max_lat, max_lon)` when provided.
+    """
+    tiles = []
+    missing_keys = []
+    for key in tile_keys_for_bbox(bbox, self.tile_size):
+      tile = self.read_tile(key)
+      if tile is None and fetch_fn is not None:
+        tile = self.fetch_tile(key, fetch_fn)
+      if tile is not None:
+        tiles.append(tile)
+      else:
+        missing_keys.append(key)
+
+    return WaysData.from_tiles(tiles), missing_keys
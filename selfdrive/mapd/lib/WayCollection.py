@@ -1,28 +1,109 @@
 from selfdrive.mapd.lib.WayRelation import WayRelation
-from selfdrive.mapd.lib.WayRelationIndex import WayRelationIndex
+from selfdrive.mapd.lib.WayRelationIndex import WayRelationIndex, WayRelationGridIndex
+from selfdrive.mapd.lib.WaysData import compact_ways
 from selfdrive.mapd.lib.Route import Route
+from selfdrive.mapd.lib.geo import R
 from selfdrive.mapd.config import LANE_WIDTH
+import numpy as np
 import uuid
 
 
 _ACCEPTABLE_BEARING_DELTA_IND = 0.7071067811865475  # sin(pi/4) | 45 degrees acceptable bearing delta
+_GRID_CELL_SIZE = 500. / R  # 500 mts side of the cells of the spatial index grid. (expressed in radians)
 
 
 class WayCollection():
   """A collection of WayRelations to use for maps data analysis.
   """
-  def __init__(self, ways, query_center):
+  def __init__(self, ways, query_center, curvature_cache=None):
     """Creates a WayCollection with a set of OSM way objects.
 
     Args:
-        ways (Array): Collection of Way objects fetched from OSM in a radius around `query_center`
+        ways (WaysData): Collection of ways fetched from OSM in a radius around `query_center`. A list of overpy Way
+          objects is converted.
         query_center (Numpy Array): [lat, lon] numpy array in radians indicating the center of the data query.
+        curvature_cache (CurvatureCache): Optional cache for the curvature calculations of the routes.
     """
     self.id = uuid.uuid4()
-    self.way_relations = [WayRelation(way) for way in ways]
+    self.way_relations = [WayRelation(way) for way in compact_ways(ways)]
     self.query_center = query_center
+    self.curvature_cache = curvature_cache
 
     self.wr_index = WayRelationIndex(self.way_relations)
+    self.wr_grid_index = WayRelationGridIndex(self.way_relations, _GRID_CELL_SIZE)
+    self._updated_way_relations = []
+
+  def merge(self, ways, query_center):
+    """Merges the results of a new OSM query into the collection. Way relations for ways not included in `ways` are
+    removed, those for new ways are added and way relations for ways that did not change are kept as they are, so
+    routes built from them stay valid.
+
+    Args:
+        ways (WaysData): Collection of ways fetched from OSM in a radius around `query_center`. A list of overpy Way
+          objects is converted.
+        query_center (Numpy Array): [lat, lon] numpy array in radians indicating the center of the data query.
+
+    Returns:
+        Array: The way relations removed from or added to the collection.
+    """
+    return self.apply_merge(self.prepare_merge(ways), query_center)
+
+  def prepare_merge(self, ways):
+    """Compares the results of a new OSM query with the collection and creates the way relations for the new ways,
+    without modifying the collection. The way relations of the collection are only read, so it can run while they are
+    used to update the route, as long as no other merge is applied in between.
+
+    Returns:
+        Tuple: The new list of way relations, the (way relation, new way) pairs of the kept ones, and the removed and
+          added way relations.
+    """
+    current_wrs = {wr.id: wr for wr in self.way_relations}
+    way_relations = []
+    kept = []
+    removed = []
+    added = []
+
+    for way in compact_ways(ways):
+      wr = current_wrs.pop(way.id, None)
+      if wr is not None:
+        if wr.way.tags == way.tags and np.array_equal(wr.way.node_ids, way.node_ids):
+          way_relations.append(wr)
+          kept.append((wr, way))
+          continue
+        removed.append(wr)  # The way has been modified, replace its way relation.
+
+      wr = WayRelation(way)
+      way_relations.append(wr)
+      added.append(wr)
+
+    # Any way relation left on `current_wrs` is not part of the new results.
+    removed.extend(current_wrs.values())
+    return way_relations, kept, removed, added
+
+  def apply_merge(self, merge, query_center):
+    """Applies the result of `prepare_merge` to the collection.
+
+    Returns:
+        Array: The way relations removed from or added to the collection.
+    """
+    way_relations, kept, removed, added = merge
+    for wr, way in kept:
+      # Point to the new way data so the previous query results can be released.
+      wr.replace_way(way)
+
+    removed_ids = set(map(id, removed))
+    for wr in removed:
+      self.wr_index.remove(wr)
+      self.wr_grid_index.remove(wr)
+    for wr in added:
+      self.wr_index.add(wr)
+      self.wr_grid_index.add(wr)
+
+    self.way_relations = way_relations
+    self.query_center = query_center
+    self._updated_way_relations = [wr for wr in self._updated_way_relations if id(wr) not in removed_ids]
+
+    return removed + added
 
   def get_route(self, location_rad, bearing_rad, location_stdev):
     """Provides the best route found in the way collection based on current location and bearing.
@@ -30,13 +111,21 @@ class WayCollection():
     if location_rad is None or bearing_rad is None or location_stdev is None:
       return None
 
-    # Update all way relations in collection to the provided location and bearing.
-    for wr in self.way_relations:
+    # Only the way relations whose bounding box may contain the location can be a match. Reset the location of
+    # those updated on a previous call that are no longer candidates, then update the candidates to the provided
+    # location and bearing.
+    candidates = self.wr_grid_index.way_relations_near_location(location_rad)
+    candidate_ids = set(map(id, candidates))
+    for wr in self._updated_way_relations:
+      if id(wr) not in candidate_ids:
+        wr.reset_location_variables()
+    for wr in candidates:
       wr.update(location_rad, bearing_rad, location_stdev)
+    self._updated_way_relations = candidates
 
     # Get the way relations where a match was found. i.e. those now marked as active as long as the direction of
     # travel is valid.
-    valid_way_relations = [wr for wr in self.way_relations if wr.active and not wr.is_prohibited]
+    valid_way_relations = [wr for wr in candidates if wr.active and not wr.is_prohibited]
 
     # If no active, then we could not find a current way to build a route.
     if len(valid_way_relations) == 0:
@@ -82,4 +171,4 @@ class WayCollection():
           wr_accurate_distance.sort(key=lambda wr: wr.highway_rank)
           current = wr_accurate_distance[0]
 
-    return Route(current, self.wr_index, self.id, self.query_center)
+    return Route(current, self.wr_index, self.id, self.query_center, self.curvature_cache)
@@ -1,5 +1,5 @@
 from selfdrive.mapd.lib.geo import DIRECTION, R, vectors, bearing_to_points, distance_to_points
-from selfdrive.mapd.lib.osm import create_way
+from selfdrive.mapd.lib.WaysData import CompactWay
 from selfdrive.config import Conversions as CV
 from selfdrive.mapd.config import LANE_WIDTH
 from common.basedir import BASEDIR
@@ -146,6 +146,9 @@ class WayRelation():
   """A class that represent the relationship of an OSM way and a given `location` and `bearing` of a driving vehicle.
   """
   def __init__(self, way, parent=None):
+    # Operate on the compact array backed representation of the way.
+    if not isinstance(way, CompactWay):
+      way = CompactWay.from_overpy(way)
     self.way = way
     self.parent = parent
     self.parent_wr_id = parent.id if parent is not None else None  # For WRs created as splits of other WRs
@@ -162,9 +165,9 @@ class WayRelation():
     except Exception:
       self.lanes = 2
 
-    # Create numpy arrays with nodes data to support calculations.
-    self._nodes_np = np.radians(np.array([[nd.lat, nd.lon] for nd in way.nodes], dtype=float))
-    self._nodes_ids = np.array([nd.id for nd in way .nodes], dtype=int)
+    # Numpy arrays with nodes data to support calculations.
+    self._nodes_np = way.nodes_rad
+    self._nodes_ids = way.node_ids
 
     # Get the vectors representation of the segments betwheen consecutive nodes. (N-1, 2)
     v = vectors(self._nodes_np) * R
@@ -181,7 +184,7 @@ class WayRelation():
                               np.amax(self._nodes_np, 0) + _WAY_BBOX_PADING))
 
     # Get the edge nodes ids.
-    self.edge_nodes_ids = [way.nodes[0].id, way.nodes[-1].id]
+    self.edge_nodes_ids = [int(self._nodes_ids[0]), int(self._nodes_ids[-1])]
 
   def __repr__(self):
     return f'(id: {self.id}, between {self.behind_idx} and {self.ahead_idx}, {self.direction}, active: {self.active})'
@@ -191,6 +194,13 @@ class WayRelation():
         return self.id == other.id
     return False
 
+  def replace_way(self, way):
+    """Replaces the underlying way with an identical `way` (same id, tags and nodes). i.e. from a new query result.
+    """
+    self.way = way
+    self._nodes_np = way.nodes_rad
+    self._nodes_ids = way.node_ids
+
   def reset_location_variables(self):
     self.distance_to_node_ahead = 0.
     self.location_rad = None
@@ -206,6 +216,10 @@ class WayRelation():
   def id(self):
     return self.way.id
 
+  @property
+  def nodes_ids(self):
+    return self._nodes_ids.tolist()
+
   @property
   def road_name(self):
     if self.name is not None:
@@ -371,16 +385,16 @@ class WayRelation():
 
   @property
   def node_ahead(self):
-    return self.way.nodes[self.ahead_idx] if self.ahead_idx is not None else None
+    return self.way.node(self.ahead_idx) if self.ahead_idx is not None else None
 
   @property
   def last_node(self):
     """Returns the last node on the way considering the traveling direction
     """
     if self.direction == DIRECTION.FORWARD:
-      return self.way.nodes[-1]
+      return self.way.node(-1)
     if self.direction == DIRECTION.BACKWARD:
-      return self.way.nodes[0]
+      return self.way.node(0)
     return None
 
   @property
@@ -418,6 +432,5 @@ class WayRelation():
     if not isinstance(way_ids, list):
       way_ids = [-1, -2]  # Default id values.
 
-    ways = [create_way(way_ids[0], node_ids=self._nodes_ids[:idx + 1], from_way=self.way),
-            create_way(way_ids[1], node_ids=self._nodes_ids[idx:], from_way=self.way)]
+    ways = [self.way.sub_way(way_ids[0], 0, idx + 1), self.way.sub_way(way_ids[1], idx, len(self.way))]
     return [WayRelation(way, parent=self) for way in ways]
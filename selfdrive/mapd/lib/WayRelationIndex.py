@@ -1,3 +1,4 @@
+import numpy as np
 
 
 class WayRelationIndex():
@@ -12,15 +13,13 @@ class WayRelationIndex():
       self.add(wr)
 
   def add(self, way_relation):
-    for node in way_relation.way.nodes:
-      node_id = node.id
+    for node_id in way_relation.nodes_ids:
       self._full_nodes_index_dict[node_id] = self._full_nodes_index_dict.get(node_id, []) + [way_relation]
       if node_id in way_relation.edge_nodes_ids:
         self._edge_nodes_index_dict[node_id] = self._edge_nodes_index_dict.get(node_id, []) + [way_relation]
 
   def remove(self, way_relation):
-    for node in way_relation.way.nodes:
-      node_id = node.id
+    for node_id in way_relation.nodes_ids:
       self._full_nodes_index_dict[node_id] = [wr for wr in self._full_nodes_index_dict.get(node_id, [])
                                               if wr is not way_relation]
       if node_id in way_relation.edge_nodes_ids:
@@ -32,3 +31,41 @@ class WayRelationIndex():
 
   def way_relations_with_node_id(self, node_id):
     return self._full_nodes_index_dict.get(node_id, [])
+
+
+class WayRelationGridIndex():
+  """
+  A spatial index of WayRelations on a uniform grid of `cell_size` radians built over the way relations bounding
+  boxes. Provides the way relations whose bounding box may contain a given location.
+  """
+  def __init__(self, way_relations, cell_size):
+    self.cell_size = cell_size
+    self._cells_dict = {}
+
+    for wr in way_relations:
+      self.add(wr)
+
+  def _cell(self, location_rad):
+    return int(np.floor(location_rad[0] / self.cell_size)), int(np.floor(location_rad[1] / self.cell_size))
+
+  def add(self, way_relation):
+    min_cell = self._cell(way_relation.bbox[0])
+    max_cell = self._cell(way_relation.bbox[1])
+    for lat_idx in range(min_cell[0], max_cell[0] + 1):
+      for lon_idx in range(min_cell[1], max_cell[1] + 1):
+        self._cells_dict.setdefault((lat_idx, lon_idx), []).append(way_relation)
+
+  def remove(self, way_relation):
+    min_cell = self._cell(way_relation.bbox[0])
+    max_cell = self._cell(way_relation.bbox[1])
+    for lat_idx in range(min_cell[0], max_cell[0] + 1):
+      for lon_idx in range(min_cell[1], max_cell[1] + 1):
+        cell = (lat_idx, lon_idx)
+        wrs = [wr for wr in self._cells_dict.get(cell, []) if wr is not way_relation]
+        if len(wrs) > 0:
+          self._cells_dict[cell] = wrs
+        else:
+          self._cells_dict.pop(cell, None)
+
+  def way_relations_near_location(self, location_rad):
+    return self._cells_dict.get(self._cell(location_rad), [])
@@ -0,0 +1,181 @@
+import json
+import numpy as np
+from collections import namedtuple
+
+
+CompactNode = namedtuple('CompactNode', ['id', 'lat', 'lon'])  # lat, lon in degrees.
+
+
+def _slices_indexes(starts, ends):
+  """Provides the array of indexes resulting from concatenating the ranges [start, end) for all `starts`, `ends`.
+  """
+  lengths = ends - starts
+  offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+  return np.repeat(starts - offsets, lengths) + np.arange(np.sum(lengths), dtype=int)
+
+
+class CompactWay():
+  """A lightweight OSM way backed by views over the arrays of a `WaysData` store.
+  `node_ids` (N) and `nodes_rad` (N, 2) hold the node ids and [lat, lon] coordinates in radians. `tags` is shared
+  with all the ways with the same tags on the store, so it must be considered read only.
+  """
+  __slots__ = ['id', 'tags', 'node_ids', 'nodes_rad']
+
+  def __init__(self, way_id, tags, node_ids, nodes_rad):
+    self.id = way_id
+    self.tags = tags
+    self.node_ids = node_ids
+    self.nodes_rad = nodes_rad
+
+  @classmethod
+  def from_overpy(cls, way):
+    nodes = way.nodes
+    node_ids = np.array([nd.id for nd in nodes], dtype=int)
+    nodes_rad = np.radians(np.array([[nd.lat, nd.lon] for nd in nodes], dtype=float))
+    return cls(way.id, way.tags, node_ids, nodes_rad)
+
+  def __len__(self):
+    return len(self.node_ids)
+
+  def node(self, idx):
+    lat, lon = np.degrees(self.nodes_rad[idx])
+    return CompactNode(int(self.node_ids[idx]), lat, lon)
+
+  @property
+  def nodes(self):
+    """A list of `CompactNode` for the nodes of the way. Built on every call, arrays should be preferred.
+    """
+    coords = np.degrees(self.nodes_rad).tolist()
+    return [CompactNode(node_id, lat, lon) for node_id, (lat, lon) in zip(self.node_ids.tolist(), coords)]
+
+  def sub_way(self, way_id, start, end):
+    """Provides a new way with the given `way_id` and the nodes of this way in the [start, end) index range.
+    """
+    return CompactWay(way_id, self.tags, self.node_ids[start:end], self.nodes_rad[start:end])
+
+
+class WaysData():
+  """A compact struct of arrays store of OSM ways. The nodes of all ways are concatenated in `node_ids` and
+  `nodes_rad` ([lat, lon] in radians), with the nodes of the way at index `i` in the range
+  `way_offsets[i]:way_offsets[i + 1]`. Tags are interned on `tags_table` and referenced by index from `way_tags`.
+  Iterating the store provides a `CompactWay` view for every way.
+  """
+  def __init__(self, way_ids, way_offsets, way_tags, tags_table, node_ids, nodes_rad):
+    self.way_ids = way_ids
+    self.way_offsets = way_offsets
+    self.way_tags = way_tags
+    self.tags_table = tags_table
+    self.node_ids = node_ids
+    self.nodes_rad = nodes_rad
+    self._ways = None
+
+  @classmethod
+  def empty(cls):
+    return cls(np.zeros(0, dtype=int), np.zeros(1, dtype=int), np.zeros(0, dtype=int), [], np.zeros(0, dtype=int),
+               np.zeros((0, 2)))
+
+  @classmethod
+  def from_overpy(cls, ways):
+    """Builds the store from a list of overpy ways.
+    """
+    tags_table = []
+    tags_idx_map = {}
+    way_tags = []
+    node_ids = []
+    coords = []
+    way_offsets = [0]
+
+    for way in ways:
+      tags_json = json.dumps(way.tags, sort_keys=True)
+      tags_idx = tags_idx_map.get(tags_json)
+      if tags_idx is None:
+        tags_idx = len(tags_table)
+        tags_idx_map[tags_json] = tags_idx
+        tags_table.append(way.tags)
+      way_tags.append(tags_idx)
+
+      for node in way.nodes:
+        node_ids.append(node.id)
+        coords.append((node.lat, node.lon))
+      way_offsets.append(len(node_ids))
+
+    return cls(np.array([way.id for way in ways], dtype=int), np.array(way_offsets, dtype=int),
+               np.array(way_tags, dtype=int), tags_table, np.array(node_ids, dtype=int),
+               np.radians(np.array(coords, dtype=float).reshape(-1, 2)))
+
+  @classmethod
+  def from_tiles(cls, tiles):
+    """Builds the store from a list of map tiles (see `TileStore.Tile`). Ways and nodes present on several tiles are
+    included only once.
+    """
+    tiles = [tile for tile in tiles if tile.way_count > 0]
+    if len(tiles) == 0:
+      return cls.empty()
+
+    # Node coordinates for all node ids on the tiles, sorted by id for lookup.
+    all_node_ids, unique_idxs = np.unique(np.concatenate([tile.node_ids for tile in tiles]), return_index=True)
+    all_nodes_rad = np.radians(np.concatenate([tile.node_coords for tile in tiles])[unique_idxs])
+
+    tags_table = []
+    tags_idx_map = {}
+    seen_way_ids = set()
+    way_ids = []
+    way_tags = []
+    way_node_ids = []
+    way_lengths = []
+
+    for tile in tiles:
+      # Skip the ways already taken from a previous tile.
+      tile_way_ids = tile.way_ids.tolist()
+      keep = np.array([way_id not in seen_way_ids for way_id in tile_way_ids], dtype=bool)
+      seen_way_ids.update(tile_way_ids)
+      if not np.any(keep):
+        continue
+
+      # Re-intern the tile tags on the merged tags table.
+      tile_tags_map = np.zeros(len(tile.tags_table), dtype=int)
+      for idx, tags in enumerate(tile.tags_table):
+        tags_json = json.dumps(tags, sort_keys=True)
+        if tags_json not in tags_idx_map:
+          tags_idx_map[tags_json] = len(tags_table)
+          tags_table.append(tags)
+        tile_tags_map[idx] = tags_idx_map[tags_json]
+
+      offsets = tile.way_offsets.astype(int)
+      starts, ends = offsets[:-1][keep], offsets[1:][keep]
+      way_ids.append(tile.way_ids[keep])
+      way_tags.append(tile_tags_map[tile.way_tags[keep]])
+      way_node_ids.append(tile.way_nodes[_slices_indexes(starts, ends)])
+      way_lengths.append(ends - starts)
+
+    node_ids = np.concatenate(way_node_ids).astype(int)
+    nodes_rad = all_nodes_rad[np.searchsorted(all_node_ids, node_ids)]
+
+    return cls(np.concatenate(way_ids).astype(int), np.concatenate(([0], np.cumsum(np.concatenate(way_lengths)))),
+               np.concatenate(way_tags), tags_table, node_ids, nodes_rad)
+
+  def __len__(self):
+    return len(self.way_ids)
+
+  def __iter__(self):
+    return iter(self.ways)
+
+  def __getitem__(self, idx):
+    return self.ways[idx]
+
+  @property
+  def ways(self):
+    if self._ways is None:
+      offsets = self.way_offsets.tolist()
+      self._ways = [CompactWay(way_id, self.tags_table[tags_idx], self.node_ids[offsets[idx]:offsets[idx + 1]],
+                               self.nodes_rad[offsets[idx]:offsets[idx + 1]])
+                    for idx, (way_id, tags_idx) in enumerate(zip(self.way_ids.tolist(), self.way_tags.tolist()))]
+    return self._ways
+
+
+def compact_ways(ways):
+  """Provides `ways` as a `WaysData` store, converting them if given as a list of overpy ways.
+  """
+  if isinstance(ways, WaysData):
+    return ways
+  return WaysData.from_overpy(ways)
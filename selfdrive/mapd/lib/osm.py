@@ -1,26 +1,27 @@
 import overpy
 import numpy as np
 from selfdrive.mapd.lib.geo import R
+from selfdrive.mapd.lib.WaysData import WaysData
 
 
-def create_way(way_id, node_ids, from_way):
+def bbox_around_location(lat, lon, radius):
+  """Provides the (min_lat, min_lon, max_lat, max_lon) bounding box in degrees of the circle of `radius` mts around
+  location.
   """
-  Creates and OSM Way with the given `way_id` and list of `node_ids`, copying attributes and tags from `from_way`
-  """
-  return overpy.Way(way_id, node_ids=node_ids, attributes={}, result=from_way._result,
-                    tags=from_way.tags)
+  bbox_angle = np.degrees(radius / R)
+  return (lat - bbox_angle, lon - bbox_angle, lat + bbox_angle, lon + bbox_angle)
 
 
 class OSM():
-  def __init__(self):
+  def __init__(self, tile_store=None):
     self.api = overpy.Overpass()
     # self.api = overpy.Overpass(url='http://3.65.170.21/api/interpreter')
+    self.tile_store = tile_store
 
-  def fetch_road_ways_around_location(self, lat, lon, radius):
-    # Calculate the bounding box coordinates for the bbox containing the circle around location.
-    bbox_angle = np.degrees(radius / R)
-    # fetch all ways and nodes on this ways in bbox
-    bbox_str = f'{str(lat - bbox_angle)},{str(lon - bbox_angle)},{str(lat + bbox_angle)},{str(lon + bbox_angle)}'
+  def fetch_road_ways_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+    """Queries Overpass for all road ways (and their nodes) in the bounding box. Raises on connection errors.
+    """
+    bbox_str = f'{str(min_lat)},{str(min_lon)},{str(max_lat)},{str(max_lon)}'
     q = """
         way(""" + bbox_str + """)
           [highway]
@@ -28,10 +29,28 @@ class OSM():
         (._;>;);
         out;
         """
+    return self.api.query(q).ways
+
+  def fetch_road_ways_around_location(self, lat, lon, radius):
+    """Provides a `WaysData` store with all road ways in the bounding box of the circle of `radius` around location.
+    """
+    bbox = bbox_around_location(lat, lon, radius)
+
+    # When a local tile store is available, read from it and only fall back to Overpass for missing tiles.
+    # Partial results would leave holes on the map, so none are provided unless all the tiles are available. The
+    # tiles fetched are kept on the store, so a retry only needs to fetch the missing ones.
+    if self.tile_store is not None:
+      ways, missing_keys = self.tile_store.ways_in_bbox(bbox, fetch_fn=self.fetch_road_ways_in_bbox)
+      if len(missing_keys) > 0:
+        print(f'Failed to fetch map tiles {missing_keys}')
+        return WaysData.empty()
+      return ways
+
+    # fetch all ways and nodes on this ways in bbox
     try:
-      ways = self.api.query(q).ways
+      ways = WaysData.from_overpy(self.fetch_road_ways_in_bbox(*bbox))
     except Exception as e:
       print(f'Exception while querying OSM:\n{e}')
-      ways = []
+      ways = WaysData.empty()
 
     return ways
@@ -5,10 +5,15 @@ import numpy as np
 from time import strftime, gmtime
 import cereal.messaging as messaging
 from common.realtime import Ratekeeper
-from selfdrive.mapd.lib.osm import OSM
-from selfdrive.mapd.lib.geo import distance_to_points
+from selfdrive.mapd.lib.osm import OSM, bbox_around_location
+from selfdrive.mapd.lib.TileStore import TileStore, tile_keys_for_bbox
+from selfdrive.mapd.lib.CurvatureCache import CurvatureCache
+from selfdrive.mapd.lib.TilePrefetcher import TilePrefetcher
+from selfdrive.mapd.lib.geo import distance_to_points, destination_point
 from selfdrive.mapd.lib.WayCollection import WayCollection
-from selfdrive.mapd.config import QUERY_RADIUS, MIN_DISTANCE_FOR_NEW_QUERY, FULL_STOP_MAX_SPEED, LOOK_AHEAD_HORIZON_TIME
+from selfdrive.mapd.config import QUERY_RADIUS, MIN_DISTANCE_FOR_NEW_QUERY, FULL_STOP_MAX_SPEED, \
+  LOOK_AHEAD_HORIZON_TIME, MAP_TILES_PATH, MAP_TILE_SIZE, MERGE_QUERY_RESULTS, CURVATURE_CACHE_PATH, \
+  CURVATURE_CACHE_MAX_BYTES, CURVATURE_CACHE_MAX_DISK_BYTES, QUERY_CENTER_AHEAD_DISTANCE
 
 
 _DEBUG = False
@@ -29,8 +34,16 @@ threading.excepthook = excepthook
 
 
 class MapD():
-  def __init__(self):
-    self.osm = OSM()
+  def __init__(self, osm=None, curvature_cache=None):
+    if osm is None:
+      osm = OSM(tile_store=TileStore(MAP_TILES_PATH, MAP_TILE_SIZE))
+    if curvature_cache is None:
+      curvature_cache = CurvatureCache(CURVATURE_CACHE_MAX_BYTES, path=CURVATURE_CACHE_PATH,
+                                       max_disk_bytes=CURVATURE_CACHE_MAX_DISK_BYTES)
+    self.osm = osm
+    self.prefetcher = TilePrefetcher(self.osm.tile_store, self.osm.fetch_road_ways_in_bbox) \
+      if self.osm.tile_store is not None else None
+    self.curvature_cache = curvature_cache
     self.way_collection = None
     self.route = None
     self.last_gps_fix_timestamp = 0
@@ -46,6 +59,7 @@ class MapD():
     self._op_enabled = False
     self._disengaging = False
     self._query_thread = None
+    self._query_tile_keys = set()  # The keys of the map tiles covered by the last query.
     self._lock = threading.RLock()
 
   def udpate_state(self, sm):
@@ -91,23 +105,53 @@ class MapD():
 
       # Only issue an update if we received some ways. Otherwise it is most likely a conectivity issue.
       # Will retry on next loop.
-      if len(ways) > 0:
-        new_way_collection = WayCollection(ways, location_rad)
+      if len(ways) == 0:
+        return
 
-        # Use the lock to update the way_collection as it might be being used to update the route.
-        _debug('Mapd: Locking to write results from osm.')
+      # When merging results, keep the current way collection and only clear the route if the changes could
+      # affect it, this way we keep the route and its calculations when crossing query areas.
+      if MERGE_QUERY_RESULTS and self.way_collection is not None:
+        # The way relations for the new ways are built before locking, only the update of the collection and its
+        # indexes is done with the lock held.
+        merge = self.way_collection.prepare_merge(ways)
+        _debug('Mapd: Locking to merge results from osm.')
         with self._lock:
-          self.way_collection = new_way_collection
+          changed_wrs = self.way_collection.apply_merge(merge, location_rad)
+          if self.route is not None and self.route.is_affected_by(changed_wrs):
+            self.route = None
           self.last_fetch_location = location_rad
-          _debug(f'Mapd: Updated map data @ {location_deg} - got {len(ways)} ways')
+          _debug(f'Mapd: Merged map data @ {location_deg} - got {len(ways)} ways, {len(changed_wrs)} changed')
+
+        _debug('Mapd: Releasing Lock to merge results from osm')
+        return
 
-        _debug('Mapd: Releasing Lock to write results from osm')
+      new_way_collection = WayCollection(ways, location_rad, self.curvature_cache)
+
+      # Use the lock to update the way_collection as it might be being used to update the route.
+      _debug('Mapd: Locking to write results from osm.')
+      with self._lock:
+        self.way_collection = new_way_collection
+        self.last_fetch_location = location_rad
+        _debug(f'Mapd: Updated map data @ {location_deg} - got {len(ways)} ways')
+
+      _debug('Mapd: Releasing Lock to write results from osm')
 
     # Ignore if we have a query thread already running.
     if self._query_thread is not None and self._query_thread.is_alive():
       return
 
-    self._query_thread = threading.Thread(target=query, args=(self.osm, self.location_deg, self.location_rad,
+    # When driving, center the query ahead of the current location so most of the area fetched is on the way ahead.
+    query_center = self.location_rad
+    if self.gps_speed >= FULL_STOP_MAX_SPEED and self.bearing_rad is not None:
+      query_center = destination_point(self.location_rad, self.bearing_rad, QUERY_CENTER_AHEAD_DISTANCE)
+    query_center_deg = tuple(np.degrees(query_center))
+
+    # The query fetches the missing tiles it covers, the prefetcher must not fetch them as well.
+    if self.prefetcher is not None:
+      bbox = bbox_around_location(*query_center_deg, QUERY_RADIUS)
+      self._query_tile_keys = set(tile_keys_for_bbox(bbox, self.osm.tile_store.tile_size))
+
+    self._query_thread = threading.Thread(target=query, args=(self.osm, query_center_deg, query_center,
                                                               QUERY_RADIUS))
     self._query_thread.start()
 
@@ -129,6 +173,19 @@ class MapD():
 
     self._query_osm_not_blocking()
 
+  def prefetch_osm_data(self):
+    # Keep the map tiles along the path ahead available, fetching them in the background before they are needed.
+    if self.prefetcher is None:
+      return
+
+    query_running = self._query_thread is not None and self._query_thread.is_alive()
+    covered_keys = self._query_tile_keys if query_running else ()
+    self.prefetcher.update(self.location_rad, self.bearing_rad, self.gps_speed, self.route, covered_keys)
+
+  def shutdown(self):
+    if self.prefetcher is not None:
+      self.prefetcher.shutdown()
+
   def update_route(self):
     def update_proc():
       # Ensure we clear the route on op disengage, this way we can correct possible incorrect map data due
@@ -242,14 +299,18 @@ def mapd_thread(sm=None, pm=None):
   if pm is None:
     pm = messaging.PubMaster(['liveMapData'])
 
-  while True:
-    sm.update()
-    mapd.udpate_state(sm)
-    mapd.update_gps(sm)
-    mapd.updated_osm_data()
-    mapd.update_route()
-    mapd.publish(pm, sm)
-    rk.keep_time()
+  try:
+    while True:
+      sm.update()
+      mapd.udpate_state(sm)
+      mapd.update_gps(sm)
+      mapd.updated_osm_data()
+      mapd.prefetch_osm_data()
+      mapd.update_route()
+      mapd.publish(pm, sm)
+      rk.keep_time()
+  finally:
+    mapd.shutdown()
 
 
 def main(sm=None, pm=None):
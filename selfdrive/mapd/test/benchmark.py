@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import argparse
+import overpy
+import numpy as np
+from time import perf_counter
+from selfdrive.mapd.lib.WayCollection import WayCollection
+from selfdrive.mapd.lib.NodesData import _MIN_NODE_DISTANCE, _ADDED_NODES_DIST, resample_vectors
+from selfdrive.mapd.lib.geo import R
+
+
+_CITY_CENTER = (52.52, 13.405)  # deg.
+
+
+def dense_city_ways(streets=60, block_size=100., node_step=25.):
+  """Creates a synthetic dense city road network as a list of overpy ways. It is a square grid of `streets` x `streets`
+  streets, `block_size` mts apart, with a way per block and nodes every `node_step` mts.
+  """
+  result = overpy.Result()
+  lat0, lon0 = np.radians(_CITY_CENTER)
+  step_lat = block_size / R
+  step_lon = block_size / (R * np.cos(lat0))
+  nodes_per_block = max(int(block_size / node_step), 1)
+  node_ids = {}
+
+  def node_id(lat_idx, lon_idx):
+    # Nodes are on a fine grid of `nodes_per_block` subdivisions per block. Share nodes on intersections.
+    key = (lat_idx, lon_idx)
+    if key not in node_ids:
+      node_ids[key] = len(node_ids) + 1
+      lat = np.degrees(lat0 + lat_idx * step_lat / nodes_per_block)
+      lon = np.degrees(lon0 + lon_idx * step_lon / nodes_per_block)
+      result.append(overpy.Node(node_id=node_ids[key], lat=lat, lon=lon, tags={}, attributes={}, result=result))
+    return node_ids[key]
+
+  way_id = 0
+  for street in range(streets):
+    for block in range(streets - 1):
+      for horizontal in [True, False]:
+        way_id += 1
+        fixed = street * nodes_per_block
+        start = block * nodes_per_block
+        keys = [(fixed, start + i) if horizontal else (start + i, fixed) for i in range(nodes_per_block + 1)]
+        tags = {'highway': 'residential', 'name': f'{"H" if horizontal else "V"} Street {street}'}
+        result.append(overpy.Way(way_id, node_ids=[node_id(*k) for k in keys], tags=tags, attributes={},
+                                 result=result))
+
+  return result.ways
+
+
+def _percentiles(times):
+  return ', '.join(f'p{p}: {np.percentile(times, p) * 1e3:.2f} ms' for p in [50, 90, 99])
+
+
+def benchmark_route_acquisition(streets=60, samples=50, seed=0):
+  """Compares the time to acquire a route on a synthetic dense city way collection, evaluating only the way
+  relations provided by the spatial index vs evaluating all the way relations in the collection.
+  """
+  ways = dense_city_ways(streets)
+  query_center = np.radians(np.array(_CITY_CENTER))
+
+  t = perf_counter()
+  wc = WayCollection(ways, query_center)
+  print(f'WayCollection with {len(wc.way_relations)} ways built in {(perf_counter() - t) * 1e3:.1f} ms')
+
+  # Random locations on the middle of way sections, driving along the way.
+  rng = np.random.default_rng(seed)
+  fixes = []
+  for wr in rng.choice(wc.way_relations, samples):
+    idx = rng.integers(len(wr._way_bearings))
+    fixes.append(((wr._nodes_np[idx] + wr._nodes_np[idx + 1]) / 2., wr._way_bearings[idx]))
+
+  def run():
+    times = []
+    located = 0
+    for location_rad, bearing_rad in fixes:
+      t = perf_counter()
+      route = wc.get_route(location_rad, bearing_rad, 5.)
+      times.append(perf_counter() - t)
+      located += route is not None and route.located
+    return np.array(times), located
+
+  grid_times, grid_located = run()
+
+  # Brute force: all way relations are candidates on every call.
+  near_location = wc.wr_grid_index.way_relations_near_location
+  wc.wr_grid_index.way_relations_near_location = lambda _: wc.way_relations
+  all_times, all_located = run()
+  wc.wr_grid_index.way_relations_near_location = near_location
+
+  print(f'Route acquisition over {samples} fixes:')
+  print(f'  grid index:  {_percentiles(grid_times)} | located {grid_located}/{samples}')
+  print(f'  all ways:    {_percentiles(all_times)} | located {all_located}/{samples}')
+  print(f'  speedup (p50): {np.median(all_times) / np.median(grid_times):.1f}x')
+
+
+def _resample_vectors_iterative(vect, dist_prev):
+  # Previous implementation of the node data enhancement, inserting vectors one too far segment at a time.
+  for idx in np.nonzero(dist_prev >= _MIN_NODE_DISTANCE)[0][::-1]:
+    n = int(np.ceil(dist_prev[idx] / _ADDED_NODES_DIST))
+    new_v = vect[idx, :] / n
+    vect = np.delete(vect, idx, axis=0)
+    vect = np.insert(vect, [idx] * n, [new_v] * n, axis=0)
+  return vect
+
+
+def benchmark_node_resampling(node_counts=(10, 100, 1000, 10000), seed=0):
+  """Compares the single pass vectorized node data resampling with the previous iterative implementation on ways
+  with sparse nodes (rural roads), where most of the segments are too far and need resampling.
+  """
+  rng = np.random.default_rng(seed)
+  for count in node_counts:
+    dist_prev = np.concatenate(([0.], rng.uniform(10., 500., count - 1)))
+    bearings = rng.uniform(-np.pi, np.pi, count)
+    vect = np.column_stack((np.sin(bearings), np.cos(bearings))) * dist_prev[:, None]
+    repeat = max(int(1000 / count), 1)
+
+    t = perf_counter()
+    for _ in range(repeat):
+      resampled = resample_vectors(vect, dist_prev)
+    vectorized = (perf_counter() - t) / repeat
+
+    t = perf_counter()
+    for _ in range(repeat):
+      expected = _resample_vectors_iterative(vect, dist_prev)
+    iterative = (perf_counter() - t) / repeat
+
+    assert np.allclose(resampled, expected)
+    print(f'{count:6d} nodes -> {len(resampled):7d} | vectorized: {vectorized * 1e3:8.3f} ms | '
+          f'iterative: {iterative * 1e3:9.3f} ms | speedup: {iterative / vectorized:7.1f}x')
+
+
+BENCHMARKS = {
+  'route_acquisition': benchmark_route_acquisition,
+  'node_resampling': benchmark_node_resampling,
+}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="mapd micro-benchmarks")
+  parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run. All by default: {list(BENCHMARKS.keys())}")
+  args = parser.parse_args()
+
+  for name in args.benchmarks or BENCHMARKS.keys():
+    print(f'***** {name} *****')
+    BENCHMARKS[name]()
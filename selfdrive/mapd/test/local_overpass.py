@@ -0,0 +1,64 @@
+import re
+import time
+import overpy
+import numpy as np
+
+
+_BBOX_RE = re.compile(r'way\(\s*([-\d.]+)\s*,\s*([-\d.]+)\s*,\s*([-\d.]+)\s*,\s*([-\d.]+)\s*\)')
+_EXCLUDED_HIGHWAY_RE = re.compile(r'\[highway!~"([^"]*)"\]')
+
+
+class LocalOverpass():
+  """A file-backed stand-in for `overpy.Overpass` serving the road way queries issued by mapd (`OSM`) from local
+  OSM XML extracts, so map data can be provided without network access and with a reproducible content.
+  A fixed `latency` in seconds can be added to every query to mimic a remote server.
+  """
+  def __init__(self, xml_paths, latency=0.):
+    self.latency = latency
+    self.query_count = 0
+    self.result = overpy.Result()
+    for path in xml_paths:
+      with open(path, 'r', encoding='utf-8') as f:
+        self.result.expand(overpy.Result.from_xml(f.read()))
+
+    # Flat arrays of the nodes of every way to resolve the bounding box queries with numpy.
+    self._ways = [way for way in self.result.ways if len(way.nodes) > 0]
+    way_nodes = [way.nodes for way in self._ways]
+    self._way_nodes_coords = np.array([[float(n.lat), float(n.lon)] for nodes in way_nodes for n in nodes],
+                                      dtype=float).reshape(-1, 2)
+    self._way_offsets = np.cumsum([0] + [len(nodes) for nodes in way_nodes])
+
+  def query(self, query):
+    """Provides an `overpy.Result` with the ways with the `highway` tag having at least one node in the
+    bounding box of the query, along with all of their nodes. The excluded highway types on the query are honored.
+    """
+    self.query_count += 1
+    if self.latency > 0.:
+      time.sleep(self.latency)
+
+    bbox_match = _BBOX_RE.search(query)
+    if bbox_match is None:
+      raise overpy.exception.OverPyException(f'Unsupported query on local overpass:\n{query}')
+    min_lat, min_lon, max_lat, max_lon = map(float, bbox_match.groups())
+
+    excluded_match = _EXCLUDED_HIGHWAY_RE.search(query)
+    excluded_re = re.compile(excluded_match.group(1)) if excluded_match is not None else None
+
+    result = overpy.Result(api=self)
+    if len(self._ways) == 0:
+      return result
+
+    lat, lon = self._way_nodes_coords[:, 0], self._way_nodes_coords[:, 1]
+    in_bbox = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+    ways_in_bbox = np.logical_or.reduceat(in_bbox, self._way_offsets[:-1])
+
+    for idx in np.nonzero(ways_in_bbox)[0]:
+      way = self._ways[idx]
+      highway = way.tags.get('highway')
+      if highway is None or (excluded_re is not None and excluded_re.match(highway)):
+        continue
+      result.append(way)
+      for node in way.nodes:
+        result.append(node)
+
+    return result
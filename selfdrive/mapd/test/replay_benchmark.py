@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Replays the `gpsLocationExternal` (and `controlsState`) messages of one or more rlogs through mapd, serving the OSM
+map data from local OSM XML extracts (see `LocalOverpass`), and reports per stage latency percentiles, route lost
+events and memory usage.
+
+  PYTHONPATH=. selfdrive/mapd/test/replay_benchmark.py rlog.bz2 [rlog.bz2 ...] --osm area.osm
+"""
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import numpy as np
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+from tools.lib.logreader import LogReader
+from selfdrive.mapd.mapd import MapD
+from selfdrive.mapd.lib.osm import OSM
+from selfdrive.mapd.lib.TileStore import TileStore
+from selfdrive.mapd.lib.CurvatureCache import CurvatureCache
+from selfdrive.mapd.config import MAP_TILE_SIZE, CURVATURE_CACHE_MAX_BYTES
+from selfdrive.mapd.test.local_overpass import LocalOverpass
+
+
+_SERVICES = ['gpsLocationExternal', 'controlsState']
+_STAGES = ['update_gps', 'updated_osm_data', 'osm_query', 'prefetch_osm_data', 'update_route', 'publish', 'total']
+_PERCENTILES = [50, 90, 99]
+
+
+class ReplaySubMaster():
+  """Minimal `SubMaster` stand-in holding the last replayed message of every service.
+  """
+  def __init__(self, services):
+    self.data = {s: None for s in services}
+    self.updated = {s: False for s in services}
+    self.valid = {s: False for s in services}
+
+  def update_msgs(self, msgs):
+    for s in self.updated:
+      self.updated[s] = False
+    for msg in msgs:
+      s = msg.which()
+      self.data[s] = getattr(msg, s)
+      self.updated[s] = True
+      self.valid[s] = msg.valid
+
+  def __getitem__(self, s):
+    return self.data[s]
+
+  def all_alive_and_valid(self, service_list=None):
+    return all(self.valid[s] for s in (service_list if service_list is not None else self.valid))
+
+
+class ReplayPubMaster():
+  """Minimal `PubMaster` stand-in counting the published messages.
+  """
+  def __init__(self):
+    self.sent = defaultdict(int)
+
+  def send(self, s, dat):
+    self.sent[s] += 1
+
+
+class StageTimer():
+  def __init__(self):
+    self.durations = defaultdict(list)
+
+  @contextmanager
+  def measure(self, stage):
+    t = perf_counter()
+    yield
+    self.durations[stage].append(perf_counter() - t)
+
+  def report(self):
+    print(f'{"stage":<20}{"count":>8}' + ''.join(f'{"p" + str(p):>10}' for p in _PERCENTILES) + f'{"max":>10}')
+    for stage in _STAGES:
+      durations = np.array(self.durations.get(stage, [])) * 1e3
+      if len(durations) == 0:
+        continue
+      values = list(np.percentile(durations, _PERCENTILES)) + [np.max(durations)]
+      print(f'{stage:<20}{len(durations):>8}' + ''.join(f'{v:>8.2f}ms' for v in values))
+
+
+def mapd_frames(lrs, rate=1.):
+  """Groups the messages of the mapd services on the logs in frames of `1 / rate` seconds, the way mapd would
+  receive them when running at `rate` hz. Yields the (logMonoTime, messages) of every frame.
+  """
+  frame_ns = int(1e9 / rate)
+  frame_start = None
+  msgs = []
+  for lr in lrs:
+    for msg in lr:
+      if msg.which() not in _SERVICES:
+        continue
+
+      if frame_start is None:
+        frame_start = msg.logMonoTime
+      elif msg.logMonoTime - frame_start >= frame_ns:
+        yield frame_start, msgs
+        frame_start, msgs = msg.logMonoTime, []
+      msgs.append(msg)
+
+  if len(msgs) > 0:
+    yield frame_start, msgs
+
+
+def replay_mapd(frames, api, tmp_path, prefetch=True):
+  """Runs mapd over the given `frames` with map data served by `api`. Query threads are waited for on every frame
+  to keep the replay deterministic, its time is reported on the `osm_query` stage.
+  Returns the stage timer, the list of route lost events as (seconds from start, location in degrees), the pub
+  master and the mapd instance.
+  """
+  osm = OSM(tile_store=TileStore(tmp_path, MAP_TILE_SIZE))
+  osm.api = api
+  mapd = MapD(osm=osm, curvature_cache=CurvatureCache(CURVATURE_CACHE_MAX_BYTES))
+  sm = ReplaySubMaster(_SERVICES)
+  pm = ReplayPubMaster()
+  timer = StageTimer()
+  route_lost_events = []
+  start_time = None
+  was_located = False
+
+  for log_mono_time, msgs in frames:
+    start_time = log_mono_time if start_time is None else start_time
+    sm.update_msgs(msgs)
+
+    with timer.measure('total'):
+      mapd.udpate_state(sm)
+      with timer.measure('update_gps'):
+        mapd.update_gps(sm)
+      with timer.measure('updated_osm_data'):
+        mapd.updated_osm_data()
+      query_thread = mapd._query_thread
+      if query_thread is not None and query_thread.is_alive():
+        with timer.measure('osm_query'):
+          query_thread.join()
+      if prefetch:
+        with timer.measure('prefetch_osm_data'):
+          mapd.prefetch_osm_data()
+      with timer.measure('update_route'):
+        mapd.update_route()
+      with timer.measure('publish'):
+        mapd.publish(pm, sm)
+
+    located = mapd.route is not None and mapd.route.located
+    if was_located and not located:
+      route_lost_events.append(((log_mono_time - start_time) * 1e-9, mapd.location_deg))
+    was_located = located
+
+  if mapd.prefetcher is not None:
+    mapd.prefetcher.shutdown()
+
+  return timer, route_lost_events, pm, mapd
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("logs", nargs="+", help="rlogs to replay, in order")
+  parser.add_argument("--osm", nargs="+", required=True, help="OSM XML extracts covering the drive")
+  parser.add_argument("--rate", type=float, default=1., help="mapd update rate in hz")
+  parser.add_argument("--overpass-latency", type=float, default=0., help="seconds added to every OSM query")
+  parser.add_argument("--no-prefetch", action="store_true", help="do not prefetch map tiles ahead")
+  parser.add_argument("--trace-memory", action="store_true", help="trace python allocations (slower)")
+  args = parser.parse_args()
+
+  api = LocalOverpass(args.osm, latency=args.overpass_latency)
+  if args.trace_memory:
+    tracemalloc.start()
+
+  with tempfile.TemporaryDirectory() as tmp_path:
+    frames = mapd_frames((LogReader(fn, only_union_types=True) for fn in args.logs), rate=args.rate)
+    timer, route_lost_events, pm, mapd = replay_mapd(frames, api, tmp_path, prefetch=not args.no_prefetch)
+
+  print(f'\nReplayed {len(timer.durations["total"])} frames, {api.query_count} OSM queries, '
+        f'{pm.sent["liveMapData"]} liveMapData published.\n')
+  timer.report()
+
+  print(f'\nRoute lost {len(route_lost_events)} times:')
+  for t, location in route_lost_events:
+    print(f'  {t:8.1f}s @ {location}')
+
+  print('\nMemory:')
+  print(f'  max rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
+  if args.trace_memory:
+    current, peak = tracemalloc.get_traced_memory()
+    print(f'  traced python allocations: {current / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB')
+  print(f'  curvature cache: {len(mapd.curvature_cache)} entries, {mapd.curvature_cache.nbytes / 2**20:.2f} MB')
+  if mapd.way_collection is not None:
+    print(f'  way collection: {len(mapd.way_collection.way_relations)} way relations')
+
+
+if __name__ == "__main__":
+  main()
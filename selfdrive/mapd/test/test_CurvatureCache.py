@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+import numpy as np
+from unittest import mock
+from numpy.testing import assert_array_almost_equal
+from selfdrive.mapd.lib.CurvatureCache import CurvatureCache, curvature_cache_key
+from selfdrive.mapd.lib.NodesData import NodesData
+from selfdrive.mapd.test.mock_data import mockRouteData_02_01
+
+
+def entry(size, value=1.):
+  return np.full(size, value), np.arange(size, dtype=float), np.full((2, 4), value)
+
+
+class TestCurvatureCache(unittest.TestCase):
+  def test_curvature_cache_key(self):
+    data = np.array([[1., 0.1, 0.2, 30.], [2., 0.3, 0.4, 30.]])
+    other_speed = data.copy()
+    other_speed[:, 3] = 50.
+    moved = data.copy()
+    moved[1, 1] = 0.31
+
+    self.assertEqual(curvature_cache_key(data), curvature_cache_key(other_speed))
+    self.assertNotEqual(curvature_cache_key(data), curvature_cache_key(moved))
+    self.assertNotEqual(curvature_cache_key(data), curvature_cache_key(np.flip(data, axis=0)))
+
+  def test_get_and_put(self):
+    cache = CurvatureCache(1024 * 1024)
+    self.assertIsNone(cache.get('a'))
+
+    cache.put('a', *entry(10))
+    cached = cache.get('a')
+
+    assert_array_almost_equal(cached[0], entry(10)[0])
+    assert_array_almost_equal(cached[1], entry(10)[1])
+    assert_array_almost_equal(cached[2], entry(10)[2])
+
+  def test_evicts_least_recently_used(self):
+    entry_bytes = sum(arr.nbytes for arr in entry(10))
+    cache = CurvatureCache(3 * entry_bytes)
+    for key in ['a', 'b', 'c']:
+      cache.put(key, *entry(10))
+
+    cache.get('a')
+    cache.put('d', *entry(10))
+
+    self.assertEqual(len(cache), 3)
+    self.assertEqual(cache.nbytes, 3 * entry_bytes)
+    self.assertIsNone(cache.get('b'))
+    self.assertIsNotNone(cache.get('a'))
+
+  def test_ignores_entries_over_budget(self):
+    cache = CurvatureCache(100)
+    cache.put('a', *entry(100))
+    self.assertIsNone(cache.get('a'))
+    self.assertEqual(cache.nbytes, 0)
+
+  def test_persists_on_disk(self):
+    with tempfile.TemporaryDirectory() as path:
+      CurvatureCache(1024 * 1024, path=path, max_disk_bytes=1024 * 1024).put('a', *entry(10, 2.))
+
+      cache = CurvatureCache(1024 * 1024, path=path, max_disk_bytes=1024 * 1024)
+      cached = cache.get('a')
+
+      assert_array_almost_equal(cached[0], entry(10, 2.)[0])
+      assert_array_almost_equal(cached[2], entry(10, 2.)[2])
+      self.assertEqual(len(cache), 1)
+
+  def test_evicts_from_disk(self):
+    with tempfile.TemporaryDirectory() as path:
+      cache = CurvatureCache(1024 * 1024, path=path, max_disk_bytes=2000)
+      for key in ['a', 'b', 'c']:
+        cache.put(key, *entry(50))
+
+      cache = CurvatureCache(1024 * 1024, path=path, max_disk_bytes=2000)
+      self.assertIsNone(cache.get('a'))
+      self.assertIsNotNone(cache.get('c'))
+
+
+class TestNodesDataWithCurvatureCache(unittest.TestCase):
+  def test_reuses_cached_calculations(self):
+    cache = CurvatureCache(1024 * 1024)
+    mockRouteData_02_01.reset()
+    wrs = mockRouteData_02_01.wrs
+    wr_index = mockRouteData_02_01.way_collection.wr_index
+
+    nd = NodesData(wrs, wr_index, cache)
+    self.assertEqual(len(cache), 1)
+
+    with mock.patch('selfdrive.mapd.lib.NodesData.spline_curvature_calculations') as spline_mock:
+      cached_nd = NodesData(wrs, wr_index, cache)
+      spline_mock.assert_not_called()
+
+    assert_array_almost_equal(cached_nd._curvature_speed_sections_data, nd._curvature_speed_sections_data)
+    self.assertEqual(len(cached_nd.curvatures_speed_limit_sections_ahead(3, 10.)),
+                     len(nd.curvatures_speed_limit_sections_ahead(3, 10.)))
@@ -3,10 +3,10 @@ import numpy as np
 from selfdrive.mapd.lib.geo import DIRECTION
 from selfdrive.config import Conversions as CV
 from selfdrive.mapd.lib.WayRelation import WayRelation
-from selfdrive.mapd.lib.NodesData import nodes_raw_data_array_for_wr, node_calculations, \
-  spline_curvature_calculations, split_speed_section_by_sign, split_speed_section_by_curv_degree, speed_section, \
-  speed_limits_for_curvatures_data, is_wr_a_valid_divertion_from_node, SpeedLimitSection, TurnSpeedLimitSection, \
-  NodesData, NodeDataIdx
+from selfdrive.mapd.lib.NodesData import _MIN_NODE_DISTANCE, _ADDED_NODES_DIST, nodes_raw_data_array_for_wr, \
+  node_calculations, resample_vectors, spline_curvature_calculations, split_speed_section_by_sign, \
+  split_speed_section_by_curv_degree, speed_section, speed_limits_for_curvatures_data, \
+  is_wr_a_valid_divertion_from_node, SpeedLimitSection, TurnSpeedLimitSection, NodesData, NodeDataIdx
 from selfdrive.mapd.test.mock_data import mockOSMWay_01_01_LongCurvy, mockNodesData01, mockCurveSectionSin, \
   mockCurveSteepCurvChange, mockCurveSteepCurvChangeShort, mockCurveSmoothCurveChange, \
   mockOSMWay_02_01_CurvyTownWithIntersections, mockOSMWay_02_02_Divertion_34785115, mockOSMWay_02_03_Short_3_node_way, \
@@ -57,6 +57,27 @@ class TestNodesDataFileFunctions(unittest.TestCase):
     with self.assertRaises(IndexError):
       node_calculations(points)
 
+  def test_resample_vectors(self):
+    vect = np.array([[3., 4.], [30., 40.], [60., 80.], [0., 1.]])
+    dist_prev = np.linalg.norm(vect, axis=1)  # [5., 50., 100., 1.]
+
+    resampled = resample_vectors(vect, dist_prev)
+
+    expected = np.concatenate(([[3., 4.]], [[30. / 4, 40. / 4]] * 4, [[60. / 7, 80. / 7]] * 7, [[0., 1.]]))
+    assert_array_almost_equal(resampled, expected)
+    assert_array_almost_equal(np.sum(resampled, axis=0), np.sum(vect, axis=0))
+
+  def test_resample_vectors_matches_iterative_insertion(self):
+    vect = mockNodesData01.v
+    dist_prev = mockNodesData01.dp
+
+    expected = vect
+    for idx in np.nonzero(dist_prev >= _MIN_NODE_DISTANCE)[0][::-1]:
+      n = int(np.ceil(dist_prev[idx] / _ADDED_NODES_DIST))
+      expected = np.insert(np.delete(expected, idx, axis=0), [idx] * n, [expected[idx, :] / n] * n, axis=0)
+
+    assert_array_almost_equal(resample_vectors(vect, dist_prev), expected)
+
   def test_spline_curvature_calculations(self):
     vect = mockNodesData01.v
     dist_prev = mockNodesData01.dp
@@ -0,0 +1,141 @@
+import tempfile
+import time
+import unittest
+import numpy as np
+from unittest import mock
+from numpy.testing import assert_array_almost_equal
+from selfdrive.mapd.lib.TilePrefetcher import TilePrefetcher, straight_path, predict_path, corridor_tile_keys
+from selfdrive.mapd.lib.TileStore import TileStore, tile_key
+from selfdrive.mapd.lib.WayCollection import WayCollection
+from selfdrive.mapd.lib.geo import distance_to_points
+from selfdrive.mapd.test.mock_data import mockOSMResponse02
+from selfdrive.mapd.test.test_WayCollection import location_on_way
+
+
+_TILE_SIZE = 0.1
+_LOCATION = np.radians(np.array([52.25, 13.85]))
+
+
+class TestTilePrefetcherFileFunctions(unittest.TestCase):
+  def test_straight_path(self):
+    points = straight_path(_LOCATION, np.pi / 2., 2500.)
+
+    assert_array_almost_equal(distance_to_points(_LOCATION, points), [1000., 2000., 2500.], decimal=3)
+    assert_array_almost_equal(points[:, 0], [_LOCATION[0]] * 3, decimal=6)
+    self.assertTrue(np.all(np.diff(points[:, 1]) > 0.))
+    self.assertEqual(straight_path(_LOCATION, 0., 0.).shape, (0, 2))
+
+  def test_predict_path_without_route(self):
+    points = predict_path(_LOCATION, 0., 3000.)
+
+    assert_array_almost_equal(points[0], _LOCATION)
+    assert_array_almost_equal(distance_to_points(_LOCATION, points), [0., 1000., 2000., 3000.], decimal=3)
+
+  def test_predict_path_with_route(self):
+    wc = WayCollection(mockOSMResponse02.ways, mockOSMResponse02.query_center)
+    wr = next(wr for wr in wc.way_relations if wr.id == 178450395)
+    location_rad, bearing_rad = location_on_way(wr, 2)
+    route = wc.get_route(location_rad, bearing_rad, 5.)
+
+    horizon = route.distance_to_end + 2000.
+    points = predict_path(location_rad, bearing_rad, horizon, route)
+    route_points = route.coordinates_ahead(horizon)
+
+    # Follows the route ahead, continues 2 km straight beyond the end of it and adds divertions.
+    assert_array_almost_equal(points[1:len(route_points) + 1], route_points)
+    extension = points[len(route_points) + 1:len(route_points) + 3]
+    assert_array_almost_equal(distance_to_points(route_points[-1], extension), [1000., 2000.], decimal=3)
+    self.assertEqual(len(points), len(route_points) + 3 + len(route.possible_divertions))
+
+  def test_corridor_tile_keys(self):
+    points = np.radians(np.array([[52.25, 13.85], [52.25, 13.95], [52.25, 13.99]]))
+
+    keys = corridor_tile_keys(points, 1000., _TILE_SIZE)
+
+    self.assertEqual(keys, [(522, 138), (522, 139)])
+    self.assertEqual(len(corridor_tile_keys(points, 10000., _TILE_SIZE)), 12)
+
+
+class TestTilePrefetcher(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.store = TileStore(self.tmp_dir.name, _TILE_SIZE)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def wait(self, prefetcher):
+    for future in list(prefetcher._pending.values()):
+      future.result()
+
+  def test_fetches_missing_upcoming_tiles(self):
+    self.store.write_tile(tile_key(52.25, 13.85, _TILE_SIZE), [])
+    fetch_fn = mock.Mock(return_value=[])
+    prefetcher = TilePrefetcher(self.store, fetch_fn)
+
+    prefetcher.update(_LOCATION, np.pi / 2., 30.)
+    self.wait(prefetcher)
+
+    self.assertEqual(prefetcher.upcoming[0], tile_key(52.25, 13.85, _TILE_SIZE))
+    self.assertEqual(fetch_fn.call_count, len(prefetcher.upcoming) - 1)
+    self.assertTrue(all(self.store.has_tile(key) for key in prefetcher.upcoming))
+
+    # No new fetches once all tiles are on the store.
+    fetch_fn.reset_mock()
+    prefetcher.update(_LOCATION, np.pi / 2., 30.)
+    self.assertEqual(prefetcher.pending_count, 0)
+    fetch_fn.assert_not_called()
+    prefetcher.shutdown()
+
+  def test_does_not_retry_failed_tiles_right_away(self):
+    fetch_fn = mock.Mock(side_effect=Exception('No connection'))
+    prefetcher = TilePrefetcher(self.store, fetch_fn)
+
+    prefetcher.update(_LOCATION, 0., 0.)
+    self.wait(prefetcher)
+    call_count = fetch_fn.call_count
+    self.assertGreater(call_count, 0)
+
+    prefetcher.update(_LOCATION, 0., 0.)
+    self.assertEqual(prefetcher.pending_count, 0)
+    self.assertEqual(fetch_fn.call_count, call_count)
+    prefetcher.shutdown()
+
+  def test_skips_covered_tiles(self):
+    fetch_fn = mock.Mock(return_value=[])
+    prefetcher = TilePrefetcher(self.store, fetch_fn)
+    covered_keys = {tile_key(52.25, 13.85, _TILE_SIZE), tile_key(52.25, 13.95, _TILE_SIZE)}
+
+    prefetcher.update(_LOCATION, np.pi / 2., 30., covered_keys=covered_keys)
+    self.wait(prefetcher)
+
+    self.assertTrue(covered_keys.issubset(prefetcher.upcoming))
+    self.assertEqual(fetch_fn.call_count, len(prefetcher.upcoming) - 2)
+    self.assertFalse(any(self.store.has_tile(key) for key in covered_keys))
+    prefetcher.shutdown()
+
+  def test_does_not_fetch_tiles_stored_since_scheduled(self):
+    fetch_fn = mock.Mock(return_value=[])
+    prefetcher = TilePrefetcher(self.store, fetch_fn)
+    key = tile_key(52.25, 13.85, _TILE_SIZE)
+    self.store.write_tile(key, [])
+
+    self.assertTrue(prefetcher._fetch(key))
+    fetch_fn.assert_not_called()
+    prefetcher.shutdown()
+
+  def test_shutdown_cancels_pending_fetches(self):
+    prefetcher = TilePrefetcher(self.store, mock.Mock(return_value=[]), workers=1)
+    with mock.patch.object(prefetcher, '_fetch', side_effect=lambda key: time.sleep(0.1)):
+      prefetcher.update(_LOCATION, np.pi / 2., 30.)
+      futures = list(prefetcher._pending.values())
+      prefetcher.shutdown()
+
+    self.assertEqual(prefetcher.pending_count, 0)
+    self.assertTrue(all(future.cancelled() for future in futures[1:]))
+
+  def test_update_without_location(self):
+    prefetcher = TilePrefetcher(self.store, mock.Mock())
+    prefetcher.update(None, None, 0.)
+    self.assertEqual(prefetcher.upcoming, [])
+    prefetcher.shutdown()
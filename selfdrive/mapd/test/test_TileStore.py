@@ -0,0 +1,139 @@
+import tempfile
+import unittest
+from unittest import mock
+from selfdrive.mapd.lib.TileStore import TileStore, Tile, encode_tile, tile_key, tile_bbox, tile_keys_for_bbox
+from selfdrive.mapd.lib.osm import OSM
+from selfdrive.mapd.lib.WaysData import WaysData
+from numpy.testing import assert_array_almost_equal
+from selfdrive.mapd.test.mock_data import mockOSMResponse01
+
+
+_TILE_SIZE = 0.1
+
+
+class TestTileStoreFileFunctions(unittest.TestCase):
+  def test_tile_key_and_bbox(self):
+    key = tile_key(52.23, -13.86, _TILE_SIZE)
+    self.assertEqual(key, (522, -139))
+
+    bbox = tile_bbox(key, _TILE_SIZE)
+    self.assertAlmostEqual(bbox[0], 52.2)
+    self.assertAlmostEqual(bbox[1], -13.9)
+    self.assertAlmostEqual(bbox[2], 52.3)
+    self.assertAlmostEqual(bbox[3], -13.8)
+
+  def test_tile_keys_for_bbox(self):
+    keys = tile_keys_for_bbox((52.15, 13.75, 52.25, 13.85), _TILE_SIZE)
+    self.assertEqual(keys, [(521, 137), (521, 138), (522, 137), (522, 138)])
+
+  def test_encode_tile_round_trip(self):
+    ways = mockOSMResponse01.ways
+    tile = Tile(encode_tile(ways))
+
+    self.assertEqual(tile.way_count, len(ways))
+    self.assertEqual(tile.way_ids.tolist(), [way.id for way in ways])
+    self.assertLess(len(tile.tags_table), len(ways))  # tags are interned
+
+    result_ways = {way.id: way for way in WaysData.from_tiles([tile])}
+    for way in ways:
+      result_way = result_ways[way.id]
+      self.assertEqual(result_way.tags, way.tags)
+      self.assertEqual(result_way.node_ids.tolist(), [n.id for n in way.nodes])
+      assert_array_almost_equal([(n.lat, n.lon) for n in result_way.nodes],
+                                [(float(n.lat), float(n.lon)) for n in way.nodes])
+
+  def test_invalid_tile_raises(self):
+    with self.assertRaises(ValueError):
+      Tile(b'XXXX' + encode_tile([])[4:])
+
+
+class TestTileStore(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.store = TileStore(self.tmp_dir.name, _TILE_SIZE)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_fetches_missing_tiles_and_writes_them_back(self):
+    ways = mockOSMResponse01.ways
+    fetch_fn = mock.Mock(return_value=ways)
+    bbox = (52.15, 13.75, 52.25, 13.85)
+
+    result, missing_keys = self.store.ways_in_bbox(bbox, fetch_fn=fetch_fn)
+
+    self.assertEqual(fetch_fn.call_count, 4)
+    self.assertEqual(missing_keys, [])
+    self.assertEqual(sorted(way.id for way in result), sorted(way.id for way in ways))
+    for key in tile_keys_for_bbox(bbox, _TILE_SIZE):
+      self.assertTrue(self.store.has_tile(key))
+
+    # A second store on the same path serves the ways without fetching.
+    fetch_fn.reset_mock()
+    result, missing_keys = TileStore(self.tmp_dir.name, _TILE_SIZE).ways_in_bbox(bbox, fetch_fn=fetch_fn)
+    fetch_fn.assert_not_called()
+    self.assertEqual(missing_keys, [])
+    self.assertEqual(sorted(way.id for way in result), sorted(way.id for way in ways))
+
+  def test_failed_fetch_is_not_stored(self):
+    fetch_fn = mock.Mock(side_effect=Exception('No connection'))
+    key = (521, 137)
+
+    self.assertIsNone(self.store.fetch_tile(key, fetch_fn))
+    self.assertFalse(self.store.has_tile(key))
+    ways, missing_keys = self.store.ways_in_bbox(tile_bbox(key, _TILE_SIZE))
+    self.assertEqual(len(ways), 0)
+    self.assertIn(key, missing_keys)
+
+  def test_reports_tiles_failed_to_fetch(self):
+    bbox = (52.15, 13.75, 52.25, 13.85)
+    failing_key = (522, 137)
+
+    def fetch_fn(*tile_bbox_):
+      if tile_bbox_ == tile_bbox(failing_key, _TILE_SIZE):
+        raise Exception('Timeout')
+      return mockOSMResponse01.ways
+
+    ways, missing_keys = self.store.ways_in_bbox(bbox, fetch_fn=fetch_fn)
+
+    self.assertEqual(missing_keys, [failing_key])
+    self.assertEqual(len(ways), len(mockOSMResponse01.ways))
+    self.assertFalse(self.store.has_tile(failing_key))
+
+  def test_osm_provides_no_ways_on_tiles_failed_to_fetch(self):
+    osm = OSM(tile_store=self.store)
+    failing_key = tile_key(52.25, 13.85, _TILE_SIZE)
+
+    def fetch_fn(*bbox):
+      if bbox == tile_bbox(failing_key, _TILE_SIZE):
+        raise Exception('Timeout')
+      return mockOSMResponse01.ways
+
+    # Nothing is provided until all the tiles are available, the ones fetched are stored and not fetched again.
+    with mock.patch.object(osm, 'fetch_road_ways_in_bbox', side_effect=fetch_fn) as fetch:
+      self.assertEqual(len(osm.fetch_road_ways_around_location(52.25, 13.85, 10000.)), 0)
+      call_count = fetch.call_count
+      self.assertGreater(call_count, 1)
+
+    with mock.patch.object(osm, 'fetch_road_ways_in_bbox', return_value=mockOSMResponse01.ways) as fetch:
+      ways = osm.fetch_road_ways_around_location(52.25, 13.85, 10000.)
+      self.assertEqual(fetch.call_count, 1)
+      self.assertEqual(len(ways), len(mockOSMResponse01.ways))
+
+  def test_limits_open_tiles(self):
+    store = TileStore(self.tmp_dir.name, _TILE_SIZE, max_open_tiles=2)
+    for key in [(0, 0), (0, 1), (0, 2)]:
+      store.write_tile(key, [])
+      store.read_tile(key)
+
+    self.assertEqual(list(store._tiles.keys()), [(0, 1), (0, 2)])
+
+  def test_osm_reads_from_tile_store(self):
+    osm = OSM(tile_store=self.store)
+    with mock.patch.object(osm, 'fetch_road_ways_in_bbox', return_value=mockOSMResponse01.ways) as fetch:
+      ways = osm.fetch_road_ways_around_location(52.25, 13.85, 1000.)
+      self.assertEqual(fetch.call_count, 1)
+      self.assertEqual(len(ways), len(mockOSMResponse01.ways))
+
+      osm.fetch_road_ways_around_location(52.25, 13.85, 1000.)
+      self.assertEqual(fetch.call_count, 1)
@@ -0,0 +1,160 @@
+import unittest
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from selfdrive.mapd.lib.WayCollection import WayCollection, _GRID_CELL_SIZE
+from selfdrive.mapd.lib.WayRelationIndex import WayRelationGridIndex
+from selfdrive.mapd.lib.NodesData import NodeDataIdx
+from selfdrive.mapd.lib.WaysData import WaysData
+from selfdrive.mapd.lib.geo import DIRECTION
+from selfdrive.mapd.test.mock_data import mockOSMResponse01, mockOSMResponse02
+
+
+def location_on_way(wr, idx):
+  """Provides a location and bearing in the middle of the section between nodes `idx` and `idx + 1` of `wr`.
+  """
+  location_rad = (wr._nodes_np[idx] + wr._nodes_np[idx + 1]) / 2.
+  return location_rad, wr._way_bearings[idx]
+
+
+class TestWayRelationGridIndex(unittest.TestCase):
+  def setUp(self):
+    self.wc = WayCollection(mockOSMResponse02.ways, mockOSMResponse02.query_center)
+
+  def test_near_location_includes_all_ways_containing_location(self):
+    index = WayRelationGridIndex(self.wc.way_relations, _GRID_CELL_SIZE)
+
+    for wr in self.wc.way_relations[::10]:
+      location_rad, _ = location_on_way(wr, 0)
+      expected = [w.id for w in self.wc.way_relations if w.is_location_in_bbox(location_rad)]
+      near = [w.id for w in index.way_relations_near_location(location_rad)]
+
+      self.assertTrue(set(expected).issubset(near))
+      self.assertLess(len(near), len(self.wc.way_relations))
+
+  def test_remove(self):
+    index = WayRelationGridIndex(self.wc.way_relations, _GRID_CELL_SIZE)
+    wr = self.wc.way_relations[0]
+    location_rad, _ = location_on_way(wr, 0)
+
+    index.remove(wr)
+
+    self.assertNotIn(wr, index.way_relations_near_location(location_rad))
+
+  def test_near_location_outside_any_way(self):
+    index = WayRelationGridIndex(self.wc.way_relations, _GRID_CELL_SIZE)
+    self.assertEqual(index.way_relations_near_location(np.array([0., 0.])), [])
+
+
+class TestWayCollection(unittest.TestCase):
+  def setUp(self):
+    self.wc = WayCollection(mockOSMResponse02.ways, mockOSMResponse02.query_center)
+
+  def test_get_route_with_missing_values(self):
+    self.assertIsNone(self.wc.get_route(None, 0., 10.))
+    self.assertIsNone(self.wc.get_route(np.array([0., 0.]), None, 10.))
+    self.assertIsNone(self.wc.get_route(np.array([0., 0.]), 0., None))
+
+  def test_get_route_outside_any_way(self):
+    self.assertIsNone(self.wc.get_route(np.array([0., 0.]), 0., 10.))
+
+  def test_get_route(self):
+    wr = next(wr for wr in self.wc.way_relations if wr.id == 178450395)
+    location_rad, bearing_rad = location_on_way(wr, 2)
+
+    route = self.wc.get_route(location_rad, bearing_rad, 5.)
+
+    self.assertTrue(route.located)
+    self.assertEqual(route.current_wr.id, 178450395)
+    self.assertEqual(route.current_wr.direction, DIRECTION.FORWARD)
+    self.assertEqual(route.way_collection_id, self.wc.id)
+
+  def test_get_route_resets_previous_candidates(self):
+    wr = next(wr for wr in self.wc.way_relations if wr.id == 178450395)
+    location_rad, bearing_rad = location_on_way(wr, 2)
+    self.wc.get_route(location_rad, bearing_rad, 5.)
+    self.assertTrue(wr.active)
+
+    self.wc.get_route(np.array([0., 0.]), 0., 10.)
+
+    self.assertFalse(wr.active)
+    self.assertFalse(any(w.active for w in self.wc.way_relations))
+
+  def test_merge_same_ways_keeps_way_relations(self):
+    wrs = list(self.wc.way_relations)
+    wc_id = self.wc.id
+
+    changed = self.wc.merge(mockOSMResponse02.ways, mockOSMResponse02.query_center)
+
+    self.assertEqual(changed, [])
+    self.assertEqual(self.wc.id, wc_id)
+    self.assertTrue(all(a is b for a, b in zip(wrs, self.wc.way_relations)))
+
+  def test_merge_removes_and_adds_way_relations(self):
+    ways = mockOSMResponse02.ways
+    wc = WayCollection(ways[:-10], mockOSMResponse02.query_center)
+    kept_wr = wc.way_relations[10]
+    removed_ids = [way.id for way in ways[:5]]
+
+    changed = wc.merge(ways[5:], mockOSMResponse01.query_center)
+
+    self.assertEqual(sorted(wr.id for wr in changed), sorted(removed_ids + [way.id for way in ways[-10:]]))
+    self.assertEqual([wr.id for wr in wc.way_relations], [way.id for way in ways[5:]])
+    self.assertIs(next(wr for wr in wc.way_relations if wr.id == kept_wr.id), kept_wr)
+    assert_array_almost_equal(wc.query_center, mockOSMResponse01.query_center)
+
+    # Removed way relations are no longer indexed.
+    for wr in changed[:5]:
+      self.assertNotIn(wr, wc.wr_index.way_relations_with_node_id(wr.nodes_ids[0]))
+      location_rad, _ = location_on_way(wr, 0)
+      self.assertNotIn(wr, wc.wr_grid_index.way_relations_near_location(location_rad))
+
+    # Added ones are.
+    for wr in changed[5:]:
+      self.assertIn(wr, wc.wr_index.way_relations_with_node_id(wr.nodes_ids[0]))
+
+  def test_prepare_merge_does_not_modify_collection(self):
+    ways = mockOSMResponse02.ways
+    wc = WayCollection(ways[:-10], mockOSMResponse02.query_center)
+    wrs = list(wc.way_relations)
+    kept_ways = [wr.way for wr in wrs]
+
+    merge = wc.prepare_merge(ways[5:])
+
+    self.assertEqual(wc.way_relations, wrs)
+    self.assertTrue(all(wr.way is way for wr, way in zip(wrs, kept_ways)))
+    added_wr = merge[3][0]
+    self.assertNotIn(added_wr, wc.wr_index.way_relations_with_node_id(added_wr.nodes_ids[0]))
+
+    changed = wc.apply_merge(merge, mockOSMResponse01.query_center)
+    self.assertEqual(len(changed), 15)
+
+  def test_merge_replaces_modified_ways(self):
+    ways = WaysData.from_overpy(mockOSMResponse02.ways)
+    # the first way without its last node
+    last = ways.way_offsets[1] - 1
+    modified_ways = WaysData(ways.way_ids, np.concatenate(([0], ways.way_offsets[1:] - 1)), ways.way_tags,
+                             ways.tags_table, np.delete(ways.node_ids, last), np.delete(ways.nodes_rad, last, axis=0))
+    wr = self.wc.way_relations[0]
+
+    changed = self.wc.merge(modified_ways, mockOSMResponse02.query_center)
+
+    self.assertEqual(len(changed), 2)
+    self.assertIs(changed[0], wr)
+    self.assertIs(changed[1], self.wc.way_relations[0])
+    self.assertEqual(changed[1].nodes_ids, wr.nodes_ids[:-1])
+
+  def test_route_is_affected_by(self):
+    wr = next(wr for wr in self.wc.way_relations if wr.id == 178450395)
+    location_rad, bearing_rad = location_on_way(wr, 2)
+    route = self.wc.get_route(location_rad, bearing_rad, 5.)
+    route_node_ids = set(route._nodes_data.get(NodeDataIdx.node_id).astype(int).tolist())
+
+    # Ways on the route or connected to it.
+    self.assertTrue(route.is_affected_by([wr]))
+    connected = next(w for w in self.wc.way_relations if w.id != wr.id and not route_node_ids.isdisjoint(w.nodes_ids))
+    self.assertTrue(route.is_affected_by([connected]))
+
+    # Ways not connected to the route.
+    not_connected = [w for w in self.wc.way_relations if route_node_ids.isdisjoint(w.nodes_ids)]
+    self.assertFalse(route.is_affected_by(not_connected))
+    self.assertFalse(route.is_affected_by([]))
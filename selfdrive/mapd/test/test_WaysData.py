@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from selfdrive.mapd.lib.WaysData import WaysData, CompactWay, compact_ways
+from selfdrive.mapd.lib.TileStore import Tile, encode_tile
+from selfdrive.mapd.test.mock_data import mockOSMResponse01, mockOSMWay_01_01_LongCurvy
+
+
+def assert_way_equal(test, compact_way, way):
+  test.assertEqual(compact_way.id, way.id)
+  test.assertEqual(compact_way.tags, way.tags)
+  test.assertEqual(compact_way.node_ids.tolist(), [n.id for n in way.nodes])
+  assert_array_almost_equal(compact_way.nodes_rad, np.radians([[float(n.lat), float(n.lon)] for n in way.nodes]))
+
+
+class TestCompactWay(unittest.TestCase):
+  def test_from_overpy(self):
+    way = CompactWay.from_overpy(mockOSMWay_01_01_LongCurvy)
+
+    assert_way_equal(self, way, mockOSMWay_01_01_LongCurvy)
+    self.assertEqual(len(way), len(mockOSMWay_01_01_LongCurvy.nodes))
+
+  def test_nodes(self):
+    way = CompactWay.from_overpy(mockOSMWay_01_01_LongCurvy)
+    nodes = mockOSMWay_01_01_LongCurvy.nodes
+
+    self.assertEqual([n.id for n in way.nodes], [n.id for n in nodes])
+    assert_array_almost_equal([(n.lat, n.lon) for n in way.nodes], [(float(n.lat), float(n.lon)) for n in nodes])
+    self.assertEqual(way.node(-1).id, nodes[-1].id)
+    self.assertAlmostEqual(way.node(2).lat, float(nodes[2].lat))
+
+  def test_sub_way(self):
+    way = CompactWay.from_overpy(mockOSMWay_01_01_LongCurvy)
+    sub_way = way.sub_way(-1, 3, 8)
+
+    self.assertEqual(sub_way.id, -1)
+    self.assertIs(sub_way.tags, way.tags)
+    self.assertEqual(sub_way.node_ids.tolist(), way.node_ids[3:8].tolist())
+    assert_array_almost_equal(sub_way.nodes_rad, way.nodes_rad[3:8])
+
+
+class TestWaysData(unittest.TestCase):
+  def test_from_overpy(self):
+    ways = mockOSMResponse01.ways
+    data = WaysData.from_overpy(ways)
+
+    self.assertEqual(len(data), len(ways))
+    self.assertLess(len(data.tags_table), len(ways))
+    for compact_way, way in zip(data, ways):
+      assert_way_equal(self, compact_way, way)
+
+    # Ways are views over the store arrays.
+    self.assertIs(data[0].node_ids.base, data.node_ids)
+
+  def test_from_tiles_includes_each_way_once(self):
+    ways = mockOSMResponse01.ways
+    tiles = [Tile(encode_tile(ways[:30])), Tile(encode_tile(ways[20:])), Tile(encode_tile([]))]
+
+    data = WaysData.from_tiles(tiles)
+
+    self.assertEqual(len(data), len(ways))
+    for compact_way, way in zip(data, ways):
+      assert_way_equal(self, compact_way, way)
+
+  def test_from_no_tiles(self):
+    self.assertEqual(len(WaysData.from_tiles([])), 0)
+    self.assertEqual(list(WaysData.empty()), [])
+
+  def test_compact_ways(self):
+    data = WaysData.from_overpy(mockOSMResponse01.ways)
+
+    self.assertIs(compact_ways(data), data)
+    self.assertEqual(len(compact_ways(mockOSMResponse01.ways)), len(mockOSMResponse01.ways))
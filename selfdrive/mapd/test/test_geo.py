@@ -1,5 +1,5 @@
 import unittest
-from selfdrive.mapd.lib.geo import vectors, ref_vectors, bearing_to_points, distance_to_points
+from selfdrive.mapd.lib.geo import vectors, ref_vectors, bearing_to_points, distance_to_points, destination_point
 import numpy as np
 from numpy.testing import assert_array_almost_equal
 from selfdrive.mapd.test.mock_data import mockNodesData01
@@ -232,3 +232,14 @@ class TestMapsdGeoLibrary(unittest.TestCase):
 
     v = distance_to_points(points[20], points)
     assert_array_almost_equal(v, expected)
+
+  def test_destination_point(self):
+    point = mockNodesData01.radians[20]
+    bearings = np.radians(np.array([0., 45., 90., 180., 270.]))
+
+    for bearing in bearings:
+      destination = destination_point(point, bearing, 1000.)
+      self.assertAlmostEqual(distance_to_points(point, np.array([destination]))[0], 1000., places=3)
+      self.assertAlmostEqual(np.cos(bearing_to_points(point, np.array([destination]))[0] - bearing), 1., places=6)
+
+    assert_array_almost_equal(destination_point(point, 0., 0.), point)
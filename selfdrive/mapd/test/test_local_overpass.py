@@ -0,0 +1,40 @@
+import unittest
+from selfdrive.mapd.lib.osm import OSM
+from selfdrive.mapd.test.local_overpass import LocalOverpass
+from selfdrive.mapd.test.mock_data import mockOSMResponse01
+
+
+_XML_PATH = 'selfdrive/mapd/test/mock_osm_response_01.xml'
+
+
+class TestLocalOverpass(unittest.TestCase):
+  def setUp(self):
+    self.api = LocalOverpass([_XML_PATH])
+    self.osm = OSM()
+    self.osm.api = self.api
+
+  def test_serves_road_ways_in_bbox(self):
+    ways = self.osm.fetch_road_ways_in_bbox(-90., -180., 90., 180.)
+
+    self.assertEqual(sorted(way.id for way in ways), sorted(way.id for way in mockOSMResponse01.ways))
+    self.assertEqual(self.api.query_count, 1)
+
+  def test_filters_by_bbox(self):
+    way = mockOSMResponse01.ways[0]
+    node = way.nodes[0]
+    ways = self.osm.fetch_road_ways_in_bbox(node.lat, node.lon, node.lat, node.lon)
+
+    self.assertIn(way.id, [w.id for w in ways])
+    self.assertLess(len(ways), len(mockOSMResponse01.ways))
+    for w in ways:
+      self.assertIn(node.id, [n.id for n in w.nodes])
+
+  def test_empty_bbox(self):
+    self.assertEqual(len(self.osm.fetch_road_ways_in_bbox(0., 0., 0.1, 0.1)), 0)
+
+  def test_excludes_highway_types_on_query(self):
+    query = 'way(-90,-180,90,180)[highway][highway!~"^(residential|secondary)$"]; (._;>;); out;'
+    ways = self.api.query(query).ways
+
+    self.assertGreater(len(ways), 0)
+    self.assertTrue(all(way.tags['highway'] not in ['residential', 'secondary'] for way in ways))
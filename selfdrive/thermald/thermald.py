@@ -179,6 +179,7 @@ def thermald_thread():
 
   network_type = NetworkType.none
   network_strength = NetworkStrength.unknown
+  network_metered = False
   network_info = None
   modem_version = None
   registered_count = 0
@@ -264,6 +265,7 @@ def thermald_thread():
       try:
         network_type = HARDWARE.get_network_type()
         network_strength = HARDWARE.get_network_strength(network_type)
+        network_metered = HARDWARE.get_network_metered(network_type)
         network_info = HARDWARE.get_network_info()  # pylint: disable=assignment-from-none
         nvme_temps = HARDWARE.get_nvme_temperatures()
         modem_temps = HARDWARE.get_modem_temperatures()
@@ -293,6 +295,7 @@ def thermald_thread():
     msg.deviceState.gpuUsagePercent = int(round(HARDWARE.get_gpu_usage_percent()))
     msg.deviceState.networkType = network_type
     msg.deviceState.networkStrength = network_strength
+    msg.deviceState.networkMetered = network_metered
     if network_info is not None:
       msg.deviceState.networkInfo = network_info
     if nvme_temps is not None:
@@ -0,0 +1,231 @@
+import os
+import re
+import mmap
+import time
+import zlib
+import fcntl
+import threading
+import numpy as np
+from common.file_helpers import mkdirs_exists_ok, rm_not_exists_ok, atomic_write_in_dir
+
+#  Index of the cached chunks. A file of fixed size records, appended by every process using the cache and compacted
+#  on eviction. Later records for a chunk override earlier ones and a record of size 0 removes the chunk.
+INDEX_DTYPE = np.dtype([('url_hash', 'S64'), ('chunk', '<i8'), ('size', '<u4'), ('crc', '<u4'),
+                        ('last_access', '<f8')])
+INDEX_FILE = "chunk_index"
+LOCK_FILE = "chunk_index.lock"
+#  Eviction removes the least recently used chunks until the cache is down to this fraction of its budget
+EVICTION_TARGET = 0.9
+
+_LAST_ACCESS_OFFSET = INDEX_DTYPE.fields['last_access'][1]
+_CHUNK_FILE_RE = re.compile(r'^([0-9a-f]{64})_([0-9]+)\.0$')
+
+
+def chunk_file_name(url_hash, chunk):
+  #  Chunk number is kept as a float to keep using existing caches
+  return url_hash + "_" + str(float(chunk))
+
+
+class DownloadCache(object):
+  """Size bounded cache of downloaded file chunks shared by all processes using the same cache_dir. Chunks are
+  stored one per file, tracked by an index with their size, checksum and last access, and evicted in least
+  recently used order once over max_bytes. Cached chunks are read as memoryviews over a memory map.
+  """
+  def __init__(self, cache_dir, max_bytes):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self._index_path = os.path.join(cache_dir, INDEX_FILE)
+    self._lock_path = os.path.join(cache_dir, LOCK_FILE)
+    self._lock = threading.RLock()
+    self._entries = {}  # (url hash, chunk) -> (record position, size, crc)
+    self._verified = set()  # chunks whose checksum was verified by this process
+    self._index_ino = None
+    self._index_loaded_size = 0
+    self.total_bytes = 0
+    mkdirs_exists_ok(cache_dir)
+
+  def _file_lock(self):
+    return _FileLock(self._lock_path)
+
+  def _sync(self):
+    # loads the records appended to the index since last sync, or all of them if it was compacted or is new
+    try:
+      st = os.stat(self._index_path)
+    except FileNotFoundError:
+      with self._file_lock():
+        if not os.path.exists(self._index_path):
+          self._adopt_existing_chunks()
+      st = os.stat(self._index_path)
+
+    if st.st_ino != self._index_ino:
+      self._entries = {}
+      self._verified = set()
+      self.total_bytes = 0
+      self._index_ino = st.st_ino
+      self._index_loaded_size = 0
+
+    record_count = (st.st_size - self._index_loaded_size) // INDEX_DTYPE.itemsize
+    if record_count <= 0:
+      return
+
+    first = self._index_loaded_size // INDEX_DTYPE.itemsize
+    records = np.fromfile(self._index_path, dtype=INDEX_DTYPE, count=record_count,
+                          offset=self._index_loaded_size)
+    for pos, (url_hash, chunk, size, crc) in enumerate(zip(records['url_hash'].tolist(), records['chunk'].tolist(),
+                                                           records['size'].tolist(), records['crc'].tolist())):
+      key = (url_hash, chunk)
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.total_bytes -= old[1]
+        self._verified.discard(key)
+      if size > 0:
+        self._entries[key] = (first + pos, size, crc)
+        self.total_bytes += size
+    self._index_loaded_size += record_count * INDEX_DTYPE.itemsize
+
+  def _adopt_existing_chunks(self):
+    # builds the index from the chunks already on the cache directory, if any. called with the file lock held
+    records = []
+    for fn in os.listdir(self.cache_dir):
+      m = _CHUNK_FILE_RE.match(fn)
+      if m is None:
+        continue
+      try:
+        with open(os.path.join(self.cache_dir, fn), "rb") as f:
+          data = f.read()
+        st = os.stat(os.path.join(self.cache_dir, fn))
+      except OSError:
+        continue
+      if len(data) > 0:
+        records.append((m.group(1).encode(), int(m.group(2)), len(data), zlib.crc32(data), st.st_atime))
+
+    with atomic_write_in_dir(self._index_path, mode="wb", overwrite=True) as f:
+      f.write(np.array(records, dtype=INDEX_DTYPE).tobytes())
+
+  def _append(self, record):
+    with self._file_lock():
+      with open(self._index_path, "ab") as f:
+        f.write(np.array([record], dtype=INDEX_DTYPE).tobytes())
+    self._sync()
+
+  def _touch(self, pos):
+    # updates the last access of the record in place, unless the index was compacted by another process since the
+    # last sync, as the record would be somewhere else then
+    try:
+      with self._file_lock():
+        fd = os.open(self._index_path, os.O_WRONLY)
+        try:
+          st = os.fstat(fd)
+          if st.st_ino == self._index_ino and (pos + 1) * INDEX_DTYPE.itemsize <= st.st_size:
+            os.pwrite(fd, np.float64(time.time()).tobytes(), pos * INDEX_DTYPE.itemsize + _LAST_ACCESS_OFFSET)
+        finally:
+          os.close(fd)
+    except OSError:
+      pass
+
+  def contains(self, url_hash, chunk):
+    with self._lock:
+      self._sync()
+      return (url_hash.encode(), chunk) in self._entries
+
+  def get(self, url_hash, chunk):
+    """Returns a memoryview of the cached chunk, or None if not cached or its contents do not match the checksum."""
+    key = (url_hash.encode(), chunk)
+    with self._lock:
+      self._sync()
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      pos, size, crc = entry
+
+      path = os.path.join(self.cache_dir, chunk_file_name(url_hash, chunk))
+      try:
+        with open(path, "rb") as f:
+          data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+      except (OSError, ValueError):
+        data = None
+
+      if key not in self._verified:
+        if data is None or len(data) != size or zlib.crc32(data) != crc:
+          self._remove(key, path)
+          return None
+        self._verified.add(key)
+
+      if data is None:
+        self._remove(key, path)
+        return None
+
+      self._touch(pos)
+      return data
+
+  def put(self, url_hash, chunk, data):
+    if len(data) == 0:
+      return
+    with self._lock:
+      key = (url_hash.encode(), chunk)
+      with atomic_write_in_dir(os.path.join(self.cache_dir, chunk_file_name(url_hash, chunk)), mode="wb",
+                               overwrite=True) as f:
+        f.write(data)
+      self._append((key[0], chunk, len(data), zlib.crc32(data), time.time()))
+      self._verified.add(key)
+      if self.total_bytes > self.max_bytes:
+        self.evict()
+
+  def _remove(self, key, path):
+    rm_not_exists_ok(path)
+    self._append((key[0], key[1], 0, 0, time.time()))
+
+  def evict(self, target_bytes=None):
+    """Removes the least recently used chunks until the cache is under target_bytes, compacting the index."""
+    if target_bytes is None:
+      target_bytes = self.max_bytes * EVICTION_TARGET
+
+    with self._lock, self._file_lock():
+      self._sync()
+      if self.total_bytes <= target_bytes:
+        return
+
+      positions = np.array([pos for pos, _, _ in self._entries.values()], dtype=np.int64)
+      records = np.fromfile(self._index_path, dtype=INDEX_DTYPE)[np.sort(positions)]
+      records = records[np.argsort(records['last_access'], kind='stable')]
+      sizes = records['size'].astype(np.int64)
+      # evict the oldest chunks until the size of the remaining ones is under the target
+      remaining = self.total_bytes - np.cumsum(sizes)
+      evict_count = int(np.searchsorted(-remaining, -target_bytes)) + 1
+
+      for url_hash, chunk in zip(records['url_hash'][:evict_count].tolist(), records['chunk'][:evict_count].tolist()):
+        rm_not_exists_ok(os.path.join(self.cache_dir, chunk_file_name(url_hash.decode(), chunk)))
+
+      with atomic_write_in_dir(self._index_path, mode="wb", overwrite=True) as f:
+        f.write(records[evict_count:].tobytes())
+      self._sync()
+
+
+class _FileLock(object):
+  # exclusive lock across processes on the lock file
+  def __init__(self, path):
+    self._path = path
+    self._f = None
+
+  def __enter__(self):
+    self._f = open(self._path, "a")
+    fcntl.flock(self._f, fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    fcntl.flock(self._f, fcntl.LOCK_UN)
+    self._f.close()
+    self._f = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_download_cache(cache_dir, max_bytes):
+  with _caches_lock:
+    cache = _caches.get(cache_dir)
+    if cache is None:
+      cache = _caches[cache_dir] = DownloadCache(cache_dir, max_bytes)
+    cache.max_bytes = max_bytes
+    return cache
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cereal import log as capnp_log
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route
+
+DEFAULT_SERVICES = ['carState', 'controlsState', 'can', 'liveMapData']
+MAX_DEPTH = 6
+
+_ARROW_TYPES = {
+  'bool': pa.bool_(),
+  'int8': pa.int8(),
+  'int16': pa.int16(),
+  'int32': pa.int32(),
+  'int64': pa.int64(),
+  'uint8': pa.uint8(),
+  'uint16': pa.uint16(),
+  'uint32': pa.uint32(),
+  'uint64': pa.uint64(),
+  'float32': pa.float32(),
+  'float64': pa.float64(),
+  'text': pa.string(),
+  'data': pa.binary(),
+  'enum': pa.string(),
+}
+_NO_DISCRIMINANT = 65535
+
+
+class _Column(object):
+  def __init__(self, name, arrow_type, convert):
+    self.name = name
+    self.arrow_type = arrow_type
+    self.convert = convert
+
+
+class _StructNode(object):
+  """Flattening plan for a capnp struct: the scalar fields (and lists of scalars) it holds as columns, and the
+  nested structs, recursively. Columns are named after the path of the field, e.g. `cruiseState.speed`.
+  Fields of union members other than the active one are null.
+  """
+  def __init__(self, schema, prefix="", depth=0):
+    self.columns = []  # (field name, _Column, union member)
+    self.children = []  # (field name, _StructNode, union member)
+    self.has_union = len(schema.union_fields) > 0
+
+    for name in schema.fieldnames:
+      field = schema.fields[name]
+      union_member = field.proto.discriminantValue != _NO_DISCRIMINANT
+      if field.proto.which() == 'group':
+        if depth < MAX_DEPTH:
+          self.children.append((name, _StructNode(field.schema, f"{prefix}{name}.", depth + 1), union_member))
+        continue
+
+      field_type = field.proto.slot.type
+      kind = field_type.which()
+      if kind in _ARROW_TYPES:
+        self.columns.append((name, _Column(prefix + name, _ARROW_TYPES[kind], _converter(kind)), union_member))
+      elif kind == 'list' and field_type.list.elementType.which() in _ARROW_TYPES:
+        element_kind = field_type.list.elementType.which()
+        convert = _converter(element_kind)
+        column = _Column(prefix + name, pa.list_(_ARROW_TYPES[element_kind]), lambda v, c=convert: [c(x) for x in v])
+        self.columns.append((name, column, union_member))
+      elif kind == 'struct' and depth < MAX_DEPTH:
+        self.children.append((name, _StructNode(field.schema, f"{prefix}{name}.", depth + 1), union_member))
+
+  def all_columns(self):
+    columns = [column for _, column, _ in self.columns]
+    for _, child, _ in self.children:
+      columns.extend(child.all_columns())
+    return columns
+
+  def append(self, reader, values):
+    # appends the values of the struct reader (or None for all of them) to the value lists by column name
+    active = reader.which() if reader is not None and self.has_union else None
+    for name, column, union_member in self.columns:
+      if reader is None or (union_member and name != active):
+        values[column.name].append(None)
+      else:
+        values[column.name].append(column.convert(getattr(reader, name)))
+
+    for name, child, union_member in self.children:
+      if reader is None or (union_member and name != active):
+        child.append(None, values)
+      else:
+        child.append(getattr(reader, name), values)
+
+
+def _converter(kind):
+  if kind == 'enum':
+    return str
+  if kind == 'data':
+    return bytes
+  return lambda v: v
+
+
+class ServiceFlattener(object):
+  """Flattens the events of a service into columns, one per scalar field plus `logMonoTime` and `valid`.
+  Services holding a list of structs (e.g. `can`) get a row per element of the list.
+  """
+  def __init__(self, service):
+    self.service = service
+    field = capnp_log.Event.schema.fields[service]
+    field_type = field.proto.slot.type
+    self.is_list = field_type.which() == 'list'
+    if self.is_list and field_type.list.elementType.which() == 'struct':
+      self.node = _StructNode(field.schema.elementType)
+    elif field_type.which() == 'struct':
+      self.node = _StructNode(field.schema)
+    else:
+      raise ValueError(f"service {service} can not be flattened")
+    self.columns = self.node.all_columns()
+
+  def schema(self):
+    return pa.schema([('logMonoTime', pa.uint64()), ('valid', pa.bool_())] +
+                     [(c.name, c.arrow_type) for c in self.columns])
+
+  def to_table(self, events):
+    values = {c.name: [] for c in self.columns}
+    mono_times = []
+    valid = []
+    for ent in events:
+      readers = getattr(ent, self.service)
+      if not self.is_list:
+        readers = [readers]
+      for reader in readers:
+        mono_times.append(ent.logMonoTime)
+        valid.append(ent.valid)
+        self.node.append(reader, values)
+
+    arrays = [pa.array(mono_times, type=pa.uint64()), pa.array(valid, type=pa.bool_())]
+    arrays += [pa.array(values[c.name], type=c.arrow_type) for c in self.columns]
+    table = pa.Table.from_arrays(arrays, schema=self.schema())
+    return table.sort_by('logMonoTime')
+
+
+def log_to_tables(events, services):
+  # returns a table per service with the flattened events of that service
+  flatteners = {s: ServiceFlattener(s) for s in services}
+  events_by_service = {s: [] for s in services}
+  for ent in events:
+    which = ent.which()
+    if which in events_by_service:
+      events_by_service[which].append(ent)
+  return {s: flatteners[s].to_table(events_by_service[s]) for s in services}
+
+
+def export_segment(log_path, out_dir, services, name):
+  # exports the services of a log to out_dir/<service>/<name>.parquet, returns the number of rows per service
+  tables = log_to_tables(LogReader(log_path, services=services), services)
+  rows = {}
+  for service, table in tables.items():
+    service_dir = os.path.join(out_dir, service)
+    os.makedirs(service_dir, exist_ok=True)
+    pq.write_table(table, os.path.join(service_dir, f"{name}.parquet"))
+    rows[service] = table.num_rows
+  return rows
+
+
+def export_logs(log_paths, out_dir, services=DEFAULT_SERVICES, workers=None):
+  """Exports the services of the logs (one per segment, None for missing ones) to a Parquet dataset per service,
+  with a file per segment at out_dir/<service>/<segment number>.parquet. Segments are exported in parallel in a
+  pool of processes. Returns the total number of rows per service.
+  """
+  for service in services:
+    ServiceFlattener(service)  # fail early on unknown services
+
+  segments = [(i, fn) for i, fn in enumerate(log_paths) if fn is not None]
+  totals = {s: 0 for s in services}
+  if len(segments) == 0:
+    return totals
+
+  workers = workers if workers is not None else min(len(segments), os.cpu_count() or 1)
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(export_segment, fn, out_dir, services, f"{i:04d}") for i, fn in segments]
+    for future in futures:
+      for service, rows in future.result().items():
+        totals[service] += rows
+  return totals
+
+
+def get_arg_parser():
+  parser = argparse.ArgumentParser(
+      description="Export services of a route to Parquet files, with a column per scalar field",
+      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+  parser.add_argument("route", help="Route name")
+  parser.add_argument("out_dir", help="Output directory, a Parquet dataset per service is created in it")
+  parser.add_argument("--services", nargs='+', default=DEFAULT_SERVICES, help="Services to export")
+  parser.add_argument("--data-dir", default=None, help="Local directory with the route segments")
+  parser.add_argument("--qlog", action="store_true", help="Export qlogs instead of rlogs")
+  parser.add_argument("--workers", type=int, default=None, help="Number of processes, one per cpu by default")
+
+  return parser
+
+
+def main(argv):
+  args = get_arg_parser().parse_args(argv)
+
+  route = Route(args.route, data_dir=args.data_dir)
+  log_paths = route.qlog_paths() if args.qlog else route.log_paths()
+  totals = export_logs(log_paths, args.out_dir, args.services, args.workers)
+  for service, rows in totals.items():
+    print(f"{service}: {rows} rows")
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -2,34 +2,206 @@
 import os
 import sys
 import bz2
+import bisect
+import heapq
+import struct
 import urllib.parse
 import capnp
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 try:
   from xx.chffr.lib.filereader import FileReader
 except ImportError:
   from tools.lib.filereader import FileReader
 from cereal import log as capnp_log
+from common.file_helpers import atomic_write_in_dir
+from tools.lib.cache import cache_path_for_file_path
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _log_ext(fn):
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in ("", ".bz2"):
+    raise Exception(f"unknown extension {ext}")
+  return ext
+
+
+def read_log_bytes(fn):
+  # returns the decompressed contents of the log
+  ext = _log_ext(fn)
+  with FileReader(fn) as f:
+    dat = f.read()
+
+  # old rlogs weren't bz2 compressed
+  return bz2.decompress(dat) if ext == ".bz2" else dat
+
+
+def _message_ends(dat, start=0):
+  # yields the end offset of every complete capnp message on dat[start:], following the stream
+  # framing: segment count - 1, segment sizes in words, padding to a word, segments
+  end = start
+  while len(dat) - end >= 4:
+    segment_count = struct.unpack_from("<I", dat, end)[0] + 1
+    header_len = (4 * (segment_count + 1) + 7) // 8 * 8
+    if len(dat) - end < header_len:
+      break
+    message_len = header_len + 8 * sum(struct.unpack_from(f"<{segment_count}I", dat, end + 4))
+    if len(dat) - end < message_len:
+      break
+    end += message_len
+    yield end
+
+
+def complete_messages_length(dat, start=0):
+  # returns the length in bytes of the complete capnp messages at the beginning of dat[start:]
+  end = start
+  for end in _message_ends(dat, start):
+    pass
+  return end - start
+
+
+class LogIndex(object):
+  """Byte offsets, logMonoTime and service of every event of a decompressed log. Events of unknown
+  union types have an empty service name.
+  """
+  def __init__(self, offsets, mono_times, services, service_names):
+    self.offsets = offsets  # start of every event, plus the total length of the log at the end
+    self.mono_times = mono_times
+    self.services = services  # index on service_names
+    self.service_names = service_names
+
+  def __len__(self):
+    return len(self.mono_times)
+
+  @property
+  def data_length(self):
+    return int(self.offsets[-1])
+
+  @classmethod
+  def from_bytes(cls, dat):
+    offsets = [0] + list(_message_ends(dat))
+    mono_times = []
+    services = []
+    service_idxs = {}
+    for ent in capnp_log.Event.read_multiple_bytes(dat[:offsets[-1]]):
+      try:
+        which = ent.which()
+      except capnp.lib.capnp.KjException:
+        which = ""
+      mono_times.append(ent.logMonoTime)
+      services.append(service_idxs.setdefault(which, len(service_idxs)))
+
+    return cls(np.array(offsets, dtype=np.uint64), np.array(mono_times, dtype=np.uint64),
+               np.array(services, dtype=np.uint16), list(service_idxs.keys()))
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as dat:
+      return cls(dat["offsets"], dat["mono_times"], dat["services"], dat["service_names"].tolist())
+
+  def save(self, path):
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      np.savez(f, offsets=self.offsets, mono_times=self.mono_times, services=self.services,
+               service_names=np.array(self.service_names, dtype=str))
+
+  def select(self, services):
+    # returns the positions of the events of the given services
+    service_idxs = [i for i, name in enumerate(self.service_names) if name in services]
+    return np.nonzero(np.isin(self.services, service_idxs))[0]
+
+
+def log_index_path(fn):
+  return cache_path_for_file_path(fn) + ".index.npz"
+
+
+def get_log_index(fn, dat=None):
+  # returns the index of the log, loaded from the cache or built from its decompressed contents dat.
+  # the cached index is rebuilt when it does not match the length of dat
+  path = log_index_path(fn)
+  try:
+    index = LogIndex.load(path)
+    if dat is None or index.data_length == len(dat):
+      return index
+  except (OSError, ValueError, KeyError):
+    pass
+
+  index = LogIndex.from_bytes(read_log_bytes(fn) if dat is None else dat)
+  try:
+    index.save(path)
+  except OSError as e:
+    print(f"failed to write log index {path}: {e}")
+  return index
+
+
+def stream_log(fn, chunk_size=STREAM_CHUNK_SIZE):
+  # yields the events of the log while it is read and decompressed, chunk by chunk
+  ext = _log_ext(fn)
+  decompressor = bz2.BZ2Decompressor() if ext == ".bz2" else None
+  buf = b""
+  with FileReader(fn) as f:
+    while True:
+      dat = f.read(chunk_size)
+      if not dat:
+        break
+
+      if decompressor is None:
+        buf += dat
+      else:
+        buf += decompressor.decompress(dat)
+        # bz2 files can contain several concatenated streams
+        while decompressor.eof and len(decompressor.unused_data) > 0:
+          unused_data = decompressor.unused_data
+          decompressor = bz2.BZ2Decompressor()
+          buf += decompressor.decompress(unused_data)
+
+      length = complete_messages_length(buf)
+      if length > 0:
+        yield from capnp_log.Event.read_multiple_bytes(buf[:length])
+        buf = buf[length:]
+
+  if len(buf) > 0:
+    raise Exception(f"truncated log {fn}")
+
+
+def _filter_union_types(ents):
+  for ent in ents:
+    try:
+      ent.which()
+      yield ent
+    except capnp.lib.capnp.KjException:
+      pass
+
 
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator(object):
-  def __init__(self, log_paths, wraparound=False):
+  def __init__(self, log_paths, wraparound=False, services=None):
     self._log_paths = log_paths
     self._wraparound = wraparound
+    self._services = services
 
-    self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
+    self._log_readers = [None]*len(log_paths)
+    self._first_log_idx = self._next_log(-1)
     self._current_log = self._first_log_idx
     self._idx = 0
-    self._log_readers = [None]*len(log_paths)
-    self.start_time = self._log_reader(self._first_log_idx)._ts[0]
+    self.start_time = self._log_reader(self._first_log_idx)._ts[0] if self._first_log_idx < len(log_paths) else 0
 
   def _log_reader(self, i):
     if self._log_readers[i] is None and self._log_paths[i] is not None:
       log_path = self._log_paths[i]
-      self._log_readers[i] = LogReader(log_path)
+      self._log_readers[i] = LogReader(log_path, services=self._services)
 
     return self._log_readers[i]
 
+  def _next_log(self, i):
+    # next segment with events after i, len(log_paths) if there is none.
+    # with services, a segment can be left without any
+    n = len(self._log_readers)
+    return next(j for j in range(i + 1, n + 1)
+                if j == n or (self._log_paths[j] is not None and len(self._log_reader(j)._ents) > 0))
+
   def __iter__(self):
     return self
 
@@ -39,8 +211,7 @@ class MultiLogIterator(object):
       self._idx += 1
     else:
       self._idx = 0
-      self._current_log = next(i for i in range(self._current_log + 1, len(self._log_readers) + 1)
-                               if i == len(self._log_readers) or self._log_paths[i] is not None)
+      self._current_log = self._next_log(self._current_log)
       # wraparound
       if self._current_log == len(self._log_readers):
         if self._wraparound:
@@ -49,11 +220,15 @@ class MultiLogIterator(object):
           raise StopIteration
 
   def __next__(self):
-    while 1:
-      lr = self._log_reader(self._current_log)
-      ret = lr._ents[self._idx]
+    if self._current_log == len(self._log_readers):
+      raise StopIteration
+    lr = self._log_reader(self._current_log)
+    ret = lr._ents[self._idx]
+    try:
       self._inc()
-      return ret
+    except StopIteration:
+      pass  # the last event, the next call stops
+    return ret
 
   def tell(self):
     # returns seconds from start of log
@@ -67,44 +242,130 @@ class MultiLogIterator(object):
 
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
+    # first event of the segment at or after ts, searched over its logMonoTimes (taken from the log
+    # index when filtering services). if there is none, continue on the following segments
+    lr = self._log_reader(minute)
+    after = np.flatnonzero(np.asarray(lr._ts, dtype=np.float64) - self.start_time >= ts * 1e9)
+    if len(after) > 0:
+      self._idx = int(after[0])
+    else:
+      self._idx = len(lr._ents) - 1
       self._inc()
+      while self.tell() < ts:
+        self._inc()
     return True
 
 
 class LogReader(object):
-  def __init__(self, fn, canonicalize=True, only_union_types=False):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, stream=False, services=None):
+    # with stream=True nothing is read until iterating, and events are yielded as the log is decompressed.
+    # with services, only the events of those services are read, located through the log index
     data_version = None
-    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-    with FileReader(fn) as f:
-      dat = f.read()
-
-    if ext == "":
-      # old rlogs weren't bz2 compressed
-      ents = capnp_log.Event.read_multiple_bytes(dat)
-    elif ext == ".bz2":
-      dat = bz2.decompress(dat)
-      ents = capnp_log.Event.read_multiple_bytes(dat)
+    self._fn = fn
+    self._stream = stream
+    self._services = services
+    if stream:
+      _log_ext(fn)
+      self._ents = None
+      self._ts = None
+    elif services is not None:
+      dat = read_log_bytes(fn)
+      index = get_log_index(fn, dat)
+      idxs = index.select(services)
+      starts, ends = index.offsets[idxs].tolist(), index.offsets[idxs + 1].tolist()
+      mv = memoryview(dat)
+      self._ents = list(capnp_log.Event.read_multiple_bytes(b"".join(mv[s:e] for s, e in zip(starts, ends))))
+      self._ts = index.mono_times[idxs].tolist()
     else:
-      raise Exception(f"unknown extension {ext}")
-
-    self._ents = list(ents)
-    self._ts = [x.logMonoTime for x in self._ents]
+      self._ents = list(capnp_log.Event.read_multiple_bytes(read_log_bytes(fn)))
+      self._ts = [x.logMonoTime for x in self._ents]
     self.data_version = data_version
     self._only_union_types = only_union_types
 
   def __iter__(self):
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
-      else:
-        yield ent
+    if self._stream:
+      ents = stream_log(self._fn)
+      if self._services is not None:
+        ents = (ent for ent in _filter_union_types(ents) if ent.which() in self._services)
+    else:
+      ents = self._ents
+    if self._only_union_types:
+      ents = _filter_union_types(ents)
+    yield from ents
+
+
+def _read_log_sorted(fn):
+  # runs on the pool workers: returns the decompressed log along with the order of its events by logMonoTime
+  # and their sorted logMonoTimes, so the main process does not need to read them to merge the segments
+  dat = read_log_bytes(fn)
+  ts = [ent.logMonoTime for ent in capnp_log.Event.read_multiple_bytes(dat)]
+  if all(a <= b for a, b in zip(ts, ts[1:])):
+    return dat, None, ts
+  order = sorted(range(len(ts)), key=ts.__getitem__)
+  return dat, order, [ts[i] for i in order]
+
+
+class ParallelLogReader(object):
+  """Reads and decompresses the logs in a pool of processes, a few segments ahead of the one being consumed, and
+  yields the events of all of them merged in logMonoTime order. None entries on log_paths (missing segments) are
+  skipped. Memory is bounded to the segments being decompressed plus the ones being merged.
+  """
+  def __init__(self, log_paths, workers=None, only_union_types=False):
+    self._log_paths = [p for p in log_paths if p is not None]
+    self._workers = workers if workers is not None else min(len(self._log_paths), os.cpu_count() or 1)
+    self._only_union_types = only_union_types
+
+  def _segments(self):
+    # yields (events, logMonoTimes) of every segment sorted by logMonoTime, in log_paths order
+    if len(self._log_paths) == 0:
+      return
+
+    with ProcessPoolExecutor(max_workers=max(self._workers, 1)) as executor:
+      paths = iter(self._log_paths)
+      pending = deque()
+      for _ in range(self._workers + 1):
+        fn = next(paths, None)
+        if fn is not None:
+          pending.append(executor.submit(_read_log_sorted, fn))
+
+      while len(pending) > 0:
+        dat, order, ts = pending.popleft().result()
+        fn = next(paths, None)
+        if fn is not None:
+          pending.append(executor.submit(_read_log_sorted, fn))
+        ents = list(capnp_log.Event.read_multiple_bytes(dat))
+        yield (ents if order is None else [ents[i] for i in order]), ts
+
+  def _merged(self):
+    # segments are consecutive in time but can overlap at their edges. a segment is added to the merge only
+    # when the events pending to be yielded reach its first event, so only a couple of them are held at once.
+    # events are yielded in runs up to the next event of any other segment
+    segments = (segment for segment in self._segments() if len(segment[1]) > 0)
+    next_segment = next(segments, None)
+    heap = []
+    counter = 0
+    while True:
+      while next_segment is not None and (len(heap) == 0 or next_segment[1][0] <= heap[0][0]):
+        heapq.heappush(heap, (next_segment[1][0], counter, 0, next_segment))
+        counter += 1
+        next_segment = next(segments, None)
+
+      if len(heap) == 0:
+        return
+
+      _, order, idx, (ents, ts) = heapq.heappop(heap)
+      bounds = ([heap[0][0]] if len(heap) > 0 else []) + ([next_segment[1][0]] if next_segment is not None else [])
+      end = bisect.bisect_right(ts, min(bounds), idx) if len(bounds) > 0 else len(ts)
+      end = max(end, idx + 1)
+      yield from ents[idx:end]
+      if end < len(ts):
+        heapq.heappush(heap, (ts[end], order, end, (ents, ts)))
+
+  def __iter__(self):
+    ents = self._merged()
+    if self._only_union_types:
+      ents = _filter_union_types(ents)
+    yield from ents
 
 if __name__ == "__main__":
   import codecs
@@ -56,5 +56,8 @@ class RobustLogReader(LogReader):
         progress.update(1)
 
     self._ts = [x.logMonoTime for x in self._ents]
+    self._fn = fn
+    self._stream = False
+    self._services = None
     self.data_version = data_version
     self._only_union_types = only_union_types
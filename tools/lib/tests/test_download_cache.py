@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from tools.lib.download_cache import DownloadCache, INDEX_DTYPE, INDEX_FILE, chunk_file_name
+
+HASH_A = "a" * 64
+HASH_B = "b" * 64
+
+
+class TestDownloadCache(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_put_get(self):
+    cache = DownloadCache(self.cache_dir, 10000)
+    self.assertIsNone(cache.get(HASH_A, 0))
+    self.assertFalse(cache.contains(HASH_A, 0))
+
+    cache.put(HASH_A, 0, b"0" * 100)
+    cache.put(HASH_A, 1, b"1" * 50)
+
+    data = cache.get(HASH_A, 0)
+    self.assertIsInstance(data, memoryview)
+    self.assertEqual(bytes(data), b"0" * 100)
+    self.assertTrue(cache.contains(HASH_A, 1))
+    self.assertFalse(cache.contains(HASH_B, 1))
+    self.assertEqual(cache.total_bytes, 150)
+
+  def test_evicts_least_recently_used(self):
+    cache = DownloadCache(self.cache_dir, 350)
+    for chunk in range(3):
+      cache.put(HASH_A, chunk, bytes([chunk]) * 100)
+      time.sleep(0.01)
+    cache.get(HASH_A, 0)
+    time.sleep(0.01)
+
+    cache.put(HASH_B, 0, b"x" * 100)
+
+    # over budget, evicted down to 90% of it
+    self.assertEqual(cache.total_bytes, 300)
+    self.assertFalse(cache.contains(HASH_A, 1))
+    self.assertFalse(os.path.exists(os.path.join(self.cache_dir, chunk_file_name(HASH_A, 1))))
+    for url_hash, chunk in [(HASH_A, 0), (HASH_A, 2), (HASH_B, 0)]:
+      self.assertTrue(cache.contains(url_hash, chunk))
+
+  def test_corrupted_chunk_is_dropped(self):
+    DownloadCache(self.cache_dir, 10000).put(HASH_A, 0, b"0" * 100)
+    with open(os.path.join(self.cache_dir, chunk_file_name(HASH_A, 0)), "wb") as f:
+      f.write(b"1" * 100)
+
+    cache = DownloadCache(self.cache_dir, 10000)
+    self.assertIsNone(cache.get(HASH_A, 0))
+    self.assertFalse(cache.contains(HASH_A, 0))
+    self.assertEqual(cache.total_bytes, 0)
+
+  def test_index_is_shared(self):
+    # e.g. two processes using the same cache dir
+    cache1 = DownloadCache(self.cache_dir, 250)
+    cache2 = DownloadCache(self.cache_dir, 250)
+
+    cache1.put(HASH_A, 0, b"0" * 100)
+    self.assertEqual(bytes(cache2.get(HASH_A, 0)), b"0" * 100)
+    time.sleep(0.01)
+    cache2.put(HASH_A, 1, b"1" * 100)
+    time.sleep(0.01)
+    cache1.get(HASH_A, 0)
+
+    # eviction on cache2 compacts the index, cache1 picks it up
+    cache2.put(HASH_A, 2, b"2" * 100)
+    self.assertFalse(cache1.contains(HASH_A, 1))
+    self.assertTrue(cache1.contains(HASH_A, 0))
+    self.assertEqual(cache1.total_bytes, cache2.total_bytes)
+
+  def test_eviction_by_other_cache_during_get(self):
+    # e.g. another process compacts the index after this one synced it, while reading a chunk
+    cache1 = DownloadCache(self.cache_dir, 10000)
+    cache2 = DownloadCache(self.cache_dir, 10000)
+    index_path = os.path.join(self.cache_dir, INDEX_FILE)
+
+    for target_bytes, chunk in [(350, 2), (150, 4)]:
+      for c in range(5):
+        cache1.put(HASH_A, c, bytes([c]) * 100)
+        time.sleep(0.01)
+
+      touch = cache1._touch
+      evicted_index = []
+
+      def evict_and_touch(pos):
+        cache2.evict(target_bytes)
+        with open(index_path, "rb") as f:
+          evicted_index.append(f.read())
+        touch(pos)
+
+      # after the eviction the record of the chunk is somewhere else (or past the end), it must not be written
+      with mock.patch.object(cache1, "_touch", side_effect=evict_and_touch):
+        self.assertEqual(bytes(cache1.get(HASH_A, chunk)), bytes([chunk]) * 100)
+      with open(index_path, "rb") as f:
+        self.assertEqual(f.read(), evicted_index[0])
+
+      # later gets and puts keep working on the compacted index
+      self.assertEqual(bytes(cache1.get(HASH_A, 4)), b"\x04" * 100)
+      cache1.put(HASH_B, 0, b"x" * 10)
+      self.assertEqual(os.path.getsize(index_path) % INDEX_DTYPE.itemsize, 0)
+      self.assertTrue(cache2.contains(HASH_B, 0))
+      self.assertEqual(cache1.total_bytes, cache2.total_bytes)
+
+  def test_adopts_existing_chunks(self):
+    with open(os.path.join(self.cache_dir, chunk_file_name(HASH_A, 3)), "wb") as f:
+      f.write(b"3" * 10)
+    with open(os.path.join(self.cache_dir, HASH_A + "_length"), "w") as f:
+      f.write("10")
+
+    cache = DownloadCache(self.cache_dir, 10000)
+    self.assertEqual(bytes(cache.get(HASH_A, 3)), b"3" * 10)
+    self.assertEqual(cache.total_bytes, 10)
+
+
+if __name__ == "__main__":
+  unittest.main()
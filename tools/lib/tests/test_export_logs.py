@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pyarrow.parquet as pq
+
+from cereal import log as capnp_log
+from tools.lib.export_logs import ServiceFlattener, export_logs, log_to_tables
+
+
+def make_segment(seg_num, n=10):
+  ents = []
+  for i in range(n):
+    t = seg_num * 1000 + i
+    ent = capnp_log.Event.new_message()
+    ent.logMonoTime = t
+    ent.valid = i % 2 == 0
+    if i % 3 == 0:
+      cs = ent.init('carState')
+      cs.vEgo = float(i)
+      cs.gearShifter = 'drive'
+      cs.cruiseState.speed = 2. * i
+      cs.canMonoTimes = [t, t + 1]
+    elif i % 3 == 1:
+      ctrl = ent.init('controlsState')
+      ctrl.enabled = True
+      ctrl.lateralControlState.init('pidState').p = float(i)
+    else:
+      can = ent.init('can', 2)
+      for j in range(2):
+        can[j].address = 0x100 + j
+        can[j].dat = bytes([i, j])
+        can[j].src = j
+    ents.append(ent)
+  return ents
+
+
+class TestExportLogs(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    cache_dir_patch = mock.patch("tools.lib.cache.DEFAULT_CACHE_DIR", os.path.join(self.tmp_dir.name, "cache"))
+    cache_dir_patch.start()
+    self.addCleanup(cache_dir_patch.stop)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_flattens_scalar_fields(self):
+    tables = log_to_tables(make_segment(0), ['carState', 'controlsState'])
+
+    cs = tables['carState'].to_pydict()
+    self.assertEqual(cs['logMonoTime'], [0, 3, 6, 9])
+    self.assertEqual(cs['valid'], [True, False, True, False])
+    self.assertEqual(cs['vEgo'], [0., 3., 6., 9.])
+    self.assertEqual(cs['cruiseState.speed'], [0., 6., 12., 18.])
+    self.assertEqual(cs['gearShifter'], ['drive'] * 4)
+    self.assertEqual(cs['canMonoTimes'][1], [3, 4])
+    self.assertNotIn('buttonEvents', cs)
+
+    # only the active union member has values
+    ctrl = tables['controlsState'].to_pydict()
+    self.assertEqual(ctrl['enabled'], [True] * 3)
+    self.assertEqual(ctrl['lateralControlState.pidState.p'], [1., 4., 7.])
+    self.assertEqual(ctrl['lateralControlState.lqrState.i'], [None] * 3)
+
+  def test_list_services_get_a_row_per_element(self):
+    can = log_to_tables(make_segment(0), ['can'])['can'].to_pydict()
+
+    self.assertEqual(can['logMonoTime'], [2, 2, 5, 5, 8, 8])
+    self.assertEqual(can['address'], [0x100, 0x101] * 3)
+    self.assertEqual(can['dat'][2], bytes([5, 0]))
+
+  def test_unknown_service(self):
+    with self.assertRaises(KeyError):
+      ServiceFlattener('notAService')
+
+  def test_export_logs(self):
+    log_paths = []
+    for seg_num in range(3):
+      fn = os.path.join(self.tmp_dir.name, f"{seg_num}.bz2")
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(b"".join(ent.to_bytes() for ent in make_segment(seg_num))))
+      log_paths.append(fn)
+    log_paths.insert(1, None)
+    out_dir = os.path.join(self.tmp_dir.name, "out")
+
+    totals = export_logs(log_paths, out_dir, ['carState', 'can'], workers=2)
+
+    self.assertEqual(totals, {'carState': 12, 'can': 18})
+    self.assertEqual(sorted(os.listdir(os.path.join(out_dir, 'carState'))),
+                     ['0000.parquet', '0002.parquet', '0003.parquet'])
+    cs = pq.read_table(os.path.join(out_dir, 'carState'))
+    self.assertEqual(sorted(cs.column('logMonoTime').to_pylist()),
+                     [s * 1000 + i for s in [0, 1, 2] for i in [0, 3, 6, 9]])
+
+
+if __name__ == "__main__":
+  unittest.main()
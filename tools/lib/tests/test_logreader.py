@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cereal import log as capnp_log
+from tools.lib.logreader import LogReader, LogIndex, MultiLogIterator, ParallelLogReader, \
+                                 complete_messages_length, log_index_path
+
+
+def make_events(mono_times, services=("carState",)):
+  ents = []
+  for i, t in enumerate(mono_times):
+    ent = capnp_log.Event.new_message()
+    ent.logMonoTime = t
+    service = services[i % len(services)]
+    if service == "carState":
+      ent.init(service).vEgo = t / 1e9
+    else:
+      ent.init(service)
+    ents.append(ent)
+  return ents
+
+
+class TestLogReader(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    cache_dir_patch = mock.patch("tools.lib.cache.DEFAULT_CACHE_DIR", os.path.join(self.tmp_dir.name, "cache"))
+    cache_dir_patch.start()
+    self.addCleanup(cache_dir_patch.stop)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def write_log(self, name, mono_times, compress=True, services=("carState",)):
+    dat = b"".join(ent.to_bytes() for ent in make_events(mono_times, services))
+    fn = os.path.join(self.tmp_dir.name, name)
+    with open(fn, "wb") as f:
+      f.write(bz2.compress(dat) if compress else dat)
+    return fn
+
+  def test_stream_matches_eager(self):
+    mono_times = list(range(0, 20000 * 1000, 1000))
+    for name, compress in [("rlog.bz2", True), ("rlog", False)]:
+      fn = self.write_log(name, mono_times, compress)
+      eager = [ent.logMonoTime for ent in LogReader(fn)]
+      streamed = [ent.logMonoTime for ent in LogReader(fn, stream=True)]
+      self.assertEqual(eager, mono_times)
+      self.assertEqual(streamed, mono_times)
+
+  def test_stream_multistream_bz2(self):
+    fn = os.path.join(self.tmp_dir.name, "rlog.bz2")
+    with open(fn, "wb") as f:
+      for mono_times in [[1, 2, 3], [4, 5]]:
+        f.write(bz2.compress(b"".join(ent.to_bytes() for ent in make_events(mono_times))))
+
+    self.assertEqual([ent.logMonoTime for ent in LogReader(fn, stream=True)], [1, 2, 3, 4, 5])
+
+  def test_stream_truncated_log_raises(self):
+    dat = b"".join(ent.to_bytes() for ent in make_events([1, 2, 3]))
+    fn = os.path.join(self.tmp_dir.name, "rlog")
+    with open(fn, "wb") as f:
+      f.write(dat[:-8])
+
+    with self.assertRaises(Exception):
+      list(LogReader(fn, stream=True))
+
+  def test_complete_messages_length(self):
+    msgs = [ent.to_bytes() for ent in make_events([1, 2])]
+    dat = b"".join(msgs)
+
+    self.assertEqual(complete_messages_length(dat), len(dat))
+    self.assertEqual(complete_messages_length(dat[:-1]), len(msgs[0]))
+    self.assertEqual(complete_messages_length(dat[:3]), 0)
+    self.assertEqual(complete_messages_length(dat, len(msgs[0])), len(msgs[1]))
+
+  def test_log_index(self):
+    services = ("carState", "controlsState", "gpsLocationExternal")
+    dat = b"".join(ent.to_bytes() for ent in make_events(range(10), services))
+
+    index = LogIndex.from_bytes(dat)
+
+    self.assertEqual(len(index), 10)
+    self.assertEqual(index.data_length, len(dat))
+    self.assertEqual(index.mono_times.tolist(), list(range(10)))
+    self.assertEqual([index.service_names[s] for s in index.services], [services[i % 3] for i in range(10)])
+    self.assertEqual(index.select(["gpsLocationExternal", "carState"]).tolist(), [0, 2, 3, 5, 6, 8, 9])
+
+  def test_services_filter(self):
+    fn = self.write_log("rlog.bz2", range(100), services=("carState", "controlsState", "gpsLocationExternal"))
+
+    with mock.patch.object(LogIndex, "from_bytes", wraps=LogIndex.from_bytes) as build_index:
+      for stream in [False, True]:
+        lr = LogReader(fn, services=["carState", "gpsLocationExternal"], stream=stream)
+        ents = list(lr)
+        self.assertEqual([ent.logMonoTime for ent in ents], [t for t in range(100) if t % 3 != 1])
+        self.assertTrue(all(ent.which() in ["carState", "gpsLocationExternal"] for ent in ents))
+        self.assertAlmostEqual(ents[-1].carState.vEgo, 99 / 1e9)
+
+      # the index is built once and cached
+      self.assertTrue(os.path.exists(log_index_path(fn)))
+      self.assertEqual([ent.logMonoTime for ent in LogReader(fn, services=["controlsState"])], list(range(1, 100, 3)))
+      self.assertEqual(build_index.call_count, 1)
+
+  def test_stale_index_is_rebuilt(self):
+    fn = self.write_log("rlog.bz2", range(10))
+    LogReader(fn, services=["carState"])
+    fn = self.write_log("rlog.bz2", range(20))
+
+    self.assertEqual(len(LogReader(fn, services=["carState"])._ents), 20)
+    self.assertEqual(len(LogIndex.load(log_index_path(fn))), 20)
+
+  def test_multi_log_iterator_seek(self):
+    step = int(1e9)
+    paths = [self.write_log(f"{i}.bz2", range(i * 60 * step, (i + 1) * 60 * step, step),
+                            services=("carState", "controlsState")) for i in range(3)]
+
+    for services in [None, ["carState"]]:
+      lr = MultiLogIterator(paths, services=services)
+      self.assertTrue(lr.seek(90.5))
+      ent = next(lr)
+      self.assertEqual(ent.logMonoTime, 92 * step if services else 91 * step)
+      self.assertFalse(lr.seek(200))
+
+  def test_multi_log_iterator_empty_segments(self):
+    # the first and third segments have none of the services
+    paths = [self.write_log(f"{i}.bz2", range(i * 10, (i + 1) * 10), services=services) for i, services in
+             enumerate([("controlsState",), ("carState", "controlsState"), ("controlsState",), ("carState",)])]
+
+    lr = MultiLogIterator(paths, services=["carState"])
+    self.assertEqual(lr.start_time, 10)
+    self.assertEqual(lr.tell(), 0)
+    self.assertEqual([ent.logMonoTime for ent in lr], [10, 12, 14, 16, 18] + list(range(30, 40)))
+
+    lr = MultiLogIterator(paths, wraparound=True, services=["carState"])
+    self.assertEqual([next(lr).logMonoTime for _ in range(16)], [10, 12, 14, 16, 18] + list(range(30, 40)) + [10])
+
+    self.assertEqual(list(MultiLogIterator(paths[:1], services=["carState"])), [])
+
+  def test_parallel_merges_in_mono_time_order(self):
+    # segments overlap at their edges and are not sorted internally
+    segments = [[5, 1, 2, 8, 10], [9, 12, 11, 20], [], [15, 30, 25]]
+    paths = [self.write_log(f"{i}.bz2", mono_times) for i, mono_times in enumerate(segments)]
+    paths.insert(1, None)
+
+    ents = list(ParallelLogReader(paths, workers=2))
+
+    self.assertEqual([ent.logMonoTime for ent in ents], sorted(t for mono_times in segments for t in mono_times))
+    self.assertAlmostEqual(ents[-1].carState.vEgo, 30 / 1e9)
+
+  def test_parallel_no_logs(self):
+    self.assertEqual(list(ParallelLogReader([None])), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from tools.lib import url_file
+from tools.lib.url_file import URLFile
+
+CHUNK_SIZE = 1000
+DATA = os.urandom(10 * CHUNK_SIZE + 123)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+  delay = 0.
+  requests = []
+  active = 0
+  max_active = 0
+  lock = threading.Lock()
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(DATA)))
+    self.end_headers()
+
+  def do_GET(self):
+    cls = RangeRequestHandler
+    with cls.lock:
+      cls.active += 1
+      cls.max_active = max(cls.max_active, cls.active)
+    try:
+      time.sleep(cls.delay)
+      m = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+      with cls.lock:
+        cls.requests.append(self.headers.get("Range"))
+      if m is None:
+        self.send_response(200)
+        body = DATA
+      else:
+        start, end = int(m.group(1)), int(m.group(2))
+        self.send_response(206)
+        body = DATA[start:end + 1]
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    finally:
+      with cls.lock:
+        cls.active -= 1
+
+
+class TestURLFile(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/rlog.bz2"
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    for name, value in [("CACHE_DIR", self.cache_dir), ("CHUNK_SIZE", CHUNK_SIZE), ("READAHEAD_CHUNKS", 2)]:
+      patcher = mock.patch.object(url_file, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    RangeRequestHandler.delay = 0.
+    RangeRequestHandler.requests = []
+    RangeRequestHandler.max_active = 0
+
+  def tearDown(self):
+    self.wait_downloads()
+    shutil.rmtree(self.cache_dir)
+
+  def wait_downloads(self):
+    for future in list(URLFile._cache_downloads.values()):
+      future.result()
+
+  def test_reads(self):
+    for cache in [True, False]:
+      for start, length in [(0, None), (0, 10), (CHUNK_SIZE - 5, 10), (1500, 3 * CHUNK_SIZE), (len(DATA) - 100, 500)]:
+        with URLFile(self.url, cache=cache) as f:
+          f.seek(start)
+          expected = DATA[start:start + length] if length is not None else DATA[start:]
+          self.assertEqual(f.read(ll=length), expected)
+
+  def test_downloads_chunks_concurrently(self):
+    RangeRequestHandler.delay = 0.2
+    with URLFile(self.url, cache=False) as f:
+      t = time.monotonic()
+      self.assertEqual(f.read(), DATA)
+      elapsed = time.monotonic() - t
+
+    self.assertGreater(RangeRequestHandler.max_active, 1)
+    self.assertLess(elapsed, 11 * RangeRequestHandler.delay / 2)
+
+  def test_cached_chunks_are_not_downloaded_again(self):
+    with URLFile(self.url, cache=True) as f:
+      self.assertEqual(f.read(), DATA)
+    request_count = len(RangeRequestHandler.requests)
+
+    with URLFile(self.url, cache=True) as f:
+      f.seek(2500)
+      self.assertEqual(f.read(ll=5000), DATA[2500:7500])
+    self.assertEqual(len(RangeRequestHandler.requests), request_count)
+
+  def test_readahead_for_sequential_reads(self):
+    with URLFile(self.url, cache=True) as f:
+      f.read(ll=500)
+      self.wait_downloads()
+      self.assertEqual(len(RangeRequestHandler.requests), 1)
+
+      # the second read is sequential, the chunks after the ones read are downloaded ahead
+      f.read(ll=1000)
+      self.wait_downloads()
+      self.assertEqual(sorted(RangeRequestHandler.requests),
+                       sorted(f"bytes={i * CHUNK_SIZE}-{(i + 1) * CHUNK_SIZE - 1}" for i in range(4)))
+
+      request_count = len(RangeRequestHandler.requests)
+      self.assertEqual(f.read(ll=2000), DATA[1500:3500])
+      self.wait_downloads()
+      self.assertEqual(len(RangeRequestHandler.requests), request_count + 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -6,15 +6,35 @@ import tempfile
 import threading
 import urllib.parse
 import pycurl
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from io import BytesIO
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from common.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
+from tools.lib.download_cache import get_download_cache
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
 
 CACHE_DIR = os.environ.get("COMMA_CACHE", "/tmp/comma_download_cache/")
+#  Cached chunks are evicted in least recently used order over this size
+CACHE_MAX_BYTES = int(os.environ.get("COMMA_CACHE_MAX_BYTES", str(10 * 1000 * 1000 * K)))
+
+#  Chunks are downloaded concurrently by a pool of threads shared by all files, each thread keeps its own
+#  curl handle so connections are reused across chunks. Sequential readers get the next chunks downloaded ahead.
+DOWNLOAD_THREADS = int(os.environ.get("URLFILE_DOWNLOAD_THREADS", "8"))
+READAHEAD_CHUNKS = int(os.environ.get("URLFILE_READAHEAD_CHUNKS", "4"))
+
+_download_pool = None
+_download_pool_lock = threading.Lock()
+
+
+def get_download_pool():
+  global _download_pool
+  with _download_pool_lock:
+    if _download_pool is None:
+      _download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS, thread_name_prefix="urlfile")
+    return _download_pool
 
 
 def hash_256(link):
@@ -24,6 +44,9 @@ def hash_256(link):
 
 class URLFile(object):
   _tlocal = threading.local()
+  #  Downloads of cache chunks in progress by cache dir, url hash and chunk, shared by all files so a chunk is only downloaded once
+  _cache_downloads = {}
+  _cache_downloads_lock = threading.Lock()
 
   def __init__(self, url, debug=False, cache=None):
     self._url = url
@@ -36,16 +59,26 @@ class URLFile(object):
     if cache is not None:
       self._force_download = not cache
 
+    self._curl = self._thread_curl()
+    self._downloads = {}  # chunk downloads by chunk index when not caching
+    self._last_read_end = None
+    mkdirs_exists_ok(CACHE_DIR)
+
+  @classmethod
+  def _thread_curl(cls):
     try:
-      self._curl = self._tlocal.curl
+      return cls._tlocal.curl
     except AttributeError:
-      self._curl = self._tlocal.curl = pycurl.Curl()
-    mkdirs_exists_ok(CACHE_DIR)
+      cls._tlocal.curl = pycurl.Curl()
+      return cls._tlocal.curl
 
   def __enter__(self):
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
+    for future in self._downloads.values():
+      future.cancel()
+    self._downloads = {}
     if self._local_file is not None:
       os.remove(self._local_file.name)
       self._local_file.close()
@@ -82,52 +115,80 @@ class URLFile(object):
     return self._length
 
   def read(self, ll=None):
-    if self._force_download:
-      return self.read_aux(ll=ll)
-
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(CACHE_DIR, str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    #  The chunks to download depend on the length, also without the cache. This costs a HEAD request per file
+    #  before the first read, which pays off as soon as the file spans more than one chunk
+    file_end = self.get_length() if ll is None else min(self._pos + ll, self.get_length())
+    if file_begin >= file_end:
+      return b""
+
+    #  Start the downloads of all the chunks of the range at once, plus the following ones for sequential reads
+    first_chunk, last_chunk = file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE
+    chunks = [(idx, self._chunk_download(idx)) for idx in range(first_chunk, last_chunk + 1)]
+    if file_begin == self._last_read_end:
+      chunk_count = (self.get_length() + CHUNK_SIZE - 1) // CHUNK_SIZE
+      for idx in range(last_chunk + 1, min(last_chunk + 1 + READAHEAD_CHUNKS, chunk_count)):
+        self._chunk_download(idx)
+
+    response = []
+    for idx, download in chunks:
+      data = self._chunk_data(idx, download)
+      position = idx * CHUNK_SIZE
+      response.append(data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)])
+
+    #  Keep the last chunk read, it is usually read again by the next small sequential read
+    for idx in [idx for idx in self._downloads if idx < last_chunk]:
+      del self._downloads[idx]
+
+    self._pos = file_end
+    self._last_read_end = file_end
+    return b"".join(response)
+
+  def _cache(self):
+    return get_download_cache(CACHE_DIR, CACHE_MAX_BYTES)
+
+  def _chunk_download(self, idx):
+    """Returns the download of the chunk, starting it if needed. None if the chunk is already cached."""
+    if self._force_download:
+      if idx not in self._downloads:
+        self._downloads[idx] = get_download_pool().submit(self._download_range, idx * CHUNK_SIZE,
+                                                          min((idx + 1) * CHUNK_SIZE, self.get_length()))
+      return self._downloads[idx]
+
+    key = (CACHE_DIR, hash_256(self._url), idx)
+    with self._cache_downloads_lock:
+      download = self._cache_downloads.get(key)
+      if download is None and not self._cache().contains(key[1], idx):
+        download = self._cache_downloads[key] = get_download_pool().submit(self._download_chunk, idx, key)
+      return download
+
+  def _download_chunk(self, idx, key):
+    try:
+      data = self._download_range(idx * CHUNK_SIZE, min((idx + 1) * CHUNK_SIZE, self.get_length()))
+      self._cache().put(key[1], idx, data)
+      return data
+    finally:
+      with self._cache_downloads_lock:
+        self._cache_downloads.pop(key, None)
+
+  def _chunk_data(self, idx, download):
+    if download is not None:
+      return download.result()
+    data = self._cache().get(hash_256(self._url), idx)
+    if data is None:
+      #  Evicted or corrupted since checked
+      return self._chunk_download(idx).result()
+    return data
 
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
-  def read_aux(self, ll=None):
-    download_range = False
-    headers = ["Connection: keep-alive"]
-    if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
-        return b""
-      headers.append(f"Range: bytes={self._pos}-{end}")
-      download_range = True
-
+  def _download_range(self, start, end):
+    #  Runs on the download threads, using the curl handle of the thread
+    if start >= end:
+      return b""
+    headers = ["Connection: keep-alive", f"Range: bytes={start}-{end - 1}"]
     dats = BytesIO()
-    c = self._curl
+    c = self._thread_curl()
+    c.reset()
     c.setopt(pycurl.URL, self._url)
     c.setopt(pycurl.WRITEDATA, dats)
     c.setopt(pycurl.NOSIGNAL, 1)
@@ -136,19 +197,7 @@ class URLFile(object):
     c.setopt(pycurl.FOLLOWLOCATION, True)
 
     if self._debug:
-      print("downloading", self._url)
-
-      def header(x):
-        if b'MISS' in x:
-          print(x.strip())
-
-      c.setopt(pycurl.HEADERFUNCTION, header)
-
-      def test(debug_type, debug_msg):
-       print("  debug(%d): %s" % (debug_type, debug_msg.strip()))
-
-      c.setopt(pycurl.VERBOSE, 1)
-      c.setopt(pycurl.DEBUGFUNCTION, test)
+      print("downloading", self._url, headers)
       t1 = time.time()
 
     c.perform()
@@ -159,16 +208,10 @@ class URLFile(object):
         print("get %s %r %.f slow" % (self._url, headers, t2 - t1))
 
     response_code = c.getinfo(pycurl.RESPONSE_CODE)
-    if response_code == 416:  # Requested Range Not Satisfiable
-      raise Exception(f"Error, range out of bounds {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-    if download_range and response_code != 206:  # Partial Content
+    full_response = response_code == 200 and start == 0 and len(dats.getvalue()) == end  # range was the whole file
+    if response_code != 206 and not full_response:  # Partial Content
       raise Exception(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-    if (not download_range) and response_code != 200:  # OK
-      raise Exception(f"Error {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-
-    ret = dats.getvalue()
-    self._pos += len(ret)
-    return ret
+    return dats.getvalue()
 
   def seek(self, pos):
     self._pos = pos